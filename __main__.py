@@ -8,7 +8,10 @@ def chesschaos_main():
     if version_info < (3, 10):
         raise ValueError('at least python 3.10 is required by this project')
 
+    from logging import INFO, basicConfig
     from menu import Window
+    # The bot logs the numbers of its search with every move.
+    basicConfig(level=INFO, format='%(name)s: %(message)s')
     Window().run()
 
 
@@ -0,0 +1,129 @@
+from numpy import array, dtype, memmap, searchsorted, uint64
+
+from argparse import ArgumentParser
+from os.path import getsize, join, split
+from time import perf_counter
+from typing import Optional
+
+from fileio import open_atomic
+from intchess import Board, Move
+from transposition import encode_move, decode_move
+
+
+__all__ = ['BOOK_PATH', 'OpeningBook', 'build_book', 'book_main']
+
+
+BOOK_PATH = join(split(__file__)[0], 'assets', 'book.bin')
+BOOK_MAGIC = b'CCBOOK01'
+# The file is the magic followed by entries sorted by key, so a lookup is a
+# binary search over the memory-mapped file.
+BOOK_DTYPE = dtype([('key', '<u8'), ('move', '<u2')])
+
+BOOK_DEPTH = 7
+BOOK_PLIES = 1
+
+
+class OpeningBook:
+    def __init__(self, path: str = BOOK_PATH):
+        self.path = path
+        self.entries = None
+        try:
+            with open(path, 'rb') as file:
+                magic = file.read(len(BOOK_MAGIC))
+            if magic == BOOK_MAGIC and getsize(path) > len(BOOK_MAGIC):
+                self.entries = memmap(path, BOOK_DTYPE, 'r', len(BOOK_MAGIC))
+        except OSError:
+            pass
+
+    def __len__(self):
+        return 0 if self.entries is None else len(self.entries)
+
+    def probe(self, board: Board) -> Optional[Move]:
+        if self.entries is None:
+            return None
+        key = uint64(board.zobrist_hash())
+        keys = self.entries['key']
+        index = searchsorted(keys, key)
+        if index == len(keys) or keys[index] != key:
+            return None
+        # A hash collision must not make the bot play an illegal move.
+        move = decode_move(int(self.entries['move'][index]))
+        return move if move is not None and board.is_legal(move) else None
+
+    @staticmethod
+    def write(path: str, moves: dict[int, Move]) -> None:
+        entries = array(sorted((key, encode_move(move)) for key, move in moves.items()),
+                        dtype=BOOK_DTYPE)
+        with open_atomic(path) as file:
+            file.write(BOOK_MAGIC)
+            file.write(entries.tobytes())
+
+
+def _book_position(start: Board, line: list[Move]) -> Board:
+    # The bot is handed a copy of the board the game checks moves with,
+    # which has the line pushed in intchess.
+    board = start.copy()
+    for move in line:
+        board.push(move)
+    return board
+
+
+def build_book(depth: int = BOOK_DEPTH, plies: int = BOOK_PLIES,
+               movetime_ms: Optional[float] = None, verbose: bool = False) -> dict[int, Move]:
+    # Search the reply to every move of the player from the start of every
+    # level, and to every move after that for the given number of plies of
+    # the player.
+    from bot import iterative_search
+    from level import LEVELS, level_board
+    from ordering import MoveOrdering
+    from transposition import TranspositionTable
+
+    moves = {}
+    table = TranspositionTable()
+    ordering = MoveOrdering()
+
+    def expand(start, line, plies):
+        for move in list(_book_position(start, line).legal_moves):
+            position = _book_position(start, line + [move])
+            key = position.zobrist_hash()
+            if key in moves:
+                continue
+            pv = []
+            for _, _, pv in iterative_search(position, depth, table, movetime_ms,
+                                             ordering=ordering):
+                pass
+            if not pv:
+                continue
+            moves[key] = pv[0]
+            if verbose:
+                print(f'  {" ".join(map(str, line + [move]))}: {pv[0]}')
+            if plies > 1:
+                expand(start, line + [move, pv[0]], plies - 1)
+
+    for index, (name, _) in enumerate(LEVELS):
+        if verbose:
+            print(f'level {name}')
+        expand(level_board(index), [], plies)
+    return moves
+
+
+def book_main():
+    parser = ArgumentParser(description='Build the opening book of the bot.')
+    parser.add_argument('-d', '--depth', type=int, default=BOOK_DEPTH,
+                        help='search depth of every book move')
+    parser.add_argument('-p', '--plies', type=int, default=BOOK_PLIES,
+                        help='number of player moves the book covers')
+    parser.add_argument('--movetime', type=float,
+                        help='search time limit of every book move in milliseconds')
+    parser.add_argument('-o', '--output', default=BOOK_PATH, help='book file to write')
+    args = parser.parse_args()
+
+    start = perf_counter()
+    moves = build_book(args.depth, args.plies, args.movetime, verbose=True)
+    OpeningBook.write(args.output, moves)
+    print(f'{len(moves)} positions written to {args.output} '
+          f'in {perf_counter() - start:.0f}s')
+
+
+if __name__ == '__main__':
+    book_main()
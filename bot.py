@@ -1,162 +1,381 @@
-from numchess import *
-from numchess import Board
+import numchess
+from intchess import *
+from intchess import Board
 
-from math import inf
-from numpy import array
+from dataclasses import dataclass
+from logging import getLogger
+from math import inf, nextafter
 from random import choice as random_choice
+from time import perf_counter
+
+from book import OpeningBook
+from evaluation import *
+from ordering import *
+from tablebase import Tablebase
+from transposition import *
 
 
 __all__ = [
-    'eval_board', 'search_openings', 'move_engine']
-
-
-# pawn, knight, bishop, rook, queen, king
-PIECE_VALUES = [1, 3.2, 3.33, 5.1, 8.8, 0]
-PAWN_POS_VALUES = array([
-    [ 0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ],
-    [ 0.05,  0.1 ,  0.1 , -0.2 , -0.2 ,  0.1 ,  0.1 ,  0.05],
-    [ 0.05, -0.05, -0.1 ,  0.0 ,  0.0 , -0.1 , -0.05,  0.05],
-    [ 0.0 ,  0.0 ,  0.0 ,  0.2 ,  0.2 ,  0.0 ,  0.0 ,  0.0 ],
-    [ 0.05,  0.05,  0.1 ,  0.25,  0.25,  0.1 ,  0.05,  0.05],
-    [ 0.1 ,  0.1 ,  0.2 ,  0.3 ,  0.3 ,  0.2 ,  0.1 ,  0.1 ],
-    [ 0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.5 ],
-    [ 0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ],
-]) + 1
-KNIGHT_POS_VALUES = array([
-    [-0.5 , -0.4 , -0.3 , -0.3 , -0.3 , -0.3 , -0.4 , -0.5 ],
-    [-0.4 , -0.2 ,  0.0 ,  0.05,  0.05,  0.0 , -0.2 , -0.4 ],
-    [-0.3 ,  0.05,  0.1 ,  0.15,  0.15,  0.1 ,  0.05, -0.3 ],
-    [-0.3 ,  0.0 ,  0.15,  0.2 ,  0.2 ,  0.15,  0.0 , -0.3 ],
-    [-0.3 ,  0.05,  0.15,  0.2 ,  0.2 ,  0.15,  0.05, -0.3 ],
-    [-0.3 ,  0.0 ,  0.1 ,  0.15,  0.15,  0.1 ,  0.0 , -0.3 ],
-    [-0.4 , -0.2 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.2 , -0.4 ],
-    [-0.5 , -0.4 , -0.3 , -0.3 , -0.3 , -0.3 , -0.4 , -0.5 ],
-]) + 3.2
-BISHOP_POS_VALUES = array([
-    [-0.2 , -0.1 , -0.1 , -0.1 , -0.1 , -0.1 , -0.1 , -0.2 ],
-    [-0.1 ,  0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.05, -0.1 ],
-    [-0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.1 , -0.1 ],
-    [-0.1 ,  0.0 ,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.0 , -0.1 ],
-    [-0.1 ,  0.05,  0.05,  0.1 ,  0.1 ,  0.05,  0.05, -0.1 ],
-    [-0.1 ,  0.0 ,  0.05,  0.1 ,  0.1 ,  0.05,  0.0 , -0.1 ],
-    [-0.1 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.1 ],
-    [-0.2 , -0.1 , -0.1 , -0.1 , -0.1 , -0.1 , -0.1 , -0.2 ],
-]) + 3.33
-ROOK_POS_VALUES = array([
-    [ 0.0 ,  0.0 ,  0.0 ,  0.05,  0.05,  0.0 ,  0.0 ,  0.0 ],
-    [-0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.05],
-    [-0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.05],
-    [-0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.05],
-    [-0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.05],
-    [-0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.05],
-    [ 0.05,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.05],
-    [ 0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ],
-]) + 5.1
-QUEEN_POS_VALUES = array([
-    [-0.2 , -0.1 , -0.1 , -0.05, -0.05, -0.1 , -0.1 , -0.2 ],
-    [-0.1 ,  0.0 ,  0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.1 ],
-    [-0.1 ,  0.05,  0.05,  0.05,  0.05,  0.05,  0.0 , -0.1 ],
-    [ 0.0 ,  0.0 ,  0.05,  0.05,  0.05,  0.05,  0.0 , -0.05],
-    [-0.05,  0.0 ,  0.05,  0.05,  0.05,  0.05,  0.0 , -0.05],
-    [-0.1 ,  0.0 ,  0.05,  0.05,  0.05,  0.05,  0.0 , -0.1 ],
-    [-0.1 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.1 ],
-    [-0.2 , -0.1 , -0.1 , -0.05, -0.05, -0.1 , -0.1 , -0.2 ],
-]) + 8.8
-KING_POS_VALUES = array([
-    [ 0.2 ,  0.3 ,  0.1 ,  0.0 ,  0.0 ,  0.1 ,  0.3 ,  0.2 ],
-    [ 0.2 ,  0.2 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.2 ,  0.2 ],
-    [-0.1 , -0.2 , -0.2 , -0.2 , -0.2 , -0.2 , -0.2 , -0.1 ],
-    [-0.2 , -0.3 , -0.3 , -0.4 , -0.4 , -0.3 , -0.3 , -0.2 ],
-    [-0.3 , -0.4 , -0.4 , -0.5 , -0.5 , -0.4 , -0.4 , -0.3 ],
-    [-0.3 , -0.4 , -0.4 , -0.5 , -0.5 , -0.4 , -0.4 , -0.3 ],
-    [-0.3 , -0.4 , -0.4 , -0.5 , -0.5 , -0.4 , -0.4 , -0.3 ],
-    [-0.3 , -0.4 , -0.4 , -0.5 , -0.5 , -0.4 , -0.4 , -0.3 ],
-])
-
-_POS_VALUES = [PAWN_POS_VALUES, KNIGHT_POS_VALUES, BISHOP_POS_VALUES,
-               ROOK_POS_VALUES, QUEEN_POS_VALUES, KING_POS_VALUES]
-POS_VALUES = [
-    [VALUES[::-1, :] for VALUES in _POS_VALUES],
-    _POS_VALUES,
-]
+    'MAX_DEPTH', 'eval_board', 'search_openings', 'SearchStats', 'Search',
+    'iterative_search', 'move_engine']
 
 
-# Stockfish does 70m/s
-def eval_board(board):  # 25k/s
-    if board.is_checkmate():
-        return -inf if board.turn else inf
-    elif board.is_game_over():
-        return 0
+logger = getLogger(__name__)
 
-    weight = 0
+MAX_DEPTH = 64
+# Captures are searched as long as they can win back this much more than the
+# material they take.
+DELTA_MARGIN = 2
+# Null moves are searched this much shallower than real ones.
+NULL_MOVE_REDUCTION = 2
+# Quiet moves after the first few are searched a ply shallower at first.
+LMR_DEPTH = 3
+LMR_MOVES = 3
+# Half the width of the first window around the value of the last iteration.
+ASPIRATION_WINDOW = 0.5
+# Re-searches of an iteration before its window is opened fully.
+ASPIRATION_RESEARCHES = 3
 
-    occupied = board.occupied_co[WHITE]
-    values = POS_VALUES[WHITE]
-    weight += ((board.pawns & occupied) * values[PAWN]).sum()
-    weight += ((board.knights & occupied) * values[KNIGHT]).sum()
-    weight += ((board.bishops & occupied) * values[BISHOP]).sum()
-    weight += ((board.rooks & occupied) * values[ROOK]).sum()
-    weight += ((board.queens & occupied) * values[QUEEN]).sum()
-    weight += ((board.kings & occupied) * values[KING]).sum()
 
-    occupied = board.occupied_co[BLACK]
-    values = POS_VALUES[BLACK]
-    weight -= ((board.pawns & occupied) * values[PAWN]).sum()
-    weight -= ((board.knights & occupied) * values[KNIGHT]).sum()
-    weight -= ((board.bishops & occupied) * values[BISHOP]).sum()
-    weight -= ((board.rooks & occupied) * values[ROOK]).sum()
-    weight -= ((board.queens & occupied) * values[QUEEN]).sum()
-    weight -= ((board.kings & occupied) * values[KING]).sum()
+class SearchTimeout(Exception):
+    pass
 
-    return weight
+
+def _outcome_value(outcome):
+    if outcome.winner is None:
+        return 0
+    return inf if outcome.winner else -inf
+
+
+# Stockfish does 70m/s
+def eval_board(board):
+    outcome = board.outcome()
+    if outcome is not None:
+        return _outcome_value(outcome)
+    # Material and piece-square values are kept up to date by push and pop.
+    return board.score
 
 
 def cmp(a, b):  # 410k/s
     return (a > b) - (a < b)
 
 
-def gen_moves(board):
-    return sorted(list(board.legal_moves), key=lambda move: (
-        -(move.promotion is not None),
-        ~(BB_SQUARES[SQUARES.index(move.to_square)] & board.occupied).any(),
-        ~(BB_SQUARES[SQUARES.index(move.to_square)] & board.pawns).any(),
-    ))
+def gen_moves(board, hash_move=None, ordering=None, ply=0, moves=None):
+    # Lazily, so a cutoff on an early move skips generating the rest.
+    if ordering is None:
+        staged = board.generate_staged_moves(hash_move)
+    else:
+        staged = board.generate_staged_moves(hash_move, ordering.killer_moves(ply),
+                                             ordering.quiet_key(board))
+    if moves is None:
+        return staged
+    return (move for move in staged if move in moves)
 
 
-def move_search(board, depth, alpha=-inf, beta=inf):
-    if depth == 0 or board.is_game_over():
-        return eval_board(board), None
-    best_move = None
-    if board.turn:
-        value = -inf
-        for move in gen_moves(board):
+def capture_gain(board, move):
+    victim = board.piece_type_at(move.to_square)
+    gain = PIECE_VALUES[PAWN if victim is None else victim]
+    if move.promotion:
+        gain += PIECE_VALUES[move.promotion] - PIECE_VALUES[PAWN]
+    return gain
+
+
+@dataclass
+class SearchStats:
+    nodes: int = 0
+    qnodes: int = 0
+    tt_hits: int = 0
+    cutoffs: int = 0
+    first_move_cutoffs: int = 0
+    depth: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def first_move_cutoff_rate(self) -> float:
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    @property
+    def nps(self) -> float:
+        return (self.nodes + self.qnodes) / self.elapsed if self.elapsed else 0.0
+
+    def merge(self, other: 'SearchStats') -> None:
+        # Counts of searches that ran side by side add up, the depth and time
+        # are those of the longest one.
+        self.nodes += other.nodes
+        self.qnodes += other.qnodes
+        self.tt_hits += other.tt_hits
+        self.cutoffs += other.cutoffs
+        self.first_move_cutoffs += other.first_move_cutoffs
+        self.depth = max(self.depth, other.depth)
+        self.elapsed = max(self.elapsed, other.elapsed)
+
+    def __str__(self):
+        return (f'depth {self.depth}, {self.nodes} nodes, {self.qnodes} qnodes, '
+                f'{self.tt_hits} tt hits, {self.cutoffs} cutoffs '
+                f'({self.first_move_cutoff_rate:.0%} on the first move), '
+                f'{self.elapsed:.2f}s, {self.nps:.0f} nps')
+
+
+# Negamax: values are from the side to move, which tries to maximize them.
+class Search:
+    def __init__(self, table=None, ordering=None, deadline=None, stop=None,
+                 null_move=True, reductions=True, stats=None):
+        self.table = table
+        self.ordering = ordering
+        self.deadline = deadline
+        self.stop = stop
+        self.null_move = null_move
+        self.reductions = reductions
+        self.stats = SearchStats() if stats is None else stats
+
+    def check_time(self):
+        if (self.deadline is not None and perf_counter() > self.deadline or
+                self.stop is not None and self.stop.is_set()):
+            raise SearchTimeout
+
+    def quiescence(self, board, alpha=-inf, beta=inf):
+        # Resolve captures and promotions before trusting the score. The side
+        # to move may also stand pat instead, and captures that can not lift
+        # the score to alpha are pruned.
+        self.check_time()
+        self.stats.qnodes += 1
+        stand_pat = board.score if board.turn else -board.score
+        if stand_pat >= beta:
+            return stand_pat
+
+        value = stand_pat
+        alpha = max(alpha, stand_pat)
+        for move in board.tactical_moves():
+            if stand_pat + capture_gain(board, move) + DELTA_MARGIN <= alpha:
+                continue
             board.push(move)
-            result, _ = move_search(board, depth - 1, alpha, beta)
+            result = -self.quiescence(board, -beta, -alpha)
             board.pop()
-            value = max(value, result)
-            if value >= beta:
-                break
+            if result > value:
+                value = result
             if value > alpha:
                 alpha = value
-                best_move = move
-        return value, best_move
-    else:
-        value = inf
-        for move in gen_moves(board):
+            if alpha >= beta:
+                break
+        return value
+
+    def negamax(self, board, depth, alpha=-inf, beta=inf, ply=0, moves=None):
+        # The value and principal variation of the position. With moves
+        # given, only those are searched at this node, so its result is not
+        # one for the whole position and is kept out of the table.
+        self.check_time()
+        # Mate and stalemate show as a node without moves, so only a leaf,
+        # which generates none, asks for them up front. So do the rare nodes
+        # the seventy-five move rule may end, as mate comes first there.
+        if depth == 0 or board.halfmove_clock >= 150:
+            outcome = board.outcome()
+            if outcome is not None:
+                return (0 if outcome.winner is None else
+                        inf if outcome.winner == board.turn else -inf), []
+        elif board.is_fivefold_repetition():
+            return 0, []
+        if depth == 0:
+            return self.quiescence(board, alpha, beta), []
+        self.stats.nodes += 1
+
+        table = self.table
+        hash_move = None
+        if table is not None:
+            key = board.zobrist_hash()
+            entry = table.probe(key)
+            if entry is not None:
+                self.stats.tt_hits += 1
+                entry_depth, score, bound, hash_move = entry
+                if moves is None and entry_depth >= depth and (
+                        bound == BOUND_EXACT or
+                        bound == BOUND_LOWER and score >= beta or
+                        bound == BOUND_UPPER and score <= alpha):
+                    return score, [] if hash_move is None else [hash_move]
+        alpha_orig = alpha
+
+        def child(depth, alpha, beta):
+            value, pv = self.negamax(board, depth, -beta, -alpha, ply + 1)
+            return -value, pv
+
+        in_check = board.is_check()
+        if (self.null_move and ply and depth > NULL_MOVE_REDUCTION and not in_check and
+                board.move_stack and board.move_stack[-1] and
+                board.occupied_co[board.turn] & ~(board.pawns | board.kings) and
+                (board.score if board.turn else -board.score) >= beta and
+                board.has_legal_moves()):
+            # If passing still fails high, a real move will too. Not done
+            # with only pawns left, where having to move is often the problem,
+            # nor in stalemate, where passing is no way out of the draw.
+            board.push(Move.null())
+            result, _ = child(depth - 1 - NULL_MOVE_REDUCTION, nextafter(beta, -inf), beta)
+            board.pop()
+            if result >= beta:
+                return beta, []
+
+        # Quiet moves late in the order are unlikely to be best. They get a
+        # shallower search first and only a full one if they beat the window.
+        reduce = self.reductions and depth >= LMR_DEPTH and not in_check
+
+        # After the first move, the others only have to be shown to be no
+        # better, which a zero window does cheaper. One that is better gets a
+        # second search with the full window for its value.
+        value = -inf
+        pv = []
+        index = -1
+        for index, move in enumerate(gen_moves(board, hash_move, self.ordering, ply, moves)):
+            late = (reduce and index >= LMR_MOVES and not move.promotion and
+                    not board.is_capture(move))
             board.push(move)
-            result, _ = move_search(board, depth - 1, alpha, beta)
+            if index == 0:
+                result, child_pv = child(depth - 1, alpha, beta)
+            else:
+                zero_beta = nextafter(alpha, inf)
+                if late and not board.is_check():
+                    result, child_pv = child(depth - 2, alpha, zero_beta)
+                else:
+                    result = inf
+                if result > alpha:
+                    result, child_pv = child(depth - 1, alpha, zero_beta)
+                if alpha < result < beta:
+                    result, child_pv = child(depth - 1, alpha, beta)
             board.pop()
-            value = min(value, result)
-            if value <= alpha:
+            if result > value:
+                value = result
+                pv = [move] + child_pv
+            if value > alpha:
+                alpha = value
+            if alpha >= beta:
+                self.stats.cutoffs += 1
+                if index == 0:
+                    self.stats.first_move_cutoffs += 1
+                if self.ordering is not None:
+                    self.ordering.cutoff(board, move, ply, depth)
                 break
-            if value < beta:
-                beta = value
-                best_move = move
-        return value, best_move
 
+        if index < 0 and moves is None:
+            return (-inf if in_check else 0), []
+
+        if table is not None and moves is None:
+            if value <= alpha_orig:
+                bound = BOUND_UPPER
+            elif value >= beta:
+                bound = BOUND_LOWER
+            else:
+                bound = BOUND_EXACT
+            table.store(key, depth, value, bound, pv[0] if pv else None)
+
+        return value, pv
+
+
+transposition_table = TranspositionTable()
+move_ordering = MoveOrdering()
+opening_book = OpeningBook()
+endgame_tablebase = Tablebase()
+
+
+def search_openings(board, book=opening_book):
+    # The book move of the position, or None if it is not in the book.
+    return None if book is None else book.probe(board)
+
+
+def search_endgames(board, tablebase=endgame_tablebase):
+    # The move that mates fastest, holds the draw or lasts longest, or None
+    # if the position is in no table.
+    return None if tablebase is None else tablebase.best_move(board)
+
+
+def iterative_search(board, depth, table=transposition_table, movetime_ms=None,
+                     stop=None, ordering=move_ordering, null_move=True,
+                     reductions=True, moves=None, stats=None):
+    # Deepen one ply at a time, yielding the depth, value from white's side
+    # and principal variation of every completed iteration. Each iteration
+    # leaves its best moves in the table to be searched first by the next
+    # one. The numbers of the search are added to stats if given.
+    if table is not None:
+        table.new_search()
+    if ordering is not None:
+        ordering.new_search()
+    start = perf_counter()
+    deadline = None if movetime_ms is None else start + movetime_ms / 1000
+    search = Search(table, ordering, None, stop, null_move, reductions, stats)
+    color = 1 if board.turn else -1
+
+    ply = len(board.move_stack)
+    value = None
+    for current_depth in range(1, depth + 1):
+        # The value is expected close to the one of the last iteration. The
+        # window is widened on the side it fails on, and opened on that side
+        # if it fails there again or on a mate, which no width would hold.
+        if value is None or value in {inf, -inf}:
+            lower = upper = inf
+        else:
+            lower = upper = ASPIRATION_WINDOW
+        search.deadline = None if current_depth == 1 else deadline
+        try:
+            researches = 0
+            while True:
+                alpha = -inf if value is None else value - lower
+                beta = inf if value is None else value + upper
+                result, pv = search.negamax(board, current_depth, alpha, beta, moves=moves)
+                if result <= alpha and alpha != -inf:
+                    lower = inf if result == -inf or lower != ASPIRATION_WINDOW else lower * 4
+                elif result >= beta and beta != inf:
+                    upper = inf if result == inf or upper != ASPIRATION_WINDOW else upper * 4
+                else:
+                    break
+                researches += 1
+                if researches >= ASPIRATION_RESEARCHES:
+                    lower = upper = inf
+        except SearchTimeout:
+            while len(board.move_stack) > ply:
+                board.pop()
+            search.stats.elapsed = perf_counter() - start
+            return
+        value = result
+        search.stats.depth = current_depth
+        search.stats.elapsed = perf_counter() - start
+        yield current_depth, color * value, pv
+        if value in {inf, -inf} or deadline is not None and perf_counter() > deadline:
+            return
+
+
+def move_engine(board: Board, /, depth=3, table=transposition_table,
+                movetime_ms=None, stop=None, ordering=move_ordering,
+                null_move=True, reductions=True, pool=None, stats=None,
+                book=opening_book, tablebase=endgame_tablebase):
+    # The numbers of the search are logged, and added to stats if given.
+    if isinstance(board, numchess.Board):
+        # Search on the bitboard backend, answer in the caller's terms.
+        return move_engine(Board.from_numchess(board), depth, table,
+                           movetime_ms, stop, ordering, null_move,
+                           reductions, pool, stats, book, tablebase).to_numchess()
+
+    move = search_openings(board, book)
+    if move is not None:
+        logger.info('%s: from the opening book', move)
+        return move
+    move = search_endgames(board, tablebase)
+    if move is not None:
+        logger.info('%s: from the endgame tablebase', move)
+        return move
+
+    if stats is None:
+        stats = SearchStats()
+    if pool is not None:
+        # The root moves are split between the worker processes of the pool.
+        result = pool.search(board, depth, movetime_ms, stop, null_move,
+                             reductions, stats)
+        if result is not None:
+            move = result[1][0]
+    else:
+        # The best move of the last completed iteration is played.
+        for _, _, pv in iterative_search(board, depth, table, movetime_ms, stop,
+                                         ordering, null_move, reductions,
+                                         stats=stats):
+            if pv:
+                move = pv[0]
 
-def move_engine(board: Board, /, depth=3):
-    move = move_search(board, depth)[1]
     if move is None:
         move = random_choice([move for move in board.legal_moves])
+    logger.info('%s: %s', move, stats)
     return move
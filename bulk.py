@@ -0,0 +1,320 @@
+from numpy import (argsort, array, concatenate, full, int8, int32, int64, ndarray,
+                   nonzero, packbits, repeat, uint8, uint64, unpackbits, where, zeros)
+
+from typing import Iterable
+
+from abilities import *
+from intchess import (
+    Board, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
+    BB_FILE_A, BB_FILE_B, BB_FILE_G, BB_FILE_H,
+    BB_RANK_1, BB_RANK_2, BB_RANK_3, BB_RANK_4, BB_RANK_5, BB_RANK_6, BB_RANK_7, BB_RANK_8,
+    BB_BACKRANKS, BB_KING_ATTACKS, BB_KNIGHT_ATTACKS, BB_PAWN_ATTACKS, between)
+
+
+__all__ = ['BoardArray']
+
+
+# The move tables of intchess as arrays to gather from by square.
+KING_ATTACKS = array(BB_KING_ATTACKS, uint64)
+KNIGHT_ATTACKS = array(BB_KNIGHT_ATTACKS, uint64)
+PAWN_ATTACKS = array(BB_PAWN_ATTACKS, uint64)
+BETWEEN = array([[between(a, b) for b in range(64)] for a in range(64)], uint64)
+SQUARE_BITS = array([1 << square for square in range(64)], uint64)
+
+# Line directions as (shift, squares a step may land on). Sliders and riders
+# are filled along them, their occupancy tables can not be gathered.
+NOT_A = ~BB_FILE_A & 0xffff_ffff_ffff_ffff
+NOT_H = ~BB_FILE_H & 0xffff_ffff_ffff_ffff
+NOT_AB = ~(BB_FILE_A | BB_FILE_B) & 0xffff_ffff_ffff_ffff
+NOT_GH = ~(BB_FILE_G | BB_FILE_H) & 0xffff_ffff_ffff_ffff
+ALL = 0xffff_ffff_ffff_ffff
+ORTH_LINES = [(8, ALL), (-8, ALL), (1, NOT_A), (-1, NOT_H)]
+DIAG_LINES = [(9, NOT_A), (7, NOT_H), (-7, NOT_A), (-9, NOT_H)]
+RIDER_LINES = [(17, NOT_A), (15, NOT_H), (10, NOT_AB), (6, NOT_GH),
+               (-6, NOT_AB), (-10, NOT_GH), (-15, NOT_A), (-17, NOT_H)]
+
+PROMOTIONS = array([QUEEN, ROOK, BISHOP, KNIGHT], int8)
+# Eagle pawns may also stay pawns on the rank before the last.
+EAGLE_PROMOTIONS = array([QUEEN, ROOK, BISHOP, KNIGHT, 0], int8)
+
+
+def _shift(bb: ndarray, shift: int) -> ndarray:
+    return bb << uint64(shift) if shift > 0 else bb >> uint64(-shift)
+
+
+def _line_attacks(sources: ndarray, occupied: ndarray, lines) -> ndarray:
+    # Kogge-Stone fill of every line from the sources up to the first
+    # occupied square, which is attacked too.
+    attacks = zeros(sources.shape, uint64)
+    for shift, mask in lines:
+        mask = uint64(mask)
+        propagators = ~occupied & mask
+        generators = sources
+        generators = generators | propagators & _shift(generators, shift)
+        propagators = propagators & _shift(propagators, shift)
+        generators = generators | propagators & _shift(generators, 2 * shift)
+        propagators = propagators & _shift(propagators, 2 * shift)
+        generators = generators | propagators & _shift(generators, 4 * shift)
+        attacks |= _shift(generators, shift) & mask
+    return attacks
+
+
+def _mask(squares: ndarray) -> ndarray:
+    # (N, 64) bools to N bitboards.
+    return packbits(squares, axis=-1, bitorder='little').view('<u8')[:, 0].astype(uint64)
+
+
+def _squares(bitboards: ndarray) -> tuple[ndarray, ndarray]:
+    # The rows and squares of every set bit.
+    bits = unpackbits(bitboards.astype('<u8').view(uint8).reshape((len(bitboards), 8)),
+                      axis=-1, bitorder='little')
+    return nonzero(bits)
+
+
+def _bits(bitboards: ndarray, squares: ndarray) -> ndarray:
+    return (bitboards & SQUARE_BITS[squares]) != 0
+
+
+# Many positions at once as arrays, for move generation in bulk. Every
+# position is a row: the bitboards in the order of Board.bitboards, the
+# abilities by square, the side to move, the en passant square or -1, and
+# the castling rights.
+class BoardArray:
+    def __init__(self, bitboards: ndarray, abilities: ndarray, turn: ndarray,
+                 ep_square: ndarray, castling_rights: ndarray):
+        self.bitboards = bitboards
+        self.abilities = abilities
+        self.turn = turn
+        self.ep_square = ep_square
+        self.castling_rights = castling_rights
+
+        white = bitboards[:, :6]
+        black = bitboards[:, 6:]
+        self.white = white[:, 0] | white[:, 1] | white[:, 2] | white[:, 3] | white[:, 4] | white[:, 5]
+        self.black = black[:, 0] | black[:, 1] | black[:, 2] | black[:, 3] | black[:, 4] | black[:, 5]
+        self.occupied = self.white | self.black
+        self.pieces = [white[:, piece_type] | black[:, piece_type] for piece_type in range(6)]
+        self.us = where(turn, self.white, self.black)
+        self.them = where(turn, self.black, self.white)
+
+        def ability(flag):
+            return _mask((abilities & flag) != 0)
+
+        pawns, knights, bishops, rooks, queens, kings = self.pieces
+        riders = ability(B_RIDER)
+        self.kinglike = kings | ability(B_SNEAKER)
+        self.knightlike = (knights | ability(B_LEAPER)) & ~riders
+        self.riders = riders
+        self.diagonal = bishops | queens | ability(B_SHIFTY)
+        self.orthogonal = rooks | queens | ability(B_RUTHLESS)
+        self.expendable = ability(B_EXPENDABLE)
+        self.pacifists = ability(B_PACIFIST)
+        self.eagles = ability(B_EAGLE) & pawns
+        self.stubborn = ability(B_STUBBORN | B_GHOST) & kings
+
+        our_kings = kings & self.us
+        self.king = full(len(turn), -1, int32)
+        rows, squares = _squares(our_kings)
+        # The last king is the one intchess looks at.
+        self.king[rows] = squares
+
+    @classmethod
+    def from_boards(cls, boards: Iterable[Board]) -> 'BoardArray':
+        boards = list(boards)
+        abilities = zeros((len(boards), 64), int64)
+        for row, board in enumerate(boards):
+            for square, flags in board.abilities.items():
+                abilities[row, square] = flags
+        return cls(array([board.bitboards() for board in boards], uint64).reshape((-1, 12)),
+                   abilities,
+                   array([board.turn for board in boards], bool),
+                   array([-1 if board.ep_square is None else board.ep_square
+                          for board in boards], int8),
+                   array([board.clean_castling_rights() for board in boards], uint64))
+
+    def __len__(self):
+        return len(self.turn)
+
+    def attacks(self) -> ndarray:
+        # The squares the side to move attacks in every position.
+        occupied = self.occupied
+        pawns = self.pieces[PAWN] & self.us
+        # Pawns only ever attack like pawns.
+        us = self.us & ~pawns
+        pawn_attacks = where(
+            self.turn,
+            _shift(pawns & uint64(NOT_H), 9) | _shift(pawns & uint64(NOT_A), 7),
+            _shift(pawns & uint64(NOT_A), -9) | _shift(pawns & uint64(NOT_H), -7))
+        return (pawn_attacks |
+                _line_attacks(self.kinglike & us, ~uint64(0), ORTH_LINES + DIAG_LINES) |
+                _line_attacks(self.knightlike & us, ~uint64(0), RIDER_LINES) |
+                _line_attacks(self.riders & us, occupied, RIDER_LINES) |
+                _line_attacks(self.diagonal & us, occupied, DIAG_LINES) |
+                _line_attacks(self.orthogonal & us, occupied, ORTH_LINES))
+
+    def _attacked(self, rows: ndarray, squares: ndarray, occupied: ndarray,
+                  removed: ndarray) -> ndarray:
+        # Whether the side not to move attacks the squares with the given
+        # occupancy, without the pieces removed.
+        them = self.them[rows] & ~removed
+        sources = SQUARE_BITS[squares]
+        attackers = (
+            KING_ATTACKS[squares] & self.kinglike[rows] |
+            KNIGHT_ATTACKS[squares] & self.knightlike[rows] |
+            PAWN_ATTACKS[self.turn[rows].astype(int8), squares] & self.pieces[PAWN][rows] |
+            _line_attacks(sources, occupied, DIAG_LINES) & self.diagonal[rows] |
+            _line_attacks(sources, occupied, ORTH_LINES) & self.orthogonal[rows] |
+            _line_attacks(sources, occupied, RIDER_LINES) & self.riders[rows])
+        return (attackers & them) != 0
+
+    def _piece_moves(self) -> tuple[ndarray, ndarray, ndarray]:
+        rows, squares = _squares(self.us & ~self.pieces[PAWN])
+        sources = SQUARE_BITS[squares]
+        occupied = self.occupied[rows]
+
+        def has(mask):
+            return _bits(mask[rows], squares)
+
+        attacks = (
+            where(has(self.kinglike), KING_ATTACKS[squares], uint64(0)) |
+            where(has(self.riders), _line_attacks(sources, occupied, RIDER_LINES),
+                  where(has(self.knightlike), KNIGHT_ATTACKS[squares], uint64(0))) |
+            _line_attacks(where(has(self.diagonal), sources, uint64(0)), occupied, DIAG_LINES) |
+            _line_attacks(where(has(self.orthogonal), sources, uint64(0)), occupied, ORTH_LINES))
+        attacks &= ~(self.us[rows] & ~self.expendable[rows])
+
+        moves, to_squares = _squares(attacks)
+        return rows[moves], squares[moves], to_squares
+
+    def _pawn_moves(self) -> tuple[ndarray, ndarray, ndarray, ndarray]:
+        turn = self.turn
+        pawns = self.pieces[PAWN] & self.us
+        empty = ~self.occupied
+        pacifists = self.pacifists & self.pieces[PAWN]
+        their_pawns = self.pieces[PAWN] & self.them
+
+        # Captures, pacifist pawns never take or get taken by enemy pawns.
+        rows, squares = _squares(pawns)
+        targets = PAWN_ATTACKS[turn[rows].astype(int8), squares] & (self.them | self.expendable)[rows]
+        targets &= where(_bits(pacifists[rows], squares), ~their_pawns[rows],
+                         ~(their_pawns & pacifists)[rows])
+        captures, capture_to = _squares(targets)
+        capture_rows, capture_from = rows[captures], squares[captures]
+
+        # Advances.
+        single = where(turn, _shift(pawns, 8), _shift(pawns, -8)) & empty
+        double = where(turn, _shift(single, 8) & uint64(BB_RANK_3 | BB_RANK_4),
+                       _shift(single, -8) & uint64(BB_RANK_6 | BB_RANK_5)) & empty
+        single_rows, single_to = _squares(single)
+        double_rows, double_to = _squares(double)
+        down = where(turn, -8, 8)
+        single_from = single_to + down[single_rows]
+        double_from = double_to + 2 * down[double_rows]
+
+        rows = concatenate([capture_rows, single_rows, double_rows])
+        from_squares = concatenate([capture_from, single_from, double_from])
+        to_squares = concatenate([capture_to, single_to, double_to])
+
+        # Promotions, eagles may promote a rank early.
+        promoting = _bits(uint64(BB_BACKRANKS), to_squares)
+        eagle_rank = where(turn[rows], uint64(BB_RANK_7), uint64(BB_RANK_2))
+        eagle = ~promoting & _bits(self.eagles[rows], from_squares) & _bits(eagle_rank, to_squares)
+        counts = where(promoting, len(PROMOTIONS), where(eagle, len(EAGLE_PROMOTIONS), 1))
+        promotions = zeros(counts.sum(), int8)
+        starts = concatenate([[0], counts.cumsum()[:-1]])
+        for index, piece_type in enumerate(PROMOTIONS):
+            promotions[starts[promoting | eagle] + index] = piece_type
+        return (repeat(rows, counts), repeat(from_squares, counts),
+                repeat(to_squares, counts), promotions)
+
+    def _ep_moves(self) -> tuple[ndarray, ndarray, ndarray]:
+        rows = nonzero(self.ep_square >= 0)[0]
+        ep_squares = self.ep_square[rows].astype(int32)
+        turn = self.turn[rows]
+        down = where(turn, -8, 8)
+        capturers = (self.pieces[PAWN] & self.us)[rows] & ~self.pacifists[rows] & \
+            PAWN_ATTACKS[(~turn).astype(int8), ep_squares] & \
+            where(turn, uint64(BB_RANK_5), uint64(BB_RANK_4))
+        # En passant is a pawn taking a pawn, which pacifists stay out of.
+        capturers = where(_bits(self.occupied[rows], ep_squares) |
+                          ((self.abilities[rows, ep_squares + down] & B_PACIFIST) != 0),
+                          uint64(0), capturers)
+        moves, from_squares = _squares(capturers)
+        return rows[moves], from_squares, ep_squares[moves]
+
+    def _castling_moves(self) -> tuple[ndarray, ndarray, ndarray]:
+        turn = self.turn
+        backrank = where(turn, uint64(BB_RANK_1), uint64(BB_RANK_8))
+        kings = self.pieces[KING] & self.us & backrank
+        # The lowest king, like intchess, and only one.
+        kings &= uint64(0) - kings
+        candidates = where(kings != 0, self.castling_rights & backrank & self.pieces[ROOK] & self.us,
+                           uint64(0))
+        rows, rooks = _squares(candidates)
+        if not len(rows):
+            return rows, rooks, rooks
+
+        king_bits = kings[rows]
+        _, king_squares = _squares(king_bits)
+        rook_bits = SQUARE_BITS[rooks]
+        a_side = rooks < king_squares
+        rank = where(turn[rows], 0, 56)
+        king_to = rank + where(a_side, 2, 6)
+        rook_to = rank + where(a_side, 3, 5)
+        king_path = BETWEEN[king_squares, king_to]
+        rook_path = BETWEEN[rooks, rook_to]
+        occupied = self.occupied[rows]
+
+        legal = ((occupied ^ king_bits ^ rook_bits) &
+                 (king_path | rook_path | SQUARE_BITS[king_to] | SQUARE_BITS[rook_to])) == 0
+
+        # Stubborn and ghost kings may castle out of and through check.
+        path = where(_bits(self.stubborn[rows], king_squares), uint64(0), king_path | king_bits)
+        path_moves, path_squares = _squares(path)
+        nothing = zeros(len(path_moves), uint64)
+        attacked = self._attacked(rows[path_moves], path_squares,
+                                  (occupied ^ king_bits)[path_moves], nothing)
+        legal[path_moves[attacked]] = False
+        legal &= ~self._attacked(rows, king_to, occupied ^ king_bits ^ rook_bits ^ SQUARE_BITS[rook_to],
+                                 zeros(len(rows), uint64))
+        return rows[legal], king_squares[legal], rooks[legal]
+
+    def pseudo_legal_moves(self) -> tuple[ndarray, ndarray, ndarray, ndarray]:
+        # The moves of every position as the arrays row, from square, to
+        # square and promotion piece type, 0 for none, sorted by row.
+        # Castling is the king taking its own rook, like in intchess.
+        piece_rows, piece_from, piece_to = self._piece_moves()
+        pawn_rows, pawn_from, pawn_to, pawn_promotions = self._pawn_moves()
+        ep_rows, ep_from, ep_to = self._ep_moves()
+        castling_rows, castling_from, castling_to = self._castling_moves()
+
+        rows = concatenate([piece_rows, pawn_rows, ep_rows, castling_rows])
+        order = argsort(rows, kind='stable')
+        return (rows[order].astype(int32),
+                concatenate([piece_from, pawn_from, ep_from, castling_from])[order].astype(int8),
+                concatenate([piece_to, pawn_to, ep_to, castling_to])[order].astype(int8),
+                concatenate([zeros(len(piece_rows), int8), pawn_promotions,
+                             zeros(len(ep_rows) + len(castling_rows), int8)])[order])
+
+    def legal_moves(self) -> tuple[ndarray, ndarray, ndarray, ndarray]:
+        # The same, without the moves that leave the king attacked.
+        rows, from_squares, to_squares, promotions = self.pseudo_legal_moves()
+        from_squares = from_squares.astype(int32)
+        to_squares = to_squares.astype(int32)
+
+        king = self.king[rows]
+        moving_king = from_squares == king
+        castling = moving_king & _bits((self.pieces[ROOK] & self.us)[rows], to_squares)
+        ep = ((self.ep_square[rows] == to_squares) & _bits(self.pieces[PAWN][rows], from_squares) &
+              ((to_squares - from_squares) % 8 != 0))
+        captured = where(ep, to_squares + where(self.turn[rows], -8, 8), to_squares)
+
+        occupied = (self.occupied[rows] & ~SQUARE_BITS[from_squares] & ~SQUARE_BITS[captured] |
+                    SQUARE_BITS[to_squares])
+        check = (king >= 0) & ~castling
+        target = where(moving_king, to_squares, king)[check]
+        legal = ~check
+        legal[check] = ~self._attacked(rows[check], target, occupied[check],
+                                       SQUARE_BITS[captured[check]])
+        return (rows[legal], from_squares[legal].astype(int8), to_squares[legal].astype(int8),
+                promotions[legal])
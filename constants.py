@@ -1,3 +1,6 @@
+from os import cpu_count
+
+
 __all__ = [
     'DEFAULT_WINDOW_SIZE',
     'BACKGROUND_COLOR', 'MENU_COLOR',
@@ -5,6 +8,8 @@ __all__ = [
     'LIGHT_MOVE_COLOR', 'DARK_MOVE_COLOR',
 
     'PIECE_TYPES', 'PROFILE_NAMES',
+
+    'BOT_MOVETIME_MS', 'BOT_TIMEOUT_MS', 'BOT_WORKERS',
 ]
 
 DEFAULT_WINDOW_SIZE = (1280, 720)
@@ -28,3 +33,10 @@ PROFILE_NAMES = (
 
     'opening', 'midgame', 'endgame', 'zugzwang', 'puzzle', 'elo',
 )
+
+BOT_MOVETIME_MS = 1000
+# Past this the bot plays the best move it has found, even mid-iteration.
+BOT_TIMEOUT_MS = 3000
+# Processes the bot searches on, one core is left to the window. With one,
+# it searches on a thread of the window process instead.
+BOT_WORKERS = max(1, (cpu_count() or 1) - 1)
@@ -0,0 +1,93 @@
+from numpy import array, asarray, einsum, ndarray, stack, uint8, uint64, unpackbits
+
+
+__all__ = ['PIECE_VALUES', 'POS_VALUES', 'SQUARE_VALUES', 'BATCH_VALUES', 'evaluate_batch']
+
+
+# pawn, knight, bishop, rook, queen, king
+PIECE_VALUES = [1, 3.2, 3.33, 5.1, 8.8, 0]
+PAWN_POS_VALUES = array([
+    [ 0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ],
+    [ 0.05,  0.1 ,  0.1 , -0.2 , -0.2 ,  0.1 ,  0.1 ,  0.05],
+    [ 0.05, -0.05, -0.1 ,  0.0 ,  0.0 , -0.1 , -0.05,  0.05],
+    [ 0.0 ,  0.0 ,  0.0 ,  0.2 ,  0.2 ,  0.0 ,  0.0 ,  0.0 ],
+    [ 0.05,  0.05,  0.1 ,  0.25,  0.25,  0.1 ,  0.05,  0.05],
+    [ 0.1 ,  0.1 ,  0.2 ,  0.3 ,  0.3 ,  0.2 ,  0.1 ,  0.1 ],
+    [ 0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.5 ],
+    [ 0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ],
+]) + 1
+KNIGHT_POS_VALUES = array([
+    [-0.5 , -0.4 , -0.3 , -0.3 , -0.3 , -0.3 , -0.4 , -0.5 ],
+    [-0.4 , -0.2 ,  0.0 ,  0.05,  0.05,  0.0 , -0.2 , -0.4 ],
+    [-0.3 ,  0.05,  0.1 ,  0.15,  0.15,  0.1 ,  0.05, -0.3 ],
+    [-0.3 ,  0.0 ,  0.15,  0.2 ,  0.2 ,  0.15,  0.0 , -0.3 ],
+    [-0.3 ,  0.05,  0.15,  0.2 ,  0.2 ,  0.15,  0.05, -0.3 ],
+    [-0.3 ,  0.0 ,  0.1 ,  0.15,  0.15,  0.1 ,  0.0 , -0.3 ],
+    [-0.4 , -0.2 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.2 , -0.4 ],
+    [-0.5 , -0.4 , -0.3 , -0.3 , -0.3 , -0.3 , -0.4 , -0.5 ],
+]) + 3.2
+BISHOP_POS_VALUES = array([
+    [-0.2 , -0.1 , -0.1 , -0.1 , -0.1 , -0.1 , -0.1 , -0.2 ],
+    [-0.1 ,  0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.05, -0.1 ],
+    [-0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.1 , -0.1 ],
+    [-0.1 ,  0.0 ,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.0 , -0.1 ],
+    [-0.1 ,  0.05,  0.05,  0.1 ,  0.1 ,  0.05,  0.05, -0.1 ],
+    [-0.1 ,  0.0 ,  0.05,  0.1 ,  0.1 ,  0.05,  0.0 , -0.1 ],
+    [-0.1 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.1 ],
+    [-0.2 , -0.1 , -0.1 , -0.1 , -0.1 , -0.1 , -0.1 , -0.2 ],
+]) + 3.33
+ROOK_POS_VALUES = array([
+    [ 0.0 ,  0.0 ,  0.0 ,  0.05,  0.05,  0.0 ,  0.0 ,  0.0 ],
+    [-0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.05],
+    [-0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.05],
+    [-0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.05],
+    [-0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.05],
+    [-0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.05],
+    [ 0.05,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.1 ,  0.05],
+    [ 0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ],
+]) + 5.1
+QUEEN_POS_VALUES = array([
+    [-0.2 , -0.1 , -0.1 , -0.05, -0.05, -0.1 , -0.1 , -0.2 ],
+    [-0.1 ,  0.0 ,  0.05,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.1 ],
+    [-0.1 ,  0.05,  0.05,  0.05,  0.05,  0.05,  0.0 , -0.1 ],
+    [ 0.0 ,  0.0 ,  0.05,  0.05,  0.05,  0.05,  0.0 , -0.05],
+    [-0.05,  0.0 ,  0.05,  0.05,  0.05,  0.05,  0.0 , -0.05],
+    [-0.1 ,  0.0 ,  0.05,  0.05,  0.05,  0.05,  0.0 , -0.1 ],
+    [-0.1 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.0 , -0.1 ],
+    [-0.2 , -0.1 , -0.1 , -0.05, -0.05, -0.1 , -0.1 , -0.2 ],
+]) + 8.8
+KING_POS_VALUES = array([
+    [ 0.2 ,  0.3 ,  0.1 ,  0.0 ,  0.0 ,  0.1 ,  0.3 ,  0.2 ],
+    [ 0.2 ,  0.2 ,  0.0 ,  0.0 ,  0.0 ,  0.0 ,  0.2 ,  0.2 ],
+    [-0.1 , -0.2 , -0.2 , -0.2 , -0.2 , -0.2 , -0.2 , -0.1 ],
+    [-0.2 , -0.3 , -0.3 , -0.4 , -0.4 , -0.3 , -0.3 , -0.2 ],
+    [-0.3 , -0.4 , -0.4 , -0.5 , -0.5 , -0.4 , -0.4 , -0.3 ],
+    [-0.3 , -0.4 , -0.4 , -0.5 , -0.5 , -0.4 , -0.4 , -0.3 ],
+    [-0.3 , -0.4 , -0.4 , -0.5 , -0.5 , -0.4 , -0.4 , -0.3 ],
+    [-0.3 , -0.4 , -0.4 , -0.5 , -0.5 , -0.4 , -0.4 , -0.3 ],
+])
+
+_POS_VALUES = [PAWN_POS_VALUES, KNIGHT_POS_VALUES, BISHOP_POS_VALUES,
+               ROOK_POS_VALUES, QUEEN_POS_VALUES, KING_POS_VALUES]
+POS_VALUES = [
+    [VALUES[::-1, :] for VALUES in _POS_VALUES],
+    _POS_VALUES,
+]
+# Per-square lists of the above, indexed by intchess squares.
+SQUARE_VALUES = [[VALUES.reshape((64,)).tolist() for VALUES in COLOR_VALUES]
+                 for COLOR_VALUES in POS_VALUES]
+# The same as one matrix of the white pieces then the black pieces by type,
+# black values negated, to score many boards in one product.
+BATCH_VALUES = stack([VALUES.reshape((64,)) for VALUES in POS_VALUES[1]] +
+                     [-VALUES.reshape((64,)) for VALUES in POS_VALUES[0]])
+
+
+def evaluate_batch(boards) -> ndarray:
+    # The scores of N boards, given as an (N, 12, 8, 8) bool array laid out
+    # like numchess bool boards, or as an (N, 12) uint64 array of bitboards,
+    # in the order of BATCH_VALUES. They match the running score of intchess.
+    boards = asarray(boards)
+    if boards.dtype == uint64:
+        # Little-endian bytes unpack to the squares of a bitboard in order.
+        boards = unpackbits(boards.astype('<u8').view(uint8), axis=-1, bitorder='little')
+    return einsum('ijk,jk->i', boards.reshape((len(boards), 12, 64)), BATCH_VALUES)
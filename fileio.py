@@ -0,0 +1,25 @@
+from contextlib import contextmanager, suppress
+from os import getpid, makedirs, remove, replace
+from os.path import split
+from typing import BinaryIO, Iterator
+
+
+__all__ = ['open_atomic']
+
+
+@contextmanager
+def open_atomic(path: str) -> Iterator[BinaryIO]:
+    # Write aside and rename, so that a running game or a concurrent import
+    # never reads half a file. A write that fails leaves nothing behind.
+    directory = split(path)[0]
+    if directory:
+        makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.{getpid()}'
+    try:
+        with open(temp_path, 'wb') as file:
+            yield file
+        replace(temp_path, path)
+    except BaseException:
+        with suppress(OSError):
+            remove(temp_path)
+        raise
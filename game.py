@@ -14,12 +14,16 @@ from pygame.mouse import get_pos as get_mouse_pos, get_pressed as get_mouse_pres
 from pygame.transform import scale
 from pygame import Rect, init as pygame_init
 
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
 from os.path import join, split
+from threading import Event
 
-from bot import move_engine
+import intchess
+from bot import MAX_DEPTH, move_engine
 from constants import *
 from function import get_surface
-from level import get_level_name, get_level
+from level import get_level_name, level_board
 from numchess import *
 
 
@@ -39,37 +43,43 @@ for piece_color in COLOR_NAMES:
 ICON = load_image(join(folder, 'assets', 'icon.png'))
 FONT = Font(join(folder, 'assets', 'ComicSans.ttf'), 64)
 
+logger = getLogger(__name__)
+
+# One worker, so a search that is being cancelled never overlaps the next.
+# It is started by the first search rather than on import.
+_search_executor = None
+
+
+def _get_search_executor() -> ThreadPoolExecutor:
+    global _search_executor
+    if _search_executor is None:
+        _search_executor = ThreadPoolExecutor(max_workers=1)
+    return _search_executor
+
 
 class Game:
-    def __init__(self, level_selected=0, deck=list[Piece]):
+    def __init__(self, level_selected=0, deck=list[Piece], search_pool=None):
         self.size = DEFAULT_WINDOW_SIZE
         self.screen = get_surface(self.size)
 
         self.drag_rank = self.drag_file = -1
         self.drag_xpad = self.drag_ypad = 0
 
-        self.board = get_level(level_selected)
-
-        for rank in range(len(deck) // 8):
-            for file in range(8):
-                piece = deck[rank * 8 + file]
-                if piece is not None:
-                    self.board.set_piece_at((rank, file), piece)
-        king_file = self.board.king(WHITE)[1]
-        for file in range(king_file - 1, 8):
-            if self.board.rooks[0, file]:
-                self.board.castling_rights |= BB_SQUARES[SQUARES.index((0, file))]
-                break
-        for file in range(king_file - 1, -1, -1):
-            if self.board.rooks[0, file]:
-                self.board.castling_rights |= BB_SQUARES[SQUARES.index((0, file))]
-                break
+        # Moves are checked and games ended by the rules the bot searches
+        # with, set up as the book and tablebases are. The numchess board
+        # keeps the pieces to draw.
+        self.rules = level_board(level_selected, deck)
+        self.board = self.rules.to_numchess()
 
         self.level_selected = level_selected
         self.promotion_from_square = -1
         self.promotion_square = -1
         self.promotion_pressed = -1
         self.player_turn = self.board.turn
+        self.search = None
+        self.search_stop = None
+        # Owned by the window, which keeps it from one game to the next.
+        self.search_pool = search_pool
 
     def update(self, size=None):
         width, height = self.size if size is None else size
@@ -137,25 +147,24 @@ class Game:
             f'Level {self.level_selected + 1}', 0, (255, 255, 255))
         self.level_text_name = FONT.render(
             get_level_name(self.level_selected), 0, (255, 255, 255))
-        outcome = self.board.outcome()
+        outcome = self.rules.outcome()
         if outcome is not None:
             if outcome.winner == self.player_turn:
                 text = 'You won'
             elif outcome.winner == (not self.player_turn):
                 text = 'You lost'
-            elif self.board.is_stalemate():
+            elif self.rules.is_stalemate():
                 text = 'Stalemate Draw'
-            elif self.board.is_insufficient_material():
-                text = 'Insufficient Material Draw'
-            elif self.board.is_seventyfive_moves():
+            elif self.rules.is_seventyfive_moves():
                 text = '75 Moves Draw'
-            elif self.board.is_fivefold_repetition():
+            elif self.rules.is_fivefold_repetition():
                 text = 'Repetition Draw'
             else:
                 text = "It's a draw"
             self.level_text_winner = FONT.render(text, 0, (255, 255, 255))
         else:
             self.level_text_winner = None
+        self.level_text_thinking = FONT.render('Thinking...', 0, (255, 255, 255))
         screen_height = self.screen.get_height()
         max_width, max_height = self.board_rect.left * 0.8, screen_height * 3 / 50
 
@@ -190,6 +199,16 @@ class Game:
                     self.level_text_winner,
                     (max_width, height * max_width / width))
 
+        width, height = self.level_text_thinking.get_size()
+        self.level_text_thinking = scale(
+            self.level_text_thinking,
+            (width * max_height / height, max_height))
+        if self.level_text_thinking.get_width() > max_width:
+            width, height = self.level_text_thinking.get_size()
+            self.level_text_thinking = scale(
+                self.level_text_thinking,
+                (max_width, height * max_width / width))
+
     def draw_piece(self, piece_type, color, rank, file):
         self.screen.blit(self.pieces[piece_type + color * 6],
                          (self.board_rect.left + file * self.block_size,
@@ -228,10 +247,10 @@ class Game:
         if self.drag_rank != -1:
             mx, my = get_mouse_pos()
 
-            for move in self.board.generate_legal_moves(
-                    from_mask=BB_SQUARES[self.drag_rank * 8 + self.drag_file]):
-                square = move.to_square
-                mask = BB_SQUARES[SQUARES.index(square)]
+            for move in self.rules.generate_legal_moves(
+                    intchess.BB_SQUARES[self.drag_rank * 8 + self.drag_file]):
+                square = intchess.square_tuple(move.to_square)
+                mask = BB_SQUARES[SQUARE_INDICES[square]]
                 if sum(square) % 2 == 0:
                     if (self.board.occupied_co[not self.board.turn] & mask).any():
                         surface = self.dark_capture
@@ -284,6 +303,12 @@ class Game:
             ypad = (screen_height * 4 / 10
                     + (screen_height * 3 / 50 - text_height) / 2)
             self.screen.blit(self.level_text_winner, (xpad, ypad))
+        elif self.search is not None:
+            text_width, text_height = self.level_text_thinking.get_size()
+            xpad = screen_width - (self.board_rect.left - text_width) / 2 - text_width
+            ypad = (screen_height * 4 / 10
+                    + (screen_height * 3 / 50 - text_height) / 2)
+            self.screen.blit(self.level_text_thinking, (xpad, ypad))
 
     def draw(self, *, draw_menu=True):
         self.screen.fill((0, 0, 0, 0))
@@ -291,17 +316,37 @@ class Game:
         if draw_menu:
             self.draw_menu()
 
+    def is_legal(self, move):
+        return self.rules.is_legal(intchess.Move.from_numchess(move))
+
+    def push(self, move):
+        self.board.push(move)
+        self.rules.push(intchess.Move.from_numchess(move))
+
     def play_move(self, move):
-        if self.board.is_legal(move):
-            self.board.push(move)
-            if self.board.is_game_over():
+        if self.is_legal(move):
+            self.push(move)
+            if self.rules.is_game_over():
                 self.update_menu()
             else:
-                self.draw()
-                bot_move = move_engine(self.board)
-                self.board.push(bot_move)
-                if self.board.is_game_over():
-                    self.update_menu()
+                # The bot searches its own copy of the rules board, history
+                # and all, on the worker while the window keeps drawing;
+                # tick picks up its move.
+                self.search_stop = Event()
+                self.search = _get_search_executor().submit(
+                    move_engine, self.rules.copy(),
+                    MAX_DEPTH, movetime_ms=BOT_MOVETIME_MS,
+                    stop=self.search_stop, pool=self.search_pool)
+
+    def cancel(self):
+        if self.search is not None:
+            self.search_stop.set()
+            self.search.cancel()
+            self.search = None
+            self.search_stop = None
+
+    def close(self):
+        self.cancel()
 
     def _lmb_up(self):
         self.drag_rank = -1
@@ -314,14 +359,28 @@ class Game:
         self.promotion_pressed = -1
 
     def tick(self):
-        pass
+        if self.search is not None and self.search.done():
+            search = self.search
+            self.search = None
+            self.search_stop = None
+            try:
+                bot_move = search.result()
+            except Exception:
+                # A broken search must not take the window down with it, the
+                # bot plays any legal move instead.
+                logger.exception('search failed')
+                bot_move = next(self.rules.generate_legal_moves(), None)
+            if bot_move is not None:
+                self.push(bot_move.to_numchess())
+            if self.rules.is_game_over():
+                self.update_menu()
 
     def on_event(self, event):
         if event.type == MOUSEBUTTONDOWN:
             if event.button != 1:
                 return
             mx, my = event.pos
-            if self.board_rect.collidepoint(mx, my) and not self.board.is_game_over():
+            if self.board_rect.collidepoint(mx, my) and not self.rules.is_game_over():
                 rank = int((self.block_size * 8 - (my - self.board_rect.top))
                             // self.block_size)
                 file = int((mx - self.board_rect.left)
@@ -377,7 +436,7 @@ class Game:
                         for piece in (QUEEN, KNIGHT, ROOK, BISHOP):
                             move = Move(divmod(from_square, 8),
                                         divmod(to_square, 8), promotion=piece)
-                            if not self.board.is_legal(move):
+                            if not self.is_legal(move):
                                 continue
                             self._lmb_up()
                             return
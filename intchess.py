@@ -0,0 +1,1526 @@
+from numpy import frombuffer, packbits, uint8, unpackbits
+
+from dataclasses import dataclass
+from itertools import chain
+from typing import Any, Callable, Hashable, Iterable, Iterator, Optional
+
+import numchess
+from abilities import *
+from evaluation import SQUARE_VALUES
+from numchess import (
+    PieceType, PIECE_TYPES, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
+    PIECE_SYMBOLS, PIECE_NAMES,
+    Color, COLORS, WHITE, BLACK, COLOR_NAMES,
+    FILE_NAMES, RANK_NAMES,
+    Termination, Outcome, Piece, ABILITY_COUNT,
+    ZOBRIST_CASTLING, ZOBRIST_EP, ZOBRIST_TURN, zobrist_piece)
+
+
+Square = int
+SQUARES = [
+    A1, B1, C1, D1, E1, F1, G1, H1,
+    A2, B2, C2, D2, E2, F2, G2, H2,
+    A3, B3, C3, D3, E3, F3, G3, H3,
+    A4, B4, C4, D4, E4, F4, G4, H4,
+    A5, B5, C5, D5, E5, F5, G5, H5,
+    A6, B6, C6, D6, E6, F6, G6, H6,
+    A7, B7, C7, D7, E7, F7, G7, H7,
+    A8, B8, C8, D8, E8, F8, G8, H8,
+] = range(64)
+SQUARE_NAMES = [f + r for r in RANK_NAMES for f in FILE_NAMES]
+
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+
+def square(rank_index: int, file_index: int) -> Square:
+    return rank_index * 8 + file_index
+
+def square_rank(square: Square) -> int:
+    return square >> 3
+
+def square_file(square: Square) -> int:
+    return square & 7
+
+def square_tuple(square: Square) -> numchess.Square:
+    return square >> 3, square & 7
+
+def square_distance(a: Square, b: Square) -> int:
+    return max(abs(square_file(a) - square_file(b)), abs(square_rank(a) - square_rank(b)))
+
+
+Bitboard = int
+BB_EMPTY = 0
+BB_ALL = 0xffff_ffff_ffff_ffff
+BB_SQUARES = [
+    BB_A1, BB_B1, BB_C1, BB_D1, BB_E1, BB_F1, BB_G1, BB_H1,
+    BB_A2, BB_B2, BB_C2, BB_D2, BB_E2, BB_F2, BB_G2, BB_H2,
+    BB_A3, BB_B3, BB_C3, BB_D3, BB_E3, BB_F3, BB_G3, BB_H3,
+    BB_A4, BB_B4, BB_C4, BB_D4, BB_E4, BB_F4, BB_G4, BB_H4,
+    BB_A5, BB_B5, BB_C5, BB_D5, BB_E5, BB_F5, BB_G5, BB_H5,
+    BB_A6, BB_B6, BB_C6, BB_D6, BB_E6, BB_F6, BB_G6, BB_H6,
+    BB_A7, BB_B7, BB_C7, BB_D7, BB_E7, BB_F7, BB_G7, BB_H7,
+    BB_A8, BB_B8, BB_C8, BB_D8, BB_E8, BB_F8, BB_G8, BB_H8,
+] = [1 << sq for sq in SQUARES]
+BB_FILES = [
+    BB_FILE_A,
+    BB_FILE_B,
+    BB_FILE_C,
+    BB_FILE_D,
+    BB_FILE_E,
+    BB_FILE_F,
+    BB_FILE_G,
+    BB_FILE_H,
+] = [0x0101_0101_0101_0101 << i for i in range(8)]
+BB_RANKS = [
+    BB_RANK_1,
+    BB_RANK_2,
+    BB_RANK_3,
+    BB_RANK_4,
+    BB_RANK_5,
+    BB_RANK_6,
+    BB_RANK_7,
+    BB_RANK_8,
+] = [0xff << (8 * i) for i in range(8)]
+
+BB_BACKRANKS = BB_RANK_1 | BB_RANK_8
+
+
+def lsb(bb: Bitboard) -> int:
+    return (bb & -bb).bit_length() - 1
+
+def scan_forward(bb: Bitboard) -> Iterator[Square]:
+    while bb:
+        r = bb & -bb
+        yield r.bit_length() - 1
+        bb ^= r
+
+def msb(bb: Bitboard) -> int:
+    return bb.bit_length() - 1
+
+def scan_reversed(bb: Bitboard) -> Iterator[Square]:
+    while bb:
+        r = bb.bit_length() - 1
+        yield r
+        bb ^= BB_SQUARES[r]
+
+def popcount(bb: Bitboard) -> int:
+    return bb.bit_count()
+
+def shift_down(b: Bitboard) -> Bitboard:
+    return b >> 8
+
+def shift_up(b: Bitboard) -> Bitboard:
+    return (b << 8) & BB_ALL
+
+def from_bool_board(bb: numchess.BoolBoard) -> Bitboard:
+    return int.from_bytes(packbits(bb.reshape((64,)), bitorder='little').tobytes(), 'little')
+
+def to_bool_board(bb: Bitboard) -> numchess.BoolBoard:
+    return unpackbits(frombuffer(bb.to_bytes(8, 'little'), dtype=uint8),
+                      bitorder='little').astype(bool).reshape((8, 8))
+
+
+def _sliding_attacks(square: Square, occupied: Bitboard, deltas: Iterable[int]) -> Bitboard:
+    attacks = BB_EMPTY
+
+    for delta in deltas:
+        sq = square
+
+        while True:
+            sq += delta
+            if not (0 <= sq < 64) or square_distance(sq, sq - delta) > 2:
+                break
+
+            attacks |= BB_SQUARES[sq]
+
+            if occupied & BB_SQUARES[sq]:
+                break
+
+    return attacks
+
+def _step_attacks(square: Square, deltas: Iterable[int]) -> Bitboard:
+    return _sliding_attacks(square, BB_ALL, deltas)
+
+KNIGHT_DELTAS = [17, 15, 10, 6, -17, -15, -10, -6]
+
+BB_KNIGHT_ATTACKS = [_step_attacks(sq, KNIGHT_DELTAS) for sq in SQUARES]
+BB_KING_ATTACKS = [_step_attacks(sq, [9, 8, 7, 1, -9, -8, -7, -1]) for sq in SQUARES]
+BB_PAWN_ATTACKS = [[_step_attacks(sq, deltas) for sq in SQUARES] for deltas in [[-7, -9], [7, 9]]]
+
+
+def _edges(square: Square) -> Bitboard:
+    return (((BB_RANK_1 | BB_RANK_8) & ~BB_RANKS[square_rank(square)]) |
+            ((BB_FILE_A | BB_FILE_H) & ~BB_FILES[square_file(square)]))
+
+def _carry_rippler(mask: Bitboard) -> Iterator[Bitboard]:
+    # Carry-Rippler trick to iterate subsets of mask.
+    subset = BB_EMPTY
+    while True:
+        yield subset
+        subset = (subset - mask) & mask
+        if not subset:
+            break
+
+def _attack_table(deltas: list[int]) -> tuple[list[Bitboard], list[dict[Bitboard, Bitboard]]]:
+    mask_table = []
+    attack_table = []
+
+    for square in SQUARES:
+        attacks = {}
+
+        mask = _sliding_attacks(square, 0, deltas) & ~_edges(square)
+        for subset in _carry_rippler(mask):
+            attacks[subset] = _sliding_attacks(square, subset, deltas)
+
+        attack_table.append(attacks)
+        mask_table.append(mask)
+
+    return mask_table, attack_table
+
+BB_DIAG_MASKS, BB_DIAG_ATTACKS = _attack_table([-9, -7, 7, 9])
+BB_FILE_MASKS, BB_FILE_ATTACKS = _attack_table([-8, 8])
+BB_RANK_MASKS, BB_RANK_ATTACKS = _attack_table([-1, 1])
+BB_RIDER_MASKS, BB_RIDER_ATTACKS = _attack_table(KNIGHT_DELTAS)
+
+
+def _rider_ray(a: Square, b: Square) -> Bitboard:
+    # The rider line through a and b, if they share one.
+    for delta in KNIGHT_DELTAS:
+        if _sliding_attacks(a, BB_EMPTY, [delta]) & BB_SQUARES[b]:
+            return _sliding_attacks(a, BB_EMPTY, [delta, -delta]) | BB_SQUARES[a]
+    return BB_EMPTY
+
+def _rays() -> list[list[Bitboard]]:
+    rays = []
+    for a, bb_a in enumerate(BB_SQUARES):
+        rays_row = []
+        for b, bb_b in enumerate(BB_SQUARES):
+            if BB_DIAG_ATTACKS[a][0] & bb_b:
+                rays_row.append((BB_DIAG_ATTACKS[a][0] & BB_DIAG_ATTACKS[b][0]) | bb_a | bb_b)
+            elif BB_RANK_ATTACKS[a][0] & bb_b:
+                rays_row.append(BB_RANK_ATTACKS[a][0] | bb_a)
+            elif BB_FILE_ATTACKS[a][0] & bb_b:
+                rays_row.append(BB_FILE_ATTACKS[a][0] | bb_a)
+            elif BB_RIDER_ATTACKS[a][0] & bb_b:
+                rays_row.append(_rider_ray(a, b))
+            else:
+                rays_row.append(BB_EMPTY)
+        rays.append(rays_row)
+    return rays
+
+BB_RAYS = _rays()
+
+def ray(a: Square, b: Square) -> Bitboard:
+    return BB_RAYS[a][b]
+
+def between(a: Square, b: Square) -> Bitboard:
+    bb = BB_RAYS[a][b] & ((BB_ALL << a) ^ (BB_ALL << b))
+    return bb & (bb - 1)
+
+
+@dataclass(unsafe_hash=True)
+class Move:
+    from_square: Square
+    to_square: Square
+    promotion: Optional[PieceType] = None
+
+    def __repr__(self):
+        promotion = '' if self.promotion is None else PIECE_SYMBOLS[self.promotion]
+        return f'Move({SQUARE_NAMES[self.from_square]}{SQUARE_NAMES[self.to_square]}{promotion})'
+
+    def __bool__(self) -> bool:
+        return bool(self.from_square or self.to_square or self.promotion)
+
+    @classmethod
+    def null(cls) -> 'Move':
+        return cls(0, 0)
+
+    @classmethod
+    def from_numchess(cls, move: numchess.Move) -> 'Move':
+        return cls(square(*move.from_square), square(*move.to_square), move.promotion)
+
+    def to_numchess(self) -> numchess.Move:
+        return numchess.Move(square_tuple(self.from_square),
+                             square_tuple(self.to_square), self.promotion)
+
+
+class _BoardState:
+
+    def __init__(self, board, squares: Iterable[Square] = ()) -> None:
+        self.pawns = board.pawns
+        self.knights = board.knights
+        self.bishops = board.bishops
+        self.rooks = board.rooks
+        self.queens = board.queens
+        self.kings = board.kings
+
+        self.occupied_w = board.occupied_co[WHITE]
+        self.occupied_b = board.occupied_co[BLACK]
+        self.occupied = board.occupied
+
+        # Only the abilities on the given squares are remembered, the ones
+        # a move can change.
+        self.abilities = [(square, board.abilities.get(square, B_NONE),
+                           board.unique_ability.get(square, B_NONE))
+                          for square in squares]
+
+        self.turn = board.turn
+        self.castling_rights = board.castling_rights
+        self.ep_square = board.ep_square
+        self.halfmove_clock = board.halfmove_clock
+
+        self.zobrist = board._zobrist
+        self.score = board.score
+        self.transposition_key = board._transposition_key()
+        self.king_attacks = board._king_attacks
+        self.has_legal_moves = board._has_legal_moves
+
+    def restore(self, board) -> None:
+        board.pawns = self.pawns
+        board.knights = self.knights
+        board.bishops = self.bishops
+        board.rooks = self.rooks
+        board.queens = self.queens
+        board.kings = self.kings
+
+        board.occupied_co[WHITE] = self.occupied_w
+        board.occupied_co[BLACK] = self.occupied_b
+        board.occupied = self.occupied
+
+        for square, abilities, unique_ability in self.abilities:
+            changed = board.abilities.get(square, B_NONE) ^ abilities
+            if changed:
+                board._toggle_abilities(BB_SQUARES[square], changed)
+            if abilities:
+                board.abilities[square] = abilities
+            else:
+                board.abilities.pop(square, None)
+            if unique_ability:
+                board.unique_ability[square] = unique_ability
+            else:
+                board.unique_ability.pop(square, None)
+
+        board.turn = self.turn
+        board.castling_rights = self.castling_rights
+        board.ep_square = self.ep_square
+        board.halfmove_clock = self.halfmove_clock
+
+        board._zobrist = self.zobrist
+        board.score = self.score
+        board._king_attacks = self.king_attacks
+        board._has_legal_moves = self.has_legal_moves
+
+
+class Board:
+    turn: Color
+    pawns: Bitboard
+    knights: Bitboard
+    bishops: Bitboard
+    rooks: Bitboard
+    queens: Bitboard
+    kings: Bitboard
+    occupied_co: list[Bitboard]
+    occupied: Bitboard
+
+    # Only squares with non-zero abilities are stored.
+    abilities: dict[Square, int]
+    unique_ability: dict[Square, int]
+    # One bitboard per ability bit, see _ability_mask().
+    ability_masks: list[Bitboard]
+
+    castling_rights: Bitboard
+    ep_square: Optional[Square]
+    halfmove_clock: int
+    move_stack: list[Move]
+    _stack: list[_BoardState]
+
+    # Material and piece-square value of the position from white's side.
+    score: float
+
+    # Zobrist hash of the pieces and their abilities, see zobrist_hash().
+    _zobrist: int
+
+    # Cache of king_attacks() with the side to move, or None.
+    _king_attacks: Optional[tuple]
+    # Cache of has_legal_moves() with the side to move, or None.
+    _has_legal_moves: Optional[tuple]
+
+    def __init__(self):
+        self.occupied_co = [BB_EMPTY, BB_EMPTY]
+        self.move_stack = []
+        self._stack = []
+        self.clear_board()
+
+    @classmethod
+    def from_numchess(cls, board: numchess.Board) -> 'Board':
+        # Move history is not carried over, so repetitions are only detected
+        # from this position onwards.
+        new = cls()
+        for sq in SQUARES:
+            piece = board.piece_at(square_tuple(sq))
+            if piece is not None:
+                new.set_piece_at(sq, Piece(piece.piece_type, bool(piece.color),
+                                           int(piece.abilities), int(piece.unique_ability)))
+
+        new.turn = bool(board.turn)
+        new.castling_rights = from_bool_board(board.castling_rights)
+        new.halfmove_clock = board.halfmove_clock
+        if board.last_move is not None and board.piece_type_at(board.last_move.to_square) == PAWN:
+            ep_square = board.get_ep_square()
+            if ep_square is not None:
+                new.ep_square = square(*ep_square)
+        return new
+
+    def to_numchess(self) -> numchess.Board:
+        board = numchess.Board()
+        for sq in scan_forward(self.occupied):
+            board.set_piece_at(square_tuple(sq), self.piece_at(sq))
+
+        board.turn = self.turn
+        board.castling_rights = to_bool_board(self.castling_rights)
+        board.halfmove_clock = self.halfmove_clock
+        # The en passant square is dropped. numchess would derive it from a
+        # last move, which the game never sets and its move generation never
+        # got to handle.
+        return board
+
+    def pack(self) -> tuple:
+        # The position without its history, in plain ints for pickling to
+        # other processes.
+        return (self.turn, self.pawns, self.knights, self.bishops, self.rooks,
+                self.queens, self.kings, self.occupied_co[WHITE], self.occupied_co[BLACK],
+                tuple(self.abilities.items()), tuple(self.unique_ability.items()),
+                self.castling_rights, self.ep_square, self.halfmove_clock,
+                self.score, self._zobrist)
+
+    @classmethod
+    def unpack(cls, packed: tuple) -> 'Board':
+        board = cls.__new__(cls)
+        (board.turn, board.pawns, board.knights, board.bishops, board.rooks,
+         board.queens, board.kings, occupied_w, occupied_b,
+         abilities, unique_ability, board.castling_rights, board.ep_square,
+         board.halfmove_clock, board.score, board._zobrist) = packed
+
+        board.occupied_co = [occupied_b, occupied_w]
+        board.occupied = occupied_w | occupied_b
+        board.abilities = dict(abilities)
+        board.unique_ability = dict(unique_ability)
+        board.ability_masks = [BB_EMPTY] * ABILITY_COUNT
+        for square, flags in abilities:
+            board._toggle_abilities(BB_SQUARES[square], flags)
+        board.move_stack = []
+        board._stack = []
+        board._king_attacks = None
+        board._has_legal_moves = None
+        return board
+
+    def bitboards(self) -> list[Bitboard]:
+        # White pieces then black pieces by type, as evaluate_batch takes them.
+        masks = [self.pawns, self.knights, self.bishops, self.rooks, self.queens, self.kings]
+        return [mask & self.occupied_co[color] for color in (WHITE, BLACK) for mask in masks]
+
+    def set_fen(self, fen: str) -> None:
+        # Abilities can not be expressed in a FEN, set them afterwards.
+        parts = fen.split()
+        if not 4 <= len(parts) <= 6:
+            raise ValueError(f'expected 4 to 6 parts in fen: {fen!r}')
+        rows = parts[0].split('/')
+        if len(rows) != 8:
+            raise ValueError(f'expected 8 rows in position part of fen: {fen!r}')
+
+        self.clear_board()
+        for rank_index, row in zip(range(7, -1, -1), rows):
+            file_index = 0
+            for c in row:
+                if c in '12345678':
+                    file_index += int(c)
+                elif c.lower() in PIECE_SYMBOLS and file_index < 8:
+                    self._set_piece_at(square(rank_index, file_index),
+                                       PIECE_SYMBOLS.index(c.lower()), c.isupper())
+                    file_index += 1
+                else:
+                    raise ValueError(f'invalid position part of fen: {fen!r}')
+            if file_index != 8:
+                raise ValueError(f'expected 8 columns per row in fen: {fen!r}')
+
+        if parts[1] not in {'w', 'b'}:
+            raise ValueError(f'expected w or b for turn part of fen: {fen!r}')
+        self.turn = parts[1] == 'w'
+
+        # Castling rights are the squares of the rooks, given as KQkq or as
+        # the files of the rooks.
+        for c in parts[2] if parts[2] != '-' else '':
+            backrank = BB_RANK_1 if c.isupper() else BB_RANK_8
+            rooks = self.rooks & self.occupied_co[c.isupper()] & backrank
+            if c.lower() == 'k':
+                rooks = BB_SQUARES[msb(rooks)] if rooks else BB_EMPTY
+            elif c.lower() == 'q':
+                rooks = BB_SQUARES[lsb(rooks)] if rooks else BB_EMPTY
+            elif c.lower() in FILE_NAMES:
+                rooks &= BB_FILES[FILE_NAMES.index(c.lower())]
+            else:
+                raise ValueError(f'invalid castling part in fen: {fen!r}')
+            self.castling_rights |= rooks
+
+        if parts[3] != '-':
+            if parts[3] not in SQUARE_NAMES:
+                raise ValueError(f'invalid en passant part in fen: {fen!r}')
+            self.ep_square = SQUARE_NAMES.index(parts[3])
+
+        if len(parts) > 4:
+            self.halfmove_clock = int(parts[4])
+
+    def clear_board(self) -> None:
+        self.turn = WHITE
+
+        self.pawns = BB_EMPTY
+        self.knights = BB_EMPTY
+        self.bishops = BB_EMPTY
+        self.rooks = BB_EMPTY
+        self.queens = BB_EMPTY
+        self.kings = BB_EMPTY
+
+        self.occupied_co[WHITE] = BB_EMPTY
+        self.occupied_co[BLACK] = BB_EMPTY
+        self.occupied = BB_EMPTY
+
+        self.abilities = {}
+        self.ability_masks = [BB_EMPTY] * ABILITY_COUNT
+        self._king_attacks = None
+        self._has_legal_moves = None
+        self.unique_ability = {}
+
+        self.castling_rights = BB_EMPTY
+        self.ep_square = None
+        self.halfmove_clock = 0
+        self.score = 0
+        self._zobrist = 0
+
+        self.clear_stack()
+
+    def clear_stack(self) -> None:
+        self.move_stack.clear()
+        self._stack.clear()
+
+    def pieces_mask(self, piece_type: PieceType, color: Color) -> Bitboard:
+        if piece_type == PAWN:
+            bb = self.pawns
+        elif piece_type == KNIGHT:
+            bb = self.knights
+        elif piece_type == BISHOP:
+            bb = self.bishops
+        elif piece_type == ROOK:
+            bb = self.rooks
+        elif piece_type == QUEEN:
+            bb = self.queens
+        else:
+            bb = self.kings
+
+        return bb & self.occupied_co[color]
+
+    def _ability_mask(self, flag: int) -> Bitboard:
+        # Kept up to date with the abilities, for a single ability flag.
+        return self.ability_masks[flag.bit_length() - 1]
+
+    def _toggle_abilities(self, mask: Bitboard, abilities: int) -> None:
+        ability_masks = self.ability_masks
+        while abilities:
+            flag = abilities & -abilities
+            ability_masks[flag.bit_length() - 1] ^= mask
+            abilities ^= flag
+
+    def piece_at(self, square: Square) -> Optional[Piece]:
+        piece_type = self.piece_type_at(square)
+        if piece_type is not None:
+            color = bool(self.occupied_co[WHITE] & BB_SQUARES[square])
+            return Piece(piece_type, color, self.abilities.get(square, B_NONE),
+                         self.unique_ability.get(square, B_NONE))
+
+    def piece_type_at(self, square: Square) -> Optional[PieceType]:
+        mask = BB_SQUARES[square]
+
+        if not self.occupied & mask:
+            return
+        elif self.pawns & mask:
+            return PAWN
+        elif self.knights & mask:
+            return KNIGHT
+        elif self.bishops & mask:
+            return BISHOP
+        elif self.rooks & mask:
+            return ROOK
+        elif self.queens & mask:
+            return QUEEN
+        else:
+            return KING
+
+    def color_at(self, square: Square) -> Optional[Color]:
+        mask = BB_SQUARES[square]
+        if self.occupied_co[WHITE] & mask:
+            return WHITE
+        elif self.occupied_co[BLACK] & mask:
+            return BLACK
+
+    @property
+    def legal_moves(self):
+        return LegalMoveGenerator(self)
+
+    @property
+    def pseudo_legal_moves(self):
+        return PseudoLegalMoveGenerator(self)
+
+    def get_ep_square(self) -> Optional[Square]:
+        return self.ep_square
+
+    def king(self, color: Color) -> Optional[Square]:
+        king_mask = self.occupied_co[color] & self.kings
+        return msb(king_mask) if king_mask else None
+
+    def attacks_mask(self, square: Square) -> Bitboard:
+        bb_square = BB_SQUARES[square]
+
+        if bb_square & self.pawns:
+            color = bool(bb_square & self.occupied_co[WHITE])
+            return BB_PAWN_ATTACKS[color][square]
+
+        abilities = self.abilities.get(square, B_NONE)
+        attacks = BB_EMPTY
+        if bb_square & self.kings or abilities & B_SNEAKER:
+            attacks = BB_KING_ATTACKS[square]
+        if abilities & B_RIDER:
+            attacks |= BB_RIDER_ATTACKS[square][BB_RIDER_MASKS[square] & self.occupied]
+        elif bb_square & self.knights or abilities & B_LEAPER:
+            attacks |= BB_KNIGHT_ATTACKS[square]
+        if bb_square & (self.bishops | self.queens) or abilities & B_SHIFTY:
+            attacks |= BB_DIAG_ATTACKS[square][BB_DIAG_MASKS[square] & self.occupied]
+        if bb_square & (self.rooks | self.queens) or abilities & B_RUTHLESS:
+            attacks |= (BB_RANK_ATTACKS[square][BB_RANK_MASKS[square] & self.occupied] |
+                        BB_FILE_ATTACKS[square][BB_FILE_MASKS[square] & self.occupied])
+        return attacks
+
+    def _sliders(self) -> tuple[Bitboard, Bitboard, Bitboard]:
+        rooks_and_queens = self.rooks | self.queens
+        bishops_and_queens = self.bishops | self.queens
+        riders = BB_EMPTY
+        if self.abilities:
+            rooks_and_queens |= self._ability_mask(B_RUTHLESS)
+            bishops_and_queens |= self._ability_mask(B_SHIFTY)
+            riders = self._ability_mask(B_RIDER)
+        return rooks_and_queens, bishops_and_queens, riders
+
+    def _attackers_mask(self, color: Color, square: Square, occupied: Bitboard) -> Bitboard:
+        rank_pieces = BB_RANK_MASKS[square] & occupied
+        file_pieces = BB_FILE_MASKS[square] & occupied
+        diag_pieces = BB_DIAG_MASKS[square] & occupied
+
+        kings = self.kings
+        knights = self.knights
+        queens_and_rooks, queens_and_bishops, riders = self._sliders()
+        if self.abilities:
+            kings |= self._ability_mask(B_SNEAKER)
+            knights = (knights | self._ability_mask(B_LEAPER)) & ~riders
+
+        attackers = (
+            (BB_KING_ATTACKS[square] & kings) |
+            (BB_KNIGHT_ATTACKS[square] & knights) |
+            (BB_RANK_ATTACKS[square][rank_pieces] & queens_and_rooks) |
+            (BB_FILE_ATTACKS[square][file_pieces] & queens_and_rooks) |
+            (BB_DIAG_ATTACKS[square][diag_pieces] & queens_and_bishops) |
+            (BB_PAWN_ATTACKS[not color][square] & self.pawns))
+        if riders:
+            rider_pieces = BB_RIDER_MASKS[square] & occupied
+            attackers |= BB_RIDER_ATTACKS[square][rider_pieces] & riders
+
+        return attackers & self.occupied_co[color]
+
+    def attackers_mask(self, color: Color, square: Square) -> Bitboard:
+        return self._attackers_mask(color, square, self.occupied)
+
+    def is_attacked_by(self, color: Color, square: Square) -> bool:
+        return bool(self.attackers_mask(color, square))
+
+    def pin_mask(self, color: Color, square: Square) -> Bitboard:
+        king = self.king(color)
+        if king is None:
+            return BB_ALL
+
+        square_mask = BB_SQUARES[square]
+
+        rooks_and_queens, bishops_and_queens, riders = self._sliders()
+        for attacks, sliders in [(BB_FILE_ATTACKS, rooks_and_queens),
+                                 (BB_RANK_ATTACKS, rooks_and_queens),
+                                 (BB_DIAG_ATTACKS, bishops_and_queens),
+                                 (BB_RIDER_ATTACKS, riders)]:
+            rays = attacks[king][0]
+            if rays & square_mask:
+                snipers = rays & sliders & self.occupied_co[not color]
+                for sniper in scan_reversed(snipers):
+                    if between(sniper, king) & (self.occupied | square_mask) == square_mask:
+                        return ray(king, sniper)
+
+                break
+
+        return BB_ALL
+
+    def _remove_piece_at(self, square: Square) -> Optional[PieceType]:
+        piece_type = self.piece_type_at(square)
+        mask = BB_SQUARES[square]
+
+        if piece_type == PAWN:
+            self.pawns ^= mask
+        elif piece_type == KNIGHT:
+            self.knights ^= mask
+        elif piece_type == BISHOP:
+            self.bishops ^= mask
+        elif piece_type == ROOK:
+            self.rooks ^= mask
+        elif piece_type == QUEEN:
+            self.queens ^= mask
+        elif piece_type == KING:
+            self.kings ^= mask
+        else:
+            return
+
+        color = bool(self.occupied_co[WHITE] & mask)
+        self.occupied ^= mask
+        self.occupied_co[color] ^= mask
+        self._king_attacks = None
+        self._has_legal_moves = None
+
+        abilities = self.abilities.pop(square, B_NONE)
+        unique_ability = self.unique_ability.pop(square, B_NONE)
+        if abilities:
+            self._toggle_abilities(mask, abilities)
+        self._zobrist ^= zobrist_piece(square, piece_type, color, abilities, unique_ability)
+        if color:
+            self.score -= SQUARE_VALUES[WHITE][piece_type][square]
+        else:
+            self.score += SQUARE_VALUES[BLACK][piece_type][square]
+
+        return piece_type
+
+    def _set_piece_at(self, square: Square, piece_type: PieceType, color: Color,
+                      abilities: int = B_NONE, unique_ability: int = B_NONE) -> None:
+        self._remove_piece_at(square)
+
+        mask = BB_SQUARES[square]
+
+        if piece_type == PAWN:
+            self.pawns |= mask
+        elif piece_type == KNIGHT:
+            self.knights |= mask
+        elif piece_type == BISHOP:
+            self.bishops |= mask
+        elif piece_type == ROOK:
+            self.rooks |= mask
+        elif piece_type == QUEEN:
+            self.queens |= mask
+        elif piece_type == KING:
+            self.kings |= mask
+        else:
+            return
+
+        self.occupied ^= mask
+        self.occupied_co[color] ^= mask
+        self._king_attacks = None
+        self._has_legal_moves = None
+
+        if abilities:
+            self.abilities[square] = abilities
+            self._toggle_abilities(mask, abilities)
+        if unique_ability:
+            self.unique_ability[square] = unique_ability
+        self._zobrist ^= zobrist_piece(square, piece_type, color, abilities, unique_ability)
+        if color:
+            self.score += SQUARE_VALUES[WHITE][piece_type][square]
+        else:
+            self.score -= SQUARE_VALUES[BLACK][piece_type][square]
+
+    def remove_piece_at(self, square: Square) -> Optional[Piece]:
+        color = bool(self.occupied_co[WHITE] & BB_SQUARES[square])
+        abilities = self.abilities.get(square, B_NONE)
+        unique_ability = self.unique_ability.get(square, B_NONE)
+        piece_type = self._remove_piece_at(square)
+        if piece_type is not None:
+            return Piece(piece_type, color, abilities, unique_ability)
+
+    def set_piece_at(self, square: Square, piece: Optional[Piece]):
+        if piece is None:
+            self.remove_piece_at(square)
+        else:
+            self._set_piece_at(square, piece.piece_type, piece.color,
+                               piece.abilities, piece.unique_ability)
+
+    def __str__(self) -> str:
+        builder = []
+
+        for rank in range(7, -1, -1):
+            for file in range(8):
+                piece = self.piece_at(square(rank, file))
+
+                if piece:
+                    symbol = PIECE_SYMBOLS[piece.piece_type]
+                    builder.append(symbol.upper() if piece.color else symbol)
+                else:
+                    builder.append('.')
+
+                if file == 7:
+                    if rank != 0:
+                        builder.append('\n')
+                else:
+                    builder.append(' ')
+
+        return ''.join(builder)
+
+    def copy(self, *, stack: bool = True) -> 'Board':
+        board = type(self).__new__(type(self))
+
+        board.turn = self.turn
+        board.pawns = self.pawns
+        board.knights = self.knights
+        board.bishops = self.bishops
+        board.rooks = self.rooks
+        board.queens = self.queens
+        board.kings = self.kings
+
+        board.occupied_co = self.occupied_co.copy()
+        board.occupied = self.occupied
+
+        board.abilities = self.abilities.copy()
+        board.ability_masks = self.ability_masks.copy()
+        board.unique_ability = self.unique_ability.copy()
+
+        board.castling_rights = self.castling_rights
+        board.ep_square = self.ep_square
+        board.halfmove_clock = self.halfmove_clock
+        board.score = self.score
+        board._zobrist = self._zobrist
+        board._king_attacks = self._king_attacks
+        board._has_legal_moves = self._has_legal_moves
+        board.move_stack = self.move_stack.copy() if stack else []
+        board._stack = self._stack.copy() if stack else []
+
+        return board
+
+    __copy__ = copy
+
+    def clean_castling_rights(self) -> Bitboard:
+        if self._stack:
+            # No new castling rights are assigned in a game, so we can assume
+            # they were filtered already.
+            return self.castling_rights
+
+        castling = self.castling_rights & self.rooks
+        white_castling = castling & BB_RANK_1 & self.occupied_co[WHITE]
+        black_castling = castling & BB_RANK_8 & self.occupied_co[BLACK]
+
+        # The kings must be on the back rank.
+        white_king_mask = self.occupied_co[WHITE] & self.kings & BB_RANK_1
+        black_king_mask = self.occupied_co[BLACK] & self.kings & BB_RANK_8
+        if not white_king_mask:
+            white_castling = 0
+        if not black_king_mask:
+            black_castling = 0
+
+        # There are only two ways of castling, a-side and h-side, and the
+        # king must be between the rooks.
+        white_a_side = white_castling & -white_castling
+        white_h_side = BB_SQUARES[msb(white_castling)] if white_castling else 0
+
+        if white_a_side and msb(white_a_side) > msb(white_king_mask):
+            white_a_side = 0
+        if white_h_side and msb(white_h_side) < msb(white_king_mask):
+            white_h_side = 0
+
+        black_a_side = black_castling & -black_castling
+        black_h_side = BB_SQUARES[msb(black_castling)] if black_castling else 0
+
+        if black_a_side and msb(black_a_side) > msb(black_king_mask):
+            black_a_side = 0
+        if black_h_side and msb(black_h_side) < msb(black_king_mask):
+            black_h_side = 0
+
+        # Done.
+        return black_a_side | black_h_side | white_a_side | white_h_side
+
+    def generate_pseudo_legal_moves(self, from_mask: Bitboard = BB_ALL, to_mask: Bitboard = BB_ALL) -> Iterator[Move]:
+        our_pieces = self.occupied_co[self.turn]
+        expendable = self._ability_mask(B_EXPENDABLE) if self.abilities else BB_EMPTY
+        unexpendable = our_pieces & ~expendable
+
+        # Generate piece moves.
+        non_pawns = our_pieces & ~self.pawns & from_mask
+        for from_square in scan_reversed(non_pawns):
+            moves = self.attacks_mask(from_square) & ~unexpendable & to_mask
+            for to_square in scan_reversed(moves):
+                yield Move(from_square, to_square)
+
+        # Generate castling moves.
+        if from_mask & self.kings:
+            yield from self.generate_castling_moves(from_mask, to_mask)
+
+        # The remaining moves are all pawn moves.
+        pawns = self.pawns & our_pieces & from_mask
+        if not pawns:
+            return
+
+        if self.abilities:
+            pacifists = self._ability_mask(B_PACIFIST) & self.pawns
+            eagles = self._ability_mask(B_EAGLE) & self.pawns
+        else:
+            pacifists = eagles = BB_EMPTY
+        their_pawns = self.pawns & self.occupied_co[not self.turn]
+        eagle_rank = BB_RANK_7 if self.turn == WHITE else BB_RANK_2
+
+        # Generate pawn captures.
+        capturers = pawns
+        for from_square in scan_reversed(capturers):
+            targets = (
+                BB_PAWN_ATTACKS[self.turn][from_square] &
+                (self.occupied_co[not self.turn] | expendable) & to_mask)
+
+            # Pacifist pawns never take or get taken by enemy pawns.
+            if BB_SQUARES[from_square] & pacifists:
+                targets &= ~their_pawns
+            else:
+                targets &= ~(their_pawns & pacifists)
+
+            for to_square in scan_reversed(targets):
+                if BB_SQUARES[to_square] & BB_BACKRANKS:
+                    yield Move(from_square, to_square, QUEEN)
+                    yield Move(from_square, to_square, ROOK)
+                    yield Move(from_square, to_square, BISHOP)
+                    yield Move(from_square, to_square, KNIGHT)
+                elif BB_SQUARES[from_square] & eagles and BB_SQUARES[to_square] & eagle_rank:
+                    yield Move(from_square, to_square, QUEEN)
+                    yield Move(from_square, to_square, ROOK)
+                    yield Move(from_square, to_square, BISHOP)
+                    yield Move(from_square, to_square, KNIGHT)
+                    yield Move(from_square, to_square)
+                else:
+                    yield Move(from_square, to_square)
+
+        # Prepare pawn advance generation.
+        if self.turn == WHITE:
+            single_moves = pawns << 8 & ~self.occupied
+            double_moves = single_moves << 8 & ~self.occupied & (BB_RANK_3 | BB_RANK_4)
+        else:
+            single_moves = pawns >> 8 & ~self.occupied
+            double_moves = single_moves >> 8 & ~self.occupied & (BB_RANK_6 | BB_RANK_5)
+
+        single_moves &= to_mask
+        double_moves &= to_mask
+
+        # Generate single pawn moves.
+        for to_square in scan_reversed(single_moves):
+            from_square = to_square + (8 if self.turn == BLACK else -8)
+
+            if BB_SQUARES[to_square] & BB_BACKRANKS:
+                yield Move(from_square, to_square, QUEEN)
+                yield Move(from_square, to_square, ROOK)
+                yield Move(from_square, to_square, BISHOP)
+                yield Move(from_square, to_square, KNIGHT)
+            elif BB_SQUARES[from_square] & eagles and BB_SQUARES[to_square] & eagle_rank:
+                yield Move(from_square, to_square, QUEEN)
+                yield Move(from_square, to_square, ROOK)
+                yield Move(from_square, to_square, BISHOP)
+                yield Move(from_square, to_square, KNIGHT)
+                yield Move(from_square, to_square)
+            else:
+                yield Move(from_square, to_square)
+
+        # Generate double pawn moves.
+        for to_square in scan_reversed(double_moves):
+            from_square = to_square + (16 if self.turn == BLACK else -16)
+            yield Move(from_square, to_square)
+
+        # Generate en passant captures.
+        if self.ep_square is not None:
+            yield from self.generate_pseudo_legal_ep(from_mask, to_mask)
+
+    def generate_pseudo_legal_ep(self, from_mask: Bitboard = BB_ALL, to_mask: Bitboard = BB_ALL) -> Iterator[Move]:
+        if self.ep_square is None or not BB_SQUARES[self.ep_square] & to_mask:
+            return
+
+        if BB_SQUARES[self.ep_square] & self.occupied:
+            return
+
+        capturers = (
+            self.pawns & self.occupied_co[self.turn] & from_mask &
+            BB_PAWN_ATTACKS[not self.turn][self.ep_square] &
+            BB_RANKS[4 if self.turn else 3])
+
+        # En passant is a pawn taking a pawn, which pacifists stay out of.
+        if self.abilities:
+            down = -8 if self.turn == WHITE else 8
+            if self.abilities.get(self.ep_square + down, B_NONE) & B_PACIFIST:
+                return
+            capturers &= ~self._ability_mask(B_PACIFIST)
+
+        for capturer in scan_reversed(capturers):
+            yield Move(capturer, self.ep_square)
+
+    def _attacked_for_king(self, path: Bitboard, occupied: Bitboard) -> bool:
+        return any(self._attackers_mask(not self.turn, sq, occupied) for sq in scan_reversed(path))
+
+    def generate_castling_moves(self, from_mask: Bitboard = BB_ALL, to_mask: Bitboard = BB_ALL) -> Iterator[Move]:
+        backrank = BB_RANK_1 if self.turn == WHITE else BB_RANK_8
+        king = self.occupied_co[self.turn] & self.kings & backrank & from_mask
+        king &= -king
+        if not king:
+            return
+
+        # Stubborn and ghost kings may castle out of and through check.
+        stubborn = self.abilities.get(msb(king), B_NONE) & (B_STUBBORN | B_GHOST)
+
+        bb_c = BB_FILE_C & backrank
+        bb_d = BB_FILE_D & backrank
+        bb_f = BB_FILE_F & backrank
+        bb_g = BB_FILE_G & backrank
+
+        # Ghost kings keep their rights even when the rook is gone.
+        rooks = self.rooks & self.occupied_co[self.turn]
+        for candidate in scan_reversed(self.clean_castling_rights() & backrank & rooks & to_mask):
+            rook = BB_SQUARES[candidate]
+
+            a_side = rook < king
+            king_to = bb_c if a_side else bb_g
+            rook_to = bb_d if a_side else bb_f
+
+            king_path = between(msb(king), msb(king_to))
+            rook_path = between(candidate, msb(rook_to))
+
+            if not ((self.occupied ^ king ^ rook) & (king_path | rook_path | king_to | rook_to) or
+                    not stubborn and self._attacked_for_king(king_path | king, self.occupied ^ king) or
+                    self._attacked_for_king(king_to, self.occupied ^ king ^ rook ^ rook_to)):
+                yield Move(msb(king), candidate)
+
+    def _to_chess960(self, move: Move) -> Move:
+        if move.from_square == E1 and self.kings & BB_E1:
+            if move.to_square == G1 and not self.rooks & BB_G1:
+                return Move(E1, H1)
+            elif move.to_square == C1 and not self.rooks & BB_C1:
+                return Move(E1, A1)
+        elif move.from_square == E8 and self.kings & BB_E8:
+            if move.to_square == G8 and not self.rooks & BB_G8:
+                return Move(E8, H8)
+            elif move.to_square == C8 and not self.rooks & BB_C8:
+                return Move(E8, A8)
+
+        return move
+
+    def king_attacks(self) -> tuple[Optional[Square], Bitboard, Bitboard]:
+        # The king of the side to move, the pieces giving check and the
+        # pieces pinned to the king. They are kept until the pieces change,
+        # and pop brings back the ones of the position it returns to.
+        king_attacks = self._king_attacks
+        if king_attacks is None or king_attacks[0] != self.turn:
+            king = self.king(self.turn)
+            if king is None:
+                king_attacks = self.turn, None, BB_EMPTY, BB_EMPTY
+            else:
+                king_attacks = (self.turn, king, self.attackers_mask(not self.turn, king),
+                                self._slider_blockers(king))
+            self._king_attacks = king_attacks
+        return king_attacks[1:]
+
+    def checkers_mask(self) -> Bitboard:
+        return self.king_attacks()[1]
+
+    def is_check(self) -> bool:
+        return bool(self.checkers_mask())
+
+    def gives_check(self, move: Move) -> bool:
+        self.push(move)
+        try:
+            return self.is_check()
+        finally:
+            self.pop()
+
+    def is_into_check(self, move: Move) -> bool:
+        king, checkers, blockers = self.king_attacks()
+        if king is None:
+            return False
+
+        # If already in check, look if it is an evasion.
+        if checkers and move not in self._generate_evasions(
+                king, checkers, BB_SQUARES[move.from_square], BB_SQUARES[move.to_square]):
+            return True
+
+        return not self._is_safe(king, blockers, move)
+
+    def was_into_check(self) -> bool:
+        king = self.king(not self.turn)
+        return king is not None and self.is_attacked_by(self.turn, king)
+
+    def is_pseudo_legal(self, move: Move) -> bool:
+        # Null moves are not pseudo-legal.
+        if not move:
+            return False
+
+        # Source square must not be vacant.
+        piece = self.piece_type_at(move.from_square)
+        if piece is None:
+            return False
+
+        # Get square masks.
+        from_mask = BB_SQUARES[move.from_square]
+        to_mask = BB_SQUARES[move.to_square]
+
+        # Check turn.
+        if not self.occupied_co[self.turn] & from_mask:
+            return False
+
+        # Only pawns can promote and only on the backrank.
+        if move.promotion:
+            if piece != PAWN or move.promotion in {PAWN, KING}:
+                return False
+
+            promotion_ranks = BB_RANK_8 if self.turn == WHITE else BB_RANK_1
+            if self.abilities.get(move.from_square, B_NONE) & B_EAGLE:
+                promotion_ranks |= BB_RANK_7 if self.turn == WHITE else BB_RANK_2
+            if not to_mask & promotion_ranks:
+                return False
+
+        # Handle castling.
+        if piece == KING:
+            move = self._to_chess960(move)
+            if move in self.generate_castling_moves():
+                return True
+
+        # Destination square can not be occupied.
+        unexpendable = self.occupied_co[self.turn] & ~self._ability_mask(B_EXPENDABLE)
+        if unexpendable & to_mask:
+            return False
+
+        # Handle pawn moves.
+        if piece == PAWN:
+            return move in self.generate_pseudo_legal_moves(from_mask, to_mask)
+
+        # Handle all other pieces.
+        return bool(self.attacks_mask(move.from_square) & to_mask)
+
+    def is_legal(self, move: Move) -> bool:
+        return self.is_pseudo_legal(move) and not self.is_into_check(move)
+
+    def is_game_over(self, *, claim_draw: bool = False) -> bool:
+        return self.outcome(claim_draw=claim_draw) is not None
+
+    def outcome(self, *, claim_draw: bool = False) -> Optional[Outcome]:
+        # Normal game end.
+        if not self.has_legal_moves():
+            if self.is_check():
+                return Outcome(Termination.CHECKMATE, not self.turn)
+            return Outcome(Termination.STALEMATE, None)
+
+        if self.is_seventyfive_moves():
+            return Outcome(Termination.SEVENTYFIVE_MOVES, None)
+        if self.is_fivefold_repetition():
+            return Outcome(Termination.FIVEFOLD_REPETITION, None)
+
+        return
+
+    def has_legal_moves(self) -> bool:
+        # Stops at the first legal move. Kept like king_attacks(), so the
+        # game end queries of a position generate at most once.
+        has_legal_moves = self._has_legal_moves
+        if has_legal_moves is None or has_legal_moves[0] != self.turn:
+            has_legal_moves = self.turn, self._find_legal_move()
+            self._has_legal_moves = has_legal_moves
+        return has_legal_moves[1]
+
+    def _find_legal_move(self) -> bool:
+        # Out of check, every move of a piece that is neither the king nor
+        # pinned is legal, so most positions need no move generated.
+        king, checkers, blockers = self.king_attacks()
+        if not checkers:
+            our_pieces = self.occupied_co[self.turn]
+            unexpendable = our_pieces & ~self._ability_mask(B_EXPENDABLE)
+            for square in scan_reversed(our_pieces & ~(self.pawns | self.kings | blockers)):
+                if self.attacks_mask(square) & ~unexpendable:
+                    return True
+        return any(self.generate_legal_moves())
+
+    def is_checkmate(self) -> bool:
+        if not self.is_check():
+            return False
+
+        return not self.has_legal_moves()
+
+    def is_stalemate(self) -> bool:
+        if self.is_check():
+            return False
+
+        return not self.has_legal_moves()
+
+    def _is_halfmoves(self, n: int) -> bool:
+        return self.halfmove_clock >= n and self.has_legal_moves()
+
+    def is_seventyfive_moves(self) -> bool:
+        return self._is_halfmoves(150)
+
+    def is_fivefold_repetition(self) -> bool:
+        return self.is_repetition(5)
+
+    def is_repetition(self, count: int = 3) -> bool:
+        # Only positions since the last zeroing move can repeat, and only
+        # every other one has the same side to move.
+        transposition_key = self._transposition_key()
+        repetitions = 1
+        for state in self._stack[-2:-self.halfmove_clock - 1:-2]:
+            if state.transposition_key == transposition_key:
+                repetitions += 1
+                if repetitions >= count:
+                    return True
+
+        return False
+
+    def is_capture(self, move: Move) -> bool:
+        return bool(BB_SQUARES[move.to_square] & self.occupied_co[not self.turn]) or self.is_en_passant(move)
+
+    def is_en_passant(self, move: Move) -> bool:
+        return (self.ep_square == move.to_square and
+                bool(self.pawns & BB_SQUARES[move.from_square]) and
+                abs(move.to_square - move.from_square) in {7, 9} and
+                not self.occupied & BB_SQUARES[move.to_square])
+
+    def is_zeroing(self, move: Move) -> bool:
+        touched = BB_SQUARES[move.from_square] ^ BB_SQUARES[move.to_square]
+        return bool(touched & self.pawns or touched & self.occupied_co[not self.turn])
+
+    def _reduces_castling_rights(self, move: Move) -> bool:
+        cr = self.clean_castling_rights()
+        touched = BB_SQUARES[move.from_square] ^ BB_SQUARES[move.to_square]
+        return bool(touched & cr or
+                    cr & BB_RANK_1 and touched & self.kings & self.occupied_co[WHITE] or
+                    cr & BB_RANK_8 and touched & self.kings & self.occupied_co[BLACK])
+
+    def is_irreversible(self, move: Move) -> bool:
+        return self.is_zeroing(move) or self._reduces_castling_rights(move) or self.has_legal_en_passant()
+
+    def is_castling(self, move: Move) -> bool:
+        if self.kings & BB_SQUARES[move.from_square]:
+            diff = square_file(move.from_square) - square_file(move.to_square)
+            return abs(diff) > 1 or bool(self.rooks & self.occupied_co[self.turn] & BB_SQUARES[move.to_square])
+        return False
+
+    def _board_state(self, squares: Iterable[Square] = ()) -> _BoardState:
+        return _BoardState(self, squares)
+
+    def _ghost_backranks(self) -> Bitboard:
+        # Ghost kings never lose their castling rights.
+        ghosts = self._ability_mask(B_GHOST) & self.kings
+        backranks = BB_EMPTY
+        if ghosts & self.occupied_co[WHITE]:
+            backranks |= BB_RANK_1
+        if ghosts & self.occupied_co[BLACK]:
+            backranks |= BB_RANK_8
+        return backranks
+
+    def push(self, move: Move) -> None:
+        # Push move and remember board state.
+        move = self._to_chess960(move)
+        touched = []
+        if move and (self.abilities or self.unique_ability):
+            # Moves only carry abilities along, so without any there is
+            # nothing to restore.
+            touched = [move.from_square, move.to_square]
+            if self.kings & BB_SQUARES[move.from_square]:
+                touched += [C1, D1, F1, G1] if self.turn == WHITE else [C8, D8, F8, G8]
+            elif move.to_square == self.ep_square and self.pawns & BB_SQUARES[move.from_square]:
+                touched.append(self.ep_square + (-8 if self.turn == WHITE else 8))
+        board_state = self._board_state(touched)
+        self.castling_rights = self.clean_castling_rights()  # Before pushing stack
+        self.move_stack.append(move)
+        self._stack.append(board_state)
+        self._king_attacks = None
+        self._has_legal_moves = None
+
+        # Reset en passant square.
+        ep_square = self.ep_square
+        self.ep_square = None
+
+        # Increment move counters.
+        self.halfmove_clock += 1
+
+        # On a null move, simply swap turns and reset the en passant square.
+        if not move:
+            self.turn = not self.turn
+            return
+
+        # Zero the half-move clock.
+        if self.is_zeroing(move):
+            self.halfmove_clock = 0
+
+        from_bb = BB_SQUARES[move.from_square]
+        to_bb = BB_SQUARES[move.to_square]
+
+        ghost_backranks = self._ghost_backranks() if self.abilities else BB_EMPTY
+        abilities = self.abilities.get(move.from_square, B_NONE)
+        unique_ability = self.unique_ability.get(move.from_square, B_NONE)
+        piece_type = self._remove_piece_at(move.from_square)
+        assert piece_type is not None, f'push() expects move to be pseudo-legal, but got {move}'
+        capture_square = move.to_square
+        captured_piece_type = self.piece_type_at(capture_square)
+
+        # Update castling rights.
+        castling_rights = self.castling_rights & ~to_bb & ~from_bb
+        if piece_type == KING:
+            if self.turn == WHITE:
+                castling_rights &= ~BB_RANK_1
+            else:
+                castling_rights &= ~BB_RANK_8
+        self.castling_rights = castling_rights | (self.castling_rights & ghost_backranks)
+
+        # Handle special pawn moves.
+        if piece_type == PAWN:
+            diff = move.to_square - move.from_square
+
+            if diff == 16:
+                self.ep_square = move.from_square + 8
+            elif diff == -16:
+                self.ep_square = move.from_square - 8
+            elif move.to_square == ep_square and abs(diff) in {7, 9} and not captured_piece_type:
+                # Remove pawns captured en passant.
+                down = -8 if self.turn == WHITE else 8
+                capture_square = ep_square + down
+                self.remove_piece_at(capture_square)
+
+        # Promotion.
+        if move.promotion:
+            piece_type = move.promotion
+            abilities &= B_TYPE[piece_type]
+            unique_ability = B_NONE
+
+        # Castling.
+        castling = piece_type == KING and self.rooks & self.occupied_co[self.turn] & to_bb
+        if castling:
+            a_side = square_file(move.to_square) < square_file(move.from_square)
+
+            rook_abilities = self.abilities.get(move.to_square, B_NONE)
+            self._remove_piece_at(move.to_square)
+
+            if a_side:
+                self._set_piece_at(C1 if self.turn == WHITE else C8, KING, self.turn, abilities)
+                self._set_piece_at(D1 if self.turn == WHITE else D8, ROOK, self.turn, rook_abilities)
+            else:
+                self._set_piece_at(G1 if self.turn == WHITE else G8, KING, self.turn, abilities)
+                self._set_piece_at(F1 if self.turn == WHITE else F8, ROOK, self.turn, rook_abilities)
+        # Put the piece on the target square.
+        else:
+            self._set_piece_at(move.to_square, piece_type, self.turn, abilities, unique_ability)
+
+        # Swap turn.
+        self.turn = not self.turn
+
+    def pop(self) -> Move:
+        move = self.move_stack.pop()
+        self._stack.pop().restore(self)
+        return move
+
+    def peek(self) -> Move:
+        return self.move_stack[-1]
+
+    def _slider_blockers(self, king: Square) -> Bitboard:
+        rooks_and_queens, bishops_and_queens, riders = self._sliders()
+
+        snipers = ((BB_RANK_ATTACKS[king][0] & rooks_and_queens) |
+                   (BB_FILE_ATTACKS[king][0] & rooks_and_queens) |
+                   (BB_DIAG_ATTACKS[king][0] & bishops_and_queens) |
+                   (BB_RIDER_ATTACKS[king][0] & riders))
+
+        blockers = 0
+
+        for sniper in scan_reversed(snipers & self.occupied_co[not self.turn]):
+            b = between(king, sniper) & self.occupied
+
+            # Add to blockers if exactly one piece in-between.
+            if b and BB_SQUARES[msb(b)] == b:
+                blockers |= b
+
+        return blockers & self.occupied_co[self.turn]
+
+    def _is_safe(self, king: Square, blockers: Bitboard, move: Move) -> bool:
+        if move.from_square == king:
+            if self.is_castling(move):
+                return True
+            else:
+                # Look through the king, so it can not step back along the
+                # line of a slider.
+                return not self._attackers_mask(
+                    not self.turn, move.to_square, self.occupied ^ BB_SQUARES[king])
+        elif self.is_en_passant(move):
+            # Two pieces leave the rank, just try it.
+            self.push(move)
+            try:
+                return not self.was_into_check()
+            finally:
+                self.pop()
+        else:
+            return bool(not blockers & BB_SQUARES[move.from_square] or
+                        ray(move.from_square, move.to_square) & BB_SQUARES[king])
+
+    def _generate_evasions(self, king: Square, checkers: Bitboard,
+                           from_mask: Bitboard = BB_ALL, to_mask: Bitboard = BB_ALL) -> Iterator[Move]:
+        if BB_SQUARES[king] & from_mask:
+            unexpendable = self.occupied_co[self.turn]
+            if self.abilities:
+                unexpendable &= ~self._ability_mask(B_EXPENDABLE)
+            for to_square in scan_reversed(BB_KING_ATTACKS[king] & ~unexpendable & to_mask):
+                yield Move(king, to_square)
+
+            if self.abilities.get(king, B_NONE) & (B_STUBBORN | B_GHOST):
+                yield from self.generate_castling_moves(from_mask, to_mask)
+
+        checker = msb(checkers)
+        if BB_SQUARES[checker] == checkers:
+            # Capture or block a single checker.
+            target = between(king, checker) | checkers
+
+            yield from self.generate_pseudo_legal_moves(~self.kings & from_mask, target & to_mask)
+
+            # Capture the checking pawn en passant (but avoid yielding
+            # duplicate moves).
+            if self.ep_square is not None and not BB_SQUARES[self.ep_square] & target:
+                last_double = self.ep_square + (-8 if self.turn == WHITE else 8)
+                if last_double == checker:
+                    yield from self.generate_pseudo_legal_ep(from_mask, to_mask)
+
+    def generate_legal_ep(self, from_mask: Bitboard = BB_ALL, to_mask: Bitboard = BB_ALL) -> Iterator[Move]:
+        for move in self.generate_pseudo_legal_ep(from_mask, to_mask):
+            if not self.is_into_check(move):
+                yield move
+
+    def generate_legal_moves(self, from_mask: Bitboard = BB_ALL, to_mask: Bitboard = BB_ALL) -> Iterator[Move]:
+        king, checkers, blockers = self.king_attacks()
+        if king is not None:
+            if checkers:
+                for move in self._generate_evasions(king, checkers, from_mask, to_mask):
+                    if self._is_safe(king, blockers, move):
+                        yield move
+            else:
+                for move in self.generate_pseudo_legal_moves(from_mask, to_mask):
+                    if self._is_safe(king, blockers, move):
+                        yield move
+        else:
+            yield from self.generate_pseudo_legal_moves(from_mask, to_mask)
+
+    def generate_legal_captures(self, from_mask: Bitboard = BB_ALL, to_mask: Bitboard = BB_ALL) -> Iterator[Move]:
+        return chain(
+            self.generate_legal_moves(from_mask, to_mask & self.occupied_co[not self.turn]),
+            self.generate_legal_ep(from_mask, to_mask))
+
+    def tactical_moves(self) -> list[Move]:
+        # Captures and promotions, by most valuable victim and then least
+        # valuable attacker. Pawns that are not on the last two ranks can not
+        # promote, and the captures already come with their promotions.
+        if self.turn == WHITE:
+            promoting = self.pawns & self.occupied_co[WHITE] & (BB_RANK_6 | BB_RANK_7)
+        else:
+            promoting = self.pawns & self.occupied_co[BLACK] & (BB_RANK_3 | BB_RANK_2)
+
+        moves = list(self.generate_legal_captures())
+        if promoting:
+            moves += [move for move in self.generate_legal_moves(promoting, ~self.occupied_co[not self.turn] & BB_ALL)
+                      if move.promotion]
+        moves.sort(key=self._mvv_lva)
+        return moves
+
+    def generate_staged_moves(self, hash_move: Optional[Move] = None,
+                              killers: Iterable[Move] = (),
+                              quiet_key: Optional[Callable[[Move], Any]] = None) -> Iterator[Move]:
+        # Legal moves in the order a search wants to try them: the hash move,
+        # the tactical moves, the killer moves, and the remaining quiet moves,
+        # sorted by quiet_key if given. Each stage is only generated once the
+        # previous one is used up.
+        if hash_move is not None and self.is_legal(hash_move):
+            hash_move = self._to_chess960(hash_move)
+            yield hash_move
+        else:
+            hash_move = None
+
+        for move in self.tactical_moves():
+            if move != hash_move:
+                yield move
+
+        quiet_killers = []
+        for move in map(self._to_chess960, killers):
+            if (move != hash_move and move not in quiet_killers and not move.promotion and
+                    not self.is_capture(move) and self.is_legal(move)):
+                quiet_killers.append(move)
+                yield move
+
+        quiets = (move for move in self.generate_legal_moves(BB_ALL, ~self.occupied_co[not self.turn] & BB_ALL)
+                  if not move.promotion and move != hash_move and move not in quiet_killers and
+                  (move.to_square != self.ep_square or not self.is_en_passant(move)))
+        if quiet_key is not None:
+            quiets = sorted(quiets, key=quiet_key)
+        yield from quiets
+
+    def _mvv_lva(self, move: Move) -> tuple[int, int]:
+        # Piece types are in order of value, promotions count as the value
+        # gained on top of the pawn.
+        victim = self.piece_type_at(move.to_square)
+        if victim is None:
+            victim = PAWN if self.is_en_passant(move) else -1
+        gain = victim + 1 + (move.promotion or 0)
+        return -gain, self.piece_type_at(move.from_square)
+
+    def has_legal_en_passant(self) -> bool:
+        return self.ep_square is not None and any(self.generate_legal_ep())
+
+    def zobrist_hash(self) -> int:
+        key = self._zobrist
+        for sq in scan_forward(self.clean_castling_rights()):
+            key ^= ZOBRIST_CASTLING[sq]
+        if self.ep_square is not None and (BB_PAWN_ATTACKS[not self.turn][self.ep_square] &
+                                           self.pawns & self.occupied_co[self.turn]):
+            key ^= ZOBRIST_EP[self.ep_square]
+        if self.turn:
+            key ^= ZOBRIST_TURN
+        return key
+
+    def _transposition_key(self) -> Hashable:
+        return self.zobrist_hash()
+
+
+class PseudoLegalMoveGenerator:
+    def __init__(self, board: Board) -> None:
+        self.board = board
+
+    def __bool__(self) -> bool:
+        return any(self.board.generate_pseudo_legal_moves())
+
+    def count(self) -> int:
+        # List conversion is faster than iterating.
+        return len(list(self))
+
+    def __iter__(self) -> Iterator[Move]:
+        return self.board.generate_pseudo_legal_moves()
+
+    def __contains__(self, move: Move) -> bool:
+        return self.board.is_pseudo_legal(move)
+
+    def __repr__(self) -> str:
+        return '<PseudoLegalMoveGenerator>'
+
+
+class LegalMoveGenerator:
+    def __init__(self, board: Board) -> None:
+        self.board = board
+
+    def __bool__(self) -> bool:
+        return any(self.board.generate_legal_moves())
+
+    def count(self) -> int:
+        # List conversion is faster than iterating.
+        return len(list(self))
+
+    def __iter__(self) -> Iterator[Move]:
+        return self.board.generate_legal_moves()
+
+    def __contains__(self, move: Move) -> bool:
+        return self.board.is_legal(move)
+
+    def __repr__(self) -> str:
+        return '<LegalMoveGenerator>'
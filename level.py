@@ -1,6 +1,9 @@
+from typing import Optional
+
+import intchess
 from numchess import *
 
-__all__ = ['LEVELS', 'get_level_name', 'get_level', 'LEVEL_BOARDS']
+__all__ = ['LEVELS', 'get_level_name', 'get_level', 'level_board', 'LEVEL_BOARDS']
 
 LEVELS = [
     (
@@ -72,14 +75,37 @@ def get_level(index) -> Board:
     king_file = board.king(BLACK)[1]
     for file in range(king_file - 1, 8):
         if board.rooks[7, file]:
-            board.castling_rights |= BB_SQUARES[SQUARES.index((7, file))]
+            board.castling_rights |= BB_SQUARES[SQUARE_INDICES[(7, file)]]
             break
     for file in range(king_file - 1, -1, -1):
         if board.rooks[7, file]:
-            board.castling_rights |= BB_SQUARES[SQUARES.index((7, file))]
+            board.castling_rights |= BB_SQUARES[SQUARE_INDICES[(7, file)]]
             break
 
     return board
 
 
+def level_board(index: int, deck: Optional[list[Piece]] = None) -> intchess.Board:
+    # Set up a level the way the game does, with the full army as the
+    # default deck of the player.
+    if deck is None:
+        deck = LEVELS[-1][1]
+
+    board = get_level(index)
+    for i, piece in enumerate(deck):
+        if piece is not None:
+            board.set_piece_at(divmod(i, 8), Piece(
+                piece.piece_type, WHITE, piece.abilities, piece.unique_ability))
+    board = intchess.Board.from_numchess(board)
+
+    king_file = intchess.square_file(board.king(WHITE))
+    rooks = board.rooks & board.occupied_co[WHITE] & intchess.BB_RANK_1
+    for files in (range(king_file - 1, 8), range(king_file - 1, -1, -1)):
+        for file in files:
+            if rooks & intchess.BB_SQUARES[file]:
+                board.castling_rights |= intchess.BB_SQUARES[file]
+                break
+    return board
+
+
 LEVEL_BOARDS = [get_level(i) for i in range(len(LEVELS))]
@@ -21,6 +21,7 @@ from constants import *
 from function import get_surface
 from game import Game
 from level import get_level_name, LEVEL_BOARDS
+from parallel import SearchPool
 from profile import Profile
 
 
@@ -87,6 +88,8 @@ class Window:
             self.profile = None
         self.game = None
         # self.game.update()
+        # Started once, so no game waits for the worker processes to start.
+        self.search_pool = SearchPool(BOT_WORKERS, BOT_TIMEOUT_MS) if BOT_WORKERS > 1 else None
 
     def update(self, size=None):
         if size is not None:
@@ -315,6 +318,11 @@ class Window:
 
         display_flip()
 
+    def close_game(self):
+        if self.game is not None:
+            self.game.close()
+            self.game = None
+
     def _lmb_up(self):
         self.menu_button_pressed = -1
         self.profile_button_pressed = -1
@@ -375,7 +383,8 @@ class Window:
                         self.update()
                 elif self.menu_button_pressed - 1 + 10 * self.menu_page != self.level_selected:
                     self.level_selected = self.menu_button_pressed - 1 + 10 * self.menu_page
-                    self.game = Game(self.level_selected, self.profile.deck)
+                    self.close_game()
+                    self.game = Game(self.level_selected, self.profile.deck, self.search_pool)
                     self.game.update()
             if self.profile_button_pressed != -1:
                 if self.profile_button_pressed == 0:
@@ -400,7 +409,7 @@ class Window:
                     profiles = get_profiles()
                     self.profile_selected = 0
                     self.level_selected = -1
-                    self.game = None
+                    self.close_game()
                     self.menu_page = 0
                     self.update()
                 else:
@@ -412,7 +421,7 @@ class Window:
                         profiles = get_profiles()
                         self.profile = Profile.load(profiles[profile_index])
                         self.level_selected = -1
-                        self.game = None
+                        self.close_game()
                         self.menu_page = 0
                         self.update()
             self._lmb_up()
@@ -431,6 +440,9 @@ class Window:
 
             for event in get_event():
                 if event.type == QUIT:
+                    self.close_game()
+                    if self.search_pool is not None:
+                        self.search_pool.close()
                     return
                 self.on_event(event)
 
@@ -1,10 +1,15 @@
-from numpy import arange, array, ndarray, ones, where, zeros
+from numpy import arange, array, frombuffer, load, ndarray, ones, savez, where, zeros
 
 from dataclasses import dataclass, field
 from enum import Enum, auto as enumauto
+from hashlib import sha1
+from inspect import getsource
+from os.path import join, split
+from random import Random
 from typing import Hashable, Iterable, Iterator, Optional
 
 from abilities import *
+from fileio import open_atomic
 from constants import *
 
 
@@ -31,6 +36,7 @@ SQUARES = [
 ] = [(r, f) for r in range(8) for f in range(8)]
 FILE_NAMES = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
 RANK_NAMES = ['1', '2', '3', '4', '5', '6', '7', '8']
+SQUARE_INDICES = {sq: index for index, sq in enumerate(SQUARES)}
 SQUARE_NAMES = {(ri, fi): f + r
                 for ri, r in enumerate(RANK_NAMES)
                 for fi, f in enumerate(FILE_NAMES)}
@@ -217,7 +223,7 @@ def _sliding_attacks(square: Square, occupied: BoolBoard, deltas: Iterable[int])
     attacks = BB_EMPTY.copy()
 
     for delta in deltas:
-        sq = SQUARES.index(square)
+        sq = SQUARE_INDICES[square]
 
         while True:
             sq += delta
@@ -254,7 +260,11 @@ def _carry_rippler(mask: BoolBoard) -> Iterator[BoolBoard]:
         if not subset:
             break
 
-def _attack_table(deltas: list[int]) -> tuple[list[BoolBoard], list[dict[int, BoolBoard]]]:
+# Attack tables are keyed by the raw bytes of the masked occupancy, which
+# costs next to nothing to produce from a BoolBoard.
+BB_EMPTY_KEY = BB_EMPTY.tobytes()
+
+def _attack_table(deltas: list[int]) -> tuple[list[BoolBoard], list[dict[bytes, BoolBoard]]]:
     mask_table = []
     attack_table = []
 
@@ -263,46 +273,102 @@ def _attack_table(deltas: list[int]) -> tuple[list[BoolBoard], list[dict[int, Bo
 
         mask = _sliding_attacks(square, BB_EMPTY.copy(), deltas) & ~_edges(square)
         for subset in _carry_rippler(mask):
-            attacks[(BB_TO_FLAG * subset).sum()] = _sliding_attacks(square, subset, deltas)
+            attacks[subset.tobytes()] = _sliding_attacks(square, subset, deltas)
 
         attack_table.append(attacks)
         mask_table.append(mask)
 
     return mask_table, attack_table
 
-BB_DIAG_MASKS, BB_DIAG_ATTACKS = _attack_table([-9, -7, 7, 9])
-BB_FILE_MASKS, BB_FILE_ATTACKS = _attack_table([-8, 8])
-BB_RANK_MASKS, BB_RANK_ATTACKS = _attack_table([-1, 1])
-BB_RIDER_MASKS, BB_RIDER_ATTACKS = _attack_table([17, 15, 10, 6, -17, -15, -10, -6])
-
-
 def _rays() -> list[list[BoolBoard]]:
     rays = []
     for a, bb_a in enumerate(BB_SQUARES):
         rays_row = []
         for b, bb_b in enumerate(BB_SQUARES):
-            if (BB_DIAG_ATTACKS[a][0] & bb_b).any():
-                rays_row.append((BB_DIAG_ATTACKS[a][0] & BB_DIAG_ATTACKS[b][0]) | bb_a | bb_b)
-            elif (BB_RANK_ATTACKS[a][0] & bb_b).any():
-                rays_row.append(BB_RANK_ATTACKS[a][0] | bb_a)
-            elif (BB_FILE_ATTACKS[a][0] & bb_b).any():
-                rays_row.append(BB_FILE_ATTACKS[a][0] | bb_a)
-            elif (BB_RIDER_ATTACKS[a][0] & bb_b).any():
-                rays_row.append(BB_RIDER_ATTACKS[a][0] | bb_a)
+            if (BB_DIAG_ATTACKS[a][BB_EMPTY_KEY] & bb_b).any():
+                rays_row.append((BB_DIAG_ATTACKS[a][BB_EMPTY_KEY] & BB_DIAG_ATTACKS[b][BB_EMPTY_KEY]) | bb_a | bb_b)
+            elif (BB_RANK_ATTACKS[a][BB_EMPTY_KEY] & bb_b).any():
+                rays_row.append(BB_RANK_ATTACKS[a][BB_EMPTY_KEY] | bb_a)
+            elif (BB_FILE_ATTACKS[a][BB_EMPTY_KEY] & bb_b).any():
+                rays_row.append(BB_FILE_ATTACKS[a][BB_EMPTY_KEY] | bb_a)
+            elif (BB_RIDER_ATTACKS[a][BB_EMPTY_KEY] & bb_b).any():
+                rays_row.append(BB_RIDER_ATTACKS[a][BB_EMPTY_KEY] | bb_a)
             else:
                 rays_row.append(BB_EMPTY.copy())
         rays.append(rays_row)
     return rays
 
-BB_RAYS = _rays()
+
+# Building the tables above takes most of the import time, so they are cached
+# next to the module. The cache is keyed by the deltas and the source of the
+# code that builds and stores them, and is rebuilt whenever those change.
+TABLES_PATH = join(split(__file__)[0], '__pycache__', 'numchess_tables.npz')
+TABLE_NAMES = ['diag', 'file', 'rank', 'rider']
+TABLE_DELTAS = [[-9, -7, 7, 9], [-8, 8], [-1, 1], [17, 15, 10, 6, -17, -15, -10, -6]]
+
+def _save_tables(path: str, tables: list[tuple[list[BoolBoard], list[dict[bytes, BoolBoard]]]],
+                 rays: list[list[BoolBoard]], version: str) -> None:
+    arrays = {'version': array(version), 'rays': array(rays)}
+    for name, (mask_table, attack_table) in zip(TABLE_NAMES, tables):
+        arrays[f'{name}_masks'] = array(mask_table)
+        arrays[f'{name}_sizes'] = array([len(attacks) for attacks in attack_table])
+        arrays[f'{name}_subsets'] = array([frombuffer(key, dtype=bool)
+                                           for attacks in attack_table for key in attacks])
+        arrays[f'{name}_attacks'] = array([bb for attacks in attack_table for bb in attacks.values()])
+
+    with open_atomic(path) as file:
+        savez(file, **arrays)
+
+def _load_tables(path: str, version: str) -> tuple[list[tuple[list[BoolBoard], list[dict[bytes, BoolBoard]]]],
+                                                   list[list[BoolBoard]]]:
+    with load(path) as data:
+        if str(data['version']) != version:
+            raise ValueError(f'stale attack tables in {path}')
+
+        tables = []
+        for name in TABLE_NAMES:
+            subsets = data[f'{name}_subsets']
+            bbs = data[f'{name}_attacks']
+            attack_table = []
+            start = 0
+            for size in data[f'{name}_sizes'].tolist():
+                attack_table.append({subsets[i].tobytes(): bbs[i] for i in range(start, start + size)})
+                start += size
+            tables.append((list(data[f'{name}_masks']), attack_table))
+
+        return tables, [list(rays_row) for rays_row in data['rays']]
+
+def _tables_version() -> str:
+    return sha1((repr(TABLE_DELTAS) + ''.join(
+        getsource(function) for function in (
+            _sliding_attacks, _step_attacks, _edges, _carry_rippler,
+            _attack_table, _rays, _save_tables, _load_tables))).encode()).hexdigest()
+
+# Without the source to key it, as in a frozen build, nothing is cached.
+_version = None
+try:
+    _version = _tables_version()
+    _tables, BB_RAYS = _load_tables(TABLES_PATH, _version)
+    [(BB_DIAG_MASKS, BB_DIAG_ATTACKS), (BB_FILE_MASKS, BB_FILE_ATTACKS),
+     (BB_RANK_MASKS, BB_RANK_ATTACKS), (BB_RIDER_MASKS, BB_RIDER_ATTACKS)] = _tables
+except (OSError, KeyError, TypeError, ValueError):
+    _tables = [_attack_table(deltas) for deltas in TABLE_DELTAS]
+    [(BB_DIAG_MASKS, BB_DIAG_ATTACKS), (BB_FILE_MASKS, BB_FILE_ATTACKS),
+     (BB_RANK_MASKS, BB_RANK_ATTACKS), (BB_RIDER_MASKS, BB_RIDER_ATTACKS)] = _tables
+    BB_RAYS = _rays()
+    if _version is not None:
+        try:
+            _save_tables(TABLES_PATH, _tables, BB_RAYS, _version)
+        except OSError:
+            pass
 
 def ray(a: Square, b: Square) -> BoolBoard:
-    return BB_RAYS[SQUARES.index(a)][SQUARES.index(b)]
+    return BB_RAYS[SQUARE_INDICES[a]][SQUARE_INDICES[b]]
 
 def between(a: Square, b: Square) -> BoolBoard:
     mask = BB_EMPTY.copy().reshape((64,))
-    mask[SQUARES.index(a):SQUARES.index(b)] = True
-    bb = BB_RAYS[SQUARES.index(a)][SQUARES.index(b)] & mask.reshape((8, 8))
+    mask[SQUARE_INDICES[a]:SQUARE_INDICES[b]] = True
+    bb = BB_RAYS[SQUARE_INDICES[a]][SQUARE_INDICES[b]] & mask.reshape((8, 8))
     bb = bb.reshape((64,))
     bb[lsb(bb)] = False
     return bb.reshape((8, 8))
@@ -312,6 +378,34 @@ AbBoard = ndarray
 AB_EMPTY = zeros((8, 8), dtype='int32')
 UnqAbBoard = ndarray
 UB_EMPTY = zeros((8, 8), dtype='int8')
+# One bool board per ability bit, of the pieces that have it.
+ABILITY_COUNT = max(FLAGS.values()).bit_length()
+ABILITY_SHIFTS = arange(ABILITY_COUNT)
+
+
+# Fixed seed, so hashes agree between runs and processes.
+_zobrist_random = Random(0x6368657373636861)
+ZOBRIST_PIECES = [[[_zobrist_random.getrandbits(64) for _ in range(64)]
+                   for _ in PIECE_TYPES] for _ in COLORS]
+ZOBRIST_ABILITIES = [[_zobrist_random.getrandbits(64) for _ in range(64)]
+                     for _ in FLAGS]
+ZOBRIST_UNIQUE_ABILITIES = [[_zobrist_random.getrandbits(64) for _ in range(64)]
+                            for _ in range(max(B_UNIQUE_TYPE) + 1)]
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for _ in range(64)]
+ZOBRIST_EP = [_zobrist_random.getrandbits(64) for _ in range(64)]
+ZOBRIST_TURN = _zobrist_random.getrandbits(64)
+
+
+def zobrist_piece(index: int, piece_type: PieceType, color: Color,
+                  abilities: int = B_NONE, unique_ability: int = B_NONE) -> int:
+    key = ZOBRIST_PIECES[color][piece_type][index]
+    while abilities:
+        bit = abilities & -abilities
+        key ^= ZOBRIST_ABILITIES[bit.bit_length() - 1][index]
+        abilities ^= bit
+    if unique_ability:
+        key ^= ZOBRIST_UNIQUE_ABILITIES[unique_ability][index]
+    return key
 
 
 @dataclass
@@ -346,10 +440,17 @@ class _BoardState:
         self.occupied_b = board.occupied_co[BLACK].copy()
         self.occupied = board.occupied.copy()
 
+        self.abilities = board.abilities.copy()
+        self.unique_ability = board.unique_ability.copy()
+        self.ability_boards = board.ability_boards.copy()
+
         self.turn = board.turn
         self.castling_rights = board.castling_rights.copy()
         self.halfmove_clock = board.halfmove_clock
 
+        self.zobrist = board._zobrist
+        self.transposition_key = board._transposition_key()
+
     def restore(self, board) -> None:
         board.pawns = self.pawns.copy()
         board.knights = self.knights.copy()
@@ -362,10 +463,16 @@ class _BoardState:
         board.occupied_co[BLACK] = self.occupied_b.copy()
         board.occupied = self.occupied.copy()
 
+        board.abilities = self.abilities.copy()
+        board.unique_ability = self.unique_ability.copy()
+        board.ability_boards = self.ability_boards.copy()
+
         board.turn = self.turn
         board.castling_rights = self.castling_rights.copy()
         board.halfmove_clock = self.halfmove_clock
 
+        board._zobrist = self.zobrist
+
 
 class Board:
     turn: Color = WHITE
@@ -380,6 +487,7 @@ class Board:
 
     abilities: AbBoard = AB_EMPTY
     unique_ability: UnqAbBoard = UB_EMPTY
+    ability_boards: ndarray = zeros((ABILITY_COUNT, 8, 8), dtype=bool)
 
     castling_rights: BoolBoard = BB_EMPTY.copy()
     last_move: Optional[Move] = None
@@ -387,6 +495,9 @@ class Board:
     move_stack: list[Move] = []
     _stack: list[_BoardState] = []
 
+    # Zobrist hash of the pieces and their abilities, see zobrist_hash().
+    _zobrist: int = 0
+
     def __init__(self):
         self.clear_board()
 
@@ -398,18 +509,21 @@ class Board:
         self.queens = BB_EMPTY.copy()
         self.kings = BB_EMPTY.copy()
 
-        self.occupied_co[BLACK] = BB_EMPTY.copy()
-        self.occupied_co[WHITE] = BB_EMPTY.copy()
+        # Fresh lists and arrays, the class defaults are shared by every board.
+        self.occupied_co = [BB_EMPTY.copy(), BB_EMPTY.copy()]
         self.occupied = BB_EMPTY.copy()
 
-        self.abilities = AB_EMPTY
-        self.unique_ability = UB_EMPTY
+        self.abilities = AB_EMPTY.copy()
+        self.unique_ability = UB_EMPTY.copy()
+        self.ability_boards = zeros((ABILITY_COUNT, 8, 8), dtype=bool)
 
         self.castling_rights = BB_EMPTY.copy()
         self.last_move = None
         self.halfmove_clock = 0
+        self._zobrist = 0
 
-        self.clear_stack()
+        self.move_stack = []
+        self._stack = []
 
     def clear_stack(self) -> None:
         self.move_stack.clear()
@@ -423,7 +537,7 @@ class Board:
                          self.unique_ability[square])
 
     def piece_type_at(self, square: Square) -> Optional[PieceType]:
-        mask = BB_SQUARES[SQUARES.index(square)]
+        mask = BB_SQUARES[SQUARE_INDICES[square]]
 
         if not self.occupied[square]:
             return
@@ -463,45 +577,54 @@ class Board:
         return SQUARES[msb(king_mask)] if king_mask.any() else None
 
     def attacks_mask(self, square: Square) -> BoolBoard:
-        square_index = SQUARES.index(square)
+        square_index = SQUARE_INDICES[square]
         bb_square = BB_SQUARES[square_index]
 
         if (bb_square & self.pawns).any():
-            color = self.occupied_co[WHITE][square_index]
+            color = bool(self.occupied_co[WHITE][square])
             return BB_PAWN_ATTACKS[color][square_index]
-        elif (bb_square & self.knights).any():
-            return BB_KNIGHT_ATTACKS[square_index]
-        elif (bb_square & self.kings).any():
-            return BB_KING_ATTACKS[square_index]
-        else:
-            attacks = 0
-            if (bb_square & self.bishops).any() or (bb_square & self.queens).any():
-                attacks = BB_DIAG_ATTACKS[square_index][(BB_TO_FLAG * (BB_DIAG_MASKS[square_index] & self.occupied)).sum()]
-            if (bb_square & self.rooks).any() or (bb_square & self.queens).any():
-                attacks |= (BB_RANK_ATTACKS[square_index][(BB_TO_FLAG * (BB_RANK_MASKS[square_index] & self.occupied)).sum()] |
-                            BB_FILE_ATTACKS[square_index][(BB_TO_FLAG * (BB_FILE_MASKS[square_index] & self.occupied)).sum()])
-            return attacks
+
+        # Abilities add moves the way _attackers_mask counts them.
+        abilities = self.abilities[square]
+        attacks = BB_EMPTY
+        if (bb_square & self.kings).any() or abilities & B_SNEAKER:
+            attacks = BB_KING_ATTACKS[square_index]
+        if abilities & B_RIDER:
+            attacks = attacks | BB_RIDER_ATTACKS[square_index][(BB_RIDER_MASKS[square_index] & self.occupied).tobytes()]
+        elif (bb_square & self.knights).any() or abilities & B_LEAPER:
+            attacks = attacks | BB_KNIGHT_ATTACKS[square_index]
+        if (bb_square & (self.bishops | self.queens)).any() or abilities & B_SHIFTY:
+            attacks = attacks | BB_DIAG_ATTACKS[square_index][(BB_DIAG_MASKS[square_index] & self.occupied).tobytes()]
+        if (bb_square & (self.rooks | self.queens)).any() or abilities & B_RUTHLESS:
+            attacks = attacks | (BB_RANK_ATTACKS[square_index][(BB_RANK_MASKS[square_index] & self.occupied).tobytes()] |
+                                 BB_FILE_ATTACKS[square_index][(BB_FILE_MASKS[square_index] & self.occupied).tobytes()])
+        return attacks
+
+    def _ability_board(self, flag: int) -> BoolBoard:
+        # Kept up to date by set_piece_at and remove_piece_at, for a single
+        # ability flag.
+        return self.ability_boards[flag.bit_length() - 1]
 
     def _attackers_mask(self, color: Color, square: Square, occupied: BoolBoard) -> BoolBoard:
-        index = SQUARES.index(square)
+        index = SQUARE_INDICES[square]
         rank_pieces = BB_RANK_MASKS[index] & occupied
         file_pieces = BB_FILE_MASKS[index] & occupied
         diag_pieces = BB_DIAG_MASKS[index] & occupied
         rider_pieces = BB_RIDER_MASKS[index] & occupied
 
-        kings = self.kings | (self.abilities & B_SNEAKER).astype(bool)
-        riders = (self.abilities & B_RIDER).astype(bool)
-        knights = (self.knights | (self.abilities & B_LEAPER).astype(bool)) & ~riders
-        queens_and_rooks = self.queens | self.rooks | (self.abilities & B_RUTHLESS).astype(bool)
-        queens_and_bishops = self.queens | self.bishops | (self.abilities & B_SHIFTY).astype(bool)
+        kings = self.kings | self._ability_board(B_SNEAKER)
+        riders = self._ability_board(B_RIDER)
+        knights = (self.knights | self._ability_board(B_LEAPER)) & ~riders
+        queens_and_rooks = self.queens | self.rooks | self._ability_board(B_RUTHLESS)
+        queens_and_bishops = self.queens | self.bishops | self._ability_board(B_SHIFTY)
 
         attackers = (
             (BB_KING_ATTACKS[index] & kings) |
             (BB_KNIGHT_ATTACKS[index] & knights) |
-            (BB_RANK_ATTACKS[index][(BB_TO_FLAG * rank_pieces).sum()] & queens_and_rooks) |
-            (BB_FILE_ATTACKS[index][(BB_TO_FLAG * file_pieces).sum()] & queens_and_rooks) |
-            (BB_DIAG_ATTACKS[index][(BB_TO_FLAG * diag_pieces).sum()] & queens_and_bishops) |
-            (BB_RIDER_ATTACKS[index][(BB_TO_FLAG * rider_pieces).sum()] & riders) |
+            (BB_RANK_ATTACKS[index][rank_pieces.tobytes()] & queens_and_rooks) |
+            (BB_FILE_ATTACKS[index][file_pieces.tobytes()] & queens_and_rooks) |
+            (BB_DIAG_ATTACKS[index][diag_pieces.tobytes()] & queens_and_bishops) |
+            (BB_RIDER_ATTACKS[index][rider_pieces.tobytes()] & riders) |
             (BB_PAWN_ATTACKS[not color][index] & self.pawns))
 
         return attackers & self.occupied_co[color]
@@ -517,14 +640,14 @@ class Board:
         if king is None:
             return BB_ALL.copy()
 
-        square_mask = BB_SQUARES[SQUARES.index(square)]
+        square_mask = BB_SQUARES[SQUARE_INDICES[square]]
 
-        riders = (self.abilities & B_RIDER).astype(bool)
+        riders = self._ability_board(B_RIDER)
         for attacks, sliders in [(BB_FILE_ATTACKS, self.rooks | self.queens),
                                  (BB_RANK_ATTACKS, self.rooks | self.queens),
                                  (BB_DIAG_ATTACKS, self.bishops | self.queens),
                                  (BB_RIDER_ATTACKS, riders)]:
-            rays = attacks[king][0]
+            rays = attacks[king][BB_EMPTY_KEY]
             if rays & square_mask:
                 snipers = rays & sliders & self.occupied_co[not color]
                 for sniper in scan_reversed(snipers):
@@ -538,8 +661,8 @@ class Board:
     def remove_piece_at(self, square: Square) -> Optional[Piece]:
         if not self.occupied[square]:
             return
-        mask = BB_SQUARES[SQUARES.index(square)]
-        color = self.occupied_co[WHITE][square]
+        mask = BB_SQUARES[SQUARE_INDICES[square]]
+        color = bool(self.occupied_co[WHITE][square])
 
         if (self.pawns & mask).any():
             self.pawns[square] = False
@@ -562,10 +685,13 @@ class Board:
 
         self.occupied[square] = False
         self.occupied_co[color][square] = False
-        abilities = self.abilities[square]
-        unique_ability = self.unique_ability[square]
+        abilities = int(self.abilities[square])
+        unique_ability = int(self.unique_ability[square])
         self.abilities[square] = 0
         self.unique_ability[square] = 0
+        self.ability_boards[:, square[0], square[1]] = False
+        self._zobrist ^= zobrist_piece(square[0] * 8 + square[1], piece_type, color,
+                                       abilities, unique_ability)
 
         return Piece(piece_type, color, abilities, unique_ability)
 
@@ -576,7 +702,7 @@ class Board:
 
         piece_type = piece.piece_type
 
-        mask = BB_SQUARES[SQUARES.index(square)]
+        mask = BB_SQUARES[SQUARE_INDICES[square]]
 
         if piece_type == PAWN:
             self.pawns |= mask
@@ -598,6 +724,9 @@ class Board:
 
         self.abilities[square] = piece.abilities
         self.unique_ability[square] = piece.unique_ability
+        self.ability_boards[:, square[0], square[1]] = int(piece.abilities) >> ABILITY_SHIFTS & 1
+        self._zobrist ^= zobrist_piece(square[0] * 8 + square[1], piece_type, bool(piece.color),
+                                       int(piece.abilities), int(piece.unique_ability))
 
     def __str__(self) -> str:
         builder = []
@@ -638,6 +767,7 @@ class Board:
         board.castling_rights = self.castling_rights
         board.last_move = self.last_move
         board.halfmove_clock = self.halfmove_clock
+        board._zobrist = self._zobrist
         board.move_stack = self.move_stack
         board._stack = self._stack
 
@@ -691,7 +821,7 @@ class Board:
             to_mask = BB_ALL.copy()
 
         our_pieces = self.occupied_co[self.turn]
-        unexpendable = our_pieces & ~(self.abilities & B_EXPENDABLE).astype(bool)
+        unexpendable = our_pieces & ~self._ability_board(B_EXPENDABLE)
 
         # Generate piece moves.
         non_pawns = our_pieces & ~self.pawns & from_mask
@@ -709,13 +839,22 @@ class Board:
         if not pawns.any():
             return
 
+        pacifists = self._ability_board(B_PACIFIST) & self.pawns
+        their_pawns = self.pawns & self.occupied_co[not self.turn]
+
         # Generate pawn captures.
         capturers = pawns
         for from_square in scan_reversed(capturers):
             targets = (
-                BB_PAWN_ATTACKS[self.turn][SQUARES.index(from_square)] &
+                BB_PAWN_ATTACKS[self.turn][SQUARE_INDICES[from_square]] &
                 (self.occupied_co[not self.turn] |
-                 (self.abilities & B_EXPENDABLE).astype(bool)) & to_mask)
+                 self._ability_board(B_EXPENDABLE)) & to_mask)
+
+            # Pacifist pawns never take or get taken by enemy pawns.
+            if self.abilities[from_square] & B_PACIFIST:
+                targets = targets & ~their_pawns
+            else:
+                targets = targets & ~(their_pawns & pacifists)
 
             for to_square in scan_reversed(targets):
                 if to_square[0] in {0, 7}:
@@ -825,7 +964,7 @@ class Board:
         bb_g = BB_FILE_G & backrank
 
         for candidate in scan_reversed(self.clean_castling_rights() & backrank & to_mask):
-            rook = BB_SQUARES[SQUARES.index(candidate)]
+            rook = BB_SQUARES[SQUARE_INDICES[candidate]]
 
             a_side = rook < king
             king_to = bb_c if a_side else bb_g
@@ -880,8 +1019,8 @@ class Board:
         # If already in check, look if it is an evasion.
         checkers = self.attackers_mask(not self.turn, king)
         if checkers.any() and move not in self._generate_evasions(
-                king, checkers, BB_SQUARES[SQUARES.index(move.from_square)],
-                BB_SQUARES[SQUARES.index(move.to_square)]):
+                king, checkers, BB_SQUARES[SQUARE_INDICES[move.from_square]],
+                BB_SQUARES[SQUARE_INDICES[move.to_square]]):
             return True
 
         return not self._is_safe(king, self._slider_blockers(king), move)
@@ -908,8 +1047,8 @@ class Board:
                         return False
 
         # Get square masks.
-        from_mask = BB_SQUARES[SQUARES.index(move.from_square)]
-        to_mask = BB_SQUARES[SQUARES.index(move.to_square)]
+        from_mask = BB_SQUARES[SQUARE_INDICES[move.from_square]]
+        to_mask = BB_SQUARES[SQUARE_INDICES[move.to_square]]
 
         # Check turn.
         if not (self.occupied_co[self.turn] & from_mask).any():
@@ -938,7 +1077,7 @@ class Board:
                 return True
 
         # Destination square can not be occupied.
-        unexpendable = self.occupied_co[self.turn] & ~(self.abilities & B_EXPENDABLE).astype(bool)
+        unexpendable = self.occupied_co[self.turn] & ~self._ability_board(B_EXPENDABLE)
         if (unexpendable & to_mask).any():
             return False
 
@@ -991,40 +1130,16 @@ class Board:
         return self.is_repetition(5)
 
     def is_repetition(self, count: int = 3) -> bool:
-        # Fast check, based on occupancy only.
-        maybe_repetitions = 1
-        for state in reversed(self._stack):
-            if (state.occupied == self.occupied).all():
-                maybe_repetitions += 1
-                if maybe_repetitions >= count:
-                    break
-        if maybe_repetitions < count:
-            return False
-
-        # Check full replay.
+        # Only positions since the last zeroing move can repeat, and only
+        # every other one has the same side to move.
         transposition_key = self._transposition_key()
-        switchyard = []
-
-        try:
-            while True:
-                if count <= 1:
+        repetitions = 1
+        for state in self._stack[-2:-self.halfmove_clock - 1:-2]:
+            if state.transposition_key == transposition_key:
+                repetitions += 1
+                if repetitions >= count:
                     return True
 
-                if len(self.move_stack) < count - 1:
-                    break
-
-                move = self.pop()
-                switchyard.append(move)
-
-                if self.is_irreversible(move):
-                    break
-
-                if self._transposition_key() == transposition_key:
-                    count -= 1
-        finally:
-            while switchyard:
-                self.push(switchyard.pop())
-
         return False
 
     def is_en_passant(self, move: Move) -> bool:
@@ -1032,12 +1147,12 @@ class Board:
         if ep_square is None:
             return False
         return (ep_square == move.to_square and
-                self.pawns & BB_SQUARES[SQUARES.index(move.from_square)].any() and
+                self.pawns & BB_SQUARES[SQUARE_INDICES[move.from_square]].any() and
                 abs(move.to_square - move.from_square) in {7, 8, 9} and
                 not self.occupied[move.to_square])
 
     def is_zeroing(self, move: Move) -> bool:
-        touched = BB_SQUARES[SQUARES.index(move.from_square)] ^ BB_SQUARES[SQUARES.index(move.to_square)]
+        touched = BB_SQUARES[SQUARE_INDICES[move.from_square]] ^ BB_SQUARES[SQUARE_INDICES[move.to_square]]
         return (touched & self.pawns).any() or (touched & self.occupied_co[not self.turn]).any()
 
     def _reduces_castling_rights(self, move: Move) -> bool:
@@ -1051,9 +1166,9 @@ class Board:
         return self.is_zeroing(move) or self._reduces_castling_rights(move) or self.has_legal_en_passant()
 
     def is_castling(self, move: Move) -> bool:
-        if (self.kings & BB_SQUARES[SQUARES.index(move.from_square)]).any():
+        if (self.kings & BB_SQUARES[SQUARE_INDICES[move.from_square]]).any():
             diff = move.from_square[1] - move.to_square[1]
-            return abs(diff) > 1 or (self.rooks & self.occupied_co[self.turn] & BB_SQUARES[SQUARES.index(move.to_square)]).any()
+            return abs(diff) > 1 or (self.rooks & self.occupied_co[self.turn] & BB_SQUARES[SQUARE_INDICES[move.to_square]]).any()
         return False
 
     def _board_state(self) -> _BoardState:
@@ -1079,8 +1194,8 @@ class Board:
         if self.is_zeroing(move):
             self.halfmove_clock = 0
 
-        from_bb = BB_SQUARES[SQUARES.index(move.from_square)]
-        to_bb = BB_SQUARES[SQUARES.index(move.to_square)]
+        from_bb = BB_SQUARES[SQUARE_INDICES[move.from_square]]
+        to_bb = BB_SQUARES[SQUARE_INDICES[move.to_square]]
 
         piece = self.remove_piece_at(move.from_square)
         assert piece is not None, f'push() expects move to be pseudo-legal, but got {move}'
@@ -1103,9 +1218,15 @@ class Board:
                 elif self.turn == BLACK and move.to_square[0] == 0:
                     self.castling_rights &= ~BB_RANK_1
 
+        # En passant, the taken pawn is beside the target square.
+        if (piece_type == PAWN and captured_piece_type is None and
+                move.to_square[1] != move.from_square[1]):
+            self.remove_piece_at((move.from_square[0], move.to_square[1]))
+
         # Promotion.
         if move.promotion:
             piece_type = move.promotion
+            piece = Piece(piece_type, piece.color, piece.abilities, piece.unique_ability)
 
         # Castling.
         castling = (piece_type == KING) and (self.occupied_co[self.turn] & to_bb).any()
@@ -1148,14 +1269,14 @@ class Board:
 
         # Horizontal attack on the fifth or fourth rank.
         horizontal_attackers = self.occupied_co[not self.turn] & (self.rooks | self.queens)
-        if (BB_RANK_ATTACKS[king][BB_RANK_MASKS[king] & occupancy] & horizontal_attackers).any():
+        if (BB_RANK_ATTACKS[king][(BB_RANK_MASKS[king] & occupancy).tobytes()] & horizontal_attackers).any():
             return True
 
         # Diagonal skewers. These are not actually possible in a real game,
         # because if the latest double pawn move covers a diagonal attack,
         # then the other side would have been in check already.
         diagonal_attackers = self.occupied_co[not self.turn] & (self.bishops | self.queens)
-        if (BB_DIAG_ATTACKS[king][BB_DIAG_MASKS[king] & occupancy] & diagonal_attackers).any():
+        if (BB_DIAG_ATTACKS[king][(BB_DIAG_MASKS[king] & occupancy).tobytes()] & diagonal_attackers).any():
             return True
 
         return False
@@ -1163,12 +1284,12 @@ class Board:
     def _slider_blockers(self, king: Square) -> BoolBoard:
         rooks_and_queens = self.rooks | self.queens
         bishops_and_queens = self.bishops | self.queens
-        riders = (self.abilities & B_RIDER).astype(bool)
+        riders = self._ability_board(B_RIDER)
 
-        snipers = ((BB_RANK_ATTACKS[SQUARES.index(king)][0] & rooks_and_queens) |
-                   (BB_FILE_ATTACKS[SQUARES.index(king)][0] & rooks_and_queens) |
-                   (BB_DIAG_ATTACKS[SQUARES.index(king)][0] & bishops_and_queens) |
-                   (BB_RIDER_ATTACKS[SQUARES.index(king)][0] & riders))
+        snipers = ((BB_RANK_ATTACKS[SQUARE_INDICES[king]][BB_EMPTY_KEY] & rooks_and_queens) |
+                   (BB_FILE_ATTACKS[SQUARE_INDICES[king]][BB_EMPTY_KEY] & rooks_and_queens) |
+                   (BB_DIAG_ATTACKS[SQUARE_INDICES[king]][BB_EMPTY_KEY] & bishops_and_queens) |
+                   (BB_RIDER_ATTACKS[SQUARE_INDICES[king]][BB_EMPTY_KEY] & riders))
 
         blockers = 0
 
@@ -1188,10 +1309,10 @@ class Board:
             else:
                 return not self.is_attacked_by(not self.turn, move.to_square)
         elif self.is_en_passant(move):
-            return bool((self.pin_mask(self.turn, move.from_square) & BB_SQUARES[SQUARES.index(move.to_square)]).any() and
+            return bool((self.pin_mask(self.turn, move.from_square) & BB_SQUARES[SQUARE_INDICES[move.to_square]]).any() and
                         not self._ep_skewered(king, move.from_square))
         else:
-            return bool(not (blockers & BB_SQUARES[SQUARES.index(move.from_square)]).any() or
+            return bool(not (blockers & BB_SQUARES[SQUARE_INDICES[move.from_square]]).any() or
                         (ray(move.from_square, move.to_square) & BB_SQUARES[king]).any())
 
     def _generate_evasions(self, king: Square, checkers: BoolBoard,
@@ -1205,10 +1326,10 @@ class Board:
 
         attacked = 0
         for checker in scan_reversed(sliders):
-            attacked |= ray(king, checker) & ~BB_SQUARES[SQUARES.index(checker)]
+            attacked |= ray(king, checker) & ~BB_SQUARES[SQUARE_INDICES[checker]]
 
-        if (BB_SQUARES[SQUARES.index(king)] & from_mask).any():
-            for to_square in scan_reversed(BB_KING_ATTACKS[SQUARES.index(king)] & ~self.occupied_co[self.turn] & ~attacked & to_mask):
+        if (BB_SQUARES[SQUARE_INDICES[king]] & from_mask).any():
+            for to_square in scan_reversed(BB_KING_ATTACKS[SQUARE_INDICES[king]] & ~self.occupied_co[self.turn] & ~attacked & to_mask):
                 yield Move(king, to_square)
 
         checker = msb(checkers)
@@ -1263,16 +1384,21 @@ class Board:
     def has_legal_en_passant(self) -> bool:
         return self.get_ep_square() is not None and any(self.generate_legal_ep())
 
+    def zobrist_hash(self) -> int:
+        key = self._zobrist
+        for index in where(self.castling_rights.reshape((64,)))[0]:
+            key ^= ZOBRIST_CASTLING[index]
+        ep_square = self.get_ep_square()
+        if ep_square is not None and self.pawns[self.last_move.to_square]:
+            index = ep_square[0] * 8 + ep_square[1]
+            if (BB_PAWN_ATTACKS[not self.turn][index] & self.pawns & self.occupied_co[self.turn]).any():
+                key ^= ZOBRIST_EP[index]
+        if self.turn:
+            key ^= ZOBRIST_TURN
+        return key
+
     def _transposition_key(self) -> Hashable:
-        keys = [self.pawns, self.knights, self.bishops, self.rooks,
-                self.queens, self.kings,
-                self.occupied_co[WHITE], self.occupied_co[BLACK],
-                self.turn, self.clean_castling_rights(),
-                self.ep_square if self.has_legal_en_passant() else None]
-        return tuple(
-            (BB_TO_FLAG * item).sum() if isinstance(item, ndarray) else item
-            for item in keys
-        )
+        return self.zobrist_hash()
 
 
 class PseudoLegalMoveGenerator:
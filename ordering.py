@@ -0,0 +1,55 @@
+from typing import Optional
+
+from intchess import Board, Move, PIECE_TYPES
+
+
+__all__ = ['KILLER_SLOTS', 'MoveOrdering']
+
+KILLER_SLOTS = 2
+MAX_PLY = 128
+
+
+# Quiet moves that caused a beta cutoff are remembered in two ways: as killer
+# moves of the ply they were played at, tried right after the captures by
+# sibling nodes, and in a butterfly history table by piece type and from/to
+# square, which sorts the rest of the quiet moves.
+class MoveOrdering:
+    def __init__(self):
+        self.clear()
+
+    def clear(self) -> None:
+        self.killers = [[None] * KILLER_SLOTS for _ in range(MAX_PLY)]
+        # One table per piece type, which run from PAWN = 0 to KING.
+        self.history = [[0] * 4096 for _ in PIECE_TYPES]
+
+    def new_search(self) -> None:
+        # Killers are tied to plies from the root, which moves on between
+        # searches, while history only fades so it can follow the game.
+        for killers in self.killers:
+            killers[:] = [None] * KILLER_SLOTS
+        for table in self.history:
+            table[:] = [value >> 1 for value in table]
+
+    def killer_moves(self, ply: int) -> list[Optional[Move]]:
+        return [move for move in self.killers[min(ply, MAX_PLY - 1)] if move is not None]
+
+    def quiet_key(self, board: Board):
+        history = self.history
+        piece_type_at = board.piece_type_at
+
+        def key(move: Move) -> int:
+            return -history[piece_type_at(move.from_square)][move.from_square << 6 | move.to_square]
+        return key
+
+    def cutoff(self, board: Board, move: Move, ply: int, depth: int) -> None:
+        # Captures and promotions are ordered well enough on their own.
+        if move.promotion or board.is_capture(move):
+            return
+
+        killers = self.killers[min(ply, MAX_PLY - 1)]
+        if killers[0] != move:
+            killers[1:] = killers[:-1]
+            killers[0] = move
+
+        self.history[board.piece_type_at(move.from_square)][
+            move.from_square << 6 | move.to_square] += depth * depth
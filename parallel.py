@@ -0,0 +1,131 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from math import inf
+from multiprocessing import get_context
+from time import perf_counter
+from typing import Optional
+
+import bot
+from intchess import Board, Move
+
+
+__all__ = ['SearchPool']
+
+
+# How often a waiting search checks whether it was stopped.
+POLL_SECONDS = 0.05
+
+
+_stop = None
+
+
+def _init_worker(stop) -> None:
+    global _stop
+    _stop = stop
+
+
+def _warm_up() -> None:
+    pass
+
+
+def _encode_moves(moves: list[Move]) -> list[tuple]:
+    return [(move.from_square, move.to_square, move.promotion) for move in moves]
+
+
+def _decode_moves(moves: list[tuple]) -> list[Move]:
+    return [Move(*move) for move in moves]
+
+
+def _search_root_moves(packed: tuple, moves: list[tuple], depth: int,
+                       movetime_ms: Optional[float], null_move: bool,
+                       reductions: bool) -> tuple[list[tuple[int, float, list[tuple]]],
+                                                  bot.SearchStats]:
+    # Runs in a worker, which keeps its own table and ordering between moves.
+    board = Board.unpack(packed)
+    stats = bot.SearchStats()
+    results = []
+    for current_depth, value, pv in bot.iterative_search(
+            board, depth, movetime_ms=movetime_ms, stop=_stop,
+            null_move=null_move, reductions=reductions, moves=_decode_moves(moves),
+            stats=stats):
+        if not pv:
+            break
+        results.append((current_depth, value, _encode_moves(pv)))
+    return results, stats
+
+
+# Worker processes that each search a share of the root moves. They are
+# started when the pool is made, so a game pays for that only once.
+class SearchPool:
+    def __init__(self, workers: int, timeout_ms: Optional[float] = None):
+        # Spawned rather than forked, the window process runs threads.
+        context = get_context('spawn')
+        self.workers = workers
+        self.timeout_ms = timeout_ms
+        self.stop = context.Event()
+        self.executor = ProcessPoolExecutor(workers, context, _init_worker, (self.stop,))
+        self.futures = [self.executor.submit(_warm_up) for _ in range(workers)]
+
+    def search(self, board: Board, depth: int, movetime_ms: Optional[float] = None,
+               stop=None, null_move: bool = True, reductions: bool = True,
+               stats: Optional[bot.SearchStats] = None) -> Optional[tuple[float, list[Move]]]:
+        # Value and principal variation of the deepest iteration that every
+        # worker finished, or None if stopped before any did. The numbers of
+        # the workers are added to stats if given.
+        moves = list(board.generate_staged_moves())
+        if not moves:
+            return None
+
+        # Workers of a stopped search must be done before the stop is lifted.
+        wait(self.futures)
+        self.stop.clear()
+        packed = board.pack()
+        self.futures = futures = [
+            self.executor.submit(_search_root_moves, packed,
+                                 _encode_moves(moves[index::self.workers]),
+                                 depth, movetime_ms, null_move, reductions)
+            for index in range(min(self.workers, len(moves)))]
+
+        timeout = None if self.timeout_ms is None else perf_counter() + self.timeout_ms / 1000
+        pending = futures
+        while pending:
+            _, pending = wait(pending, POLL_SECONDS, FIRST_COMPLETED)
+            if stop is not None and stop.is_set():
+                self.stop.set()
+                return None
+            if timeout is not None and perf_counter() > timeout:
+                # The workers give up and return the iterations they finished.
+                self.stop.set()
+        results = []
+        for future in futures:
+            result, worker_stats = future.result()
+            results.append(result)
+            if stats is not None:
+                stats.merge(worker_stats)
+        if not any(results):
+            return None
+
+        # A worker that proved a mate stops deepening, which is no reason to
+        # compare the others at a shallower depth.
+        depth = min((result[-1][0] for result in results
+                     if result and result[-1][1] not in {inf, -inf}), default=depth)
+        # Of equal mates, the one proved at the smallest depth is the
+        # quickest, and the one proved at the largest the slowest to suffer.
+        # Any other choice may put the mate off for good.
+        win = inf if board.turn else -inf
+        best = best_depth = None
+        for result in results:
+            finished = [entry for entry in result if entry[0] <= depth]
+            if not finished:
+                continue
+            entry_depth, value, pv = finished[-1]
+            if (best is None or board.turn and value > best[0] or
+                    not board.turn and value < best[0] or
+                    value == best[0] and value in {inf, -inf} and
+                    (entry_depth < best_depth) == (value == win)):
+                best, best_depth = (value, _decode_moves(pv)), entry_depth
+        return best
+
+    def close(self) -> None:
+        # Stopped workers return within a node, so waiting for them is quick.
+        self.stop.set()
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,215 @@
+from argparse import ArgumentParser
+from sys import exit as sys_exit
+from time import perf_counter
+from typing import Optional
+
+from numpy import array, isclose, uint64
+
+from abilities import *
+from bulk import BoardArray
+from evaluation import evaluate_batch
+from intchess import Board, Move, SQUARE_NAMES, STARTING_FEN
+from level import LEVELS, level_board
+
+
+__all__ = ['perft', 'perft_bulk', 'divide', 'check_scores', 'PERFT_SUITE', 'perft_main']
+
+
+def perft(board, depth: int) -> int:
+    if depth < 1:
+        return 1
+
+    moves = list(board.generate_legal_moves())
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        board.push(move)
+        nodes += perft(board, depth - 1)
+        board.pop()
+    return nodes
+
+
+def perft_bulk(board: Board, depth: int) -> int:
+    # The same count, with the moves of the last ply generated for all the
+    # positions before it at once.
+    if depth < 2:
+        return perft(board, depth)
+
+    frontier = []
+
+    def collect(depth):
+        if depth == 1:
+            frontier.append(board.copy(stack=False))
+            return
+        for move in list(board.generate_legal_moves()):
+            board.push(move)
+            collect(depth - 1)
+            board.pop()
+
+    collect(depth)
+    return len(BoardArray.from_boards(frontier).legal_moves()[0])
+
+
+def divide(board, depth: int) -> dict[Move, int]:
+    result = {}
+    for move in list(board.generate_legal_moves()):
+        board.push(move)
+        result[move] = perft(board, depth - 1)
+        board.pop()
+    return result
+
+
+def check_scores(board: Board, depth: int) -> tuple[int, int]:
+    # The number of leaves and how many of them have a running score that
+    # differs from scoring them from scratch. The leaves below a node are
+    # scored together.
+    if depth < 1:
+        return 0, 0
+    if depth > 1:
+        leaves = mismatches = 0
+        for move in list(board.generate_legal_moves()):
+            board.push(move)
+            result = check_scores(board, depth - 1)
+            board.pop()
+            leaves += result[0]
+            mismatches += result[1]
+        return leaves, mismatches
+
+    bitboards, scores = [], []
+    for move in list(board.generate_legal_moves()):
+        board.push(move)
+        bitboards.append(board.bitboards())
+        scores.append(board.score)
+        board.pop()
+    if not scores:
+        return 0, 0
+    return len(scores), int((~isclose(evaluate_batch(array(bitboards, uint64)), scores)).sum())
+
+
+def fen_board(fen: str, abilities: Optional[dict[str, int]] = None) -> Board:
+    board = Board()
+    board.set_fen(fen)
+    for name, ability in (abilities or {}).items():
+        sq = SQUARE_NAMES.index(name)
+        piece = board.piece_at(sq)
+        piece.abilities |= ability
+        board.set_piece_at(sq, piece)
+    return board
+
+
+# (name, fen, abilities by square name, depth, expected nodes). The standard
+# positions have well known counts, the rest are what the move generator
+# produced when they were added and guard against regressions.
+PERFT_SUITE = [
+    ('startpos', STARTING_FEN, {}, 4, 197281),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', {}, 3, 97862),
+    ('endgame', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', {}, 4, 43238),
+    ('mirrored', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', {}, 3, 9467),
+    ('promotions', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', {}, 3, 62379),
+
+    ('leaper', 'r3k3/8/8/3b4/8/2B5/8/R3K3 w Qq - 0 1',
+     {'c3': B_LEAPER, 'd5': B_LEAPER}, 3, 25546),
+    ('shifty', '4k3/8/2n5/8/8/5N2/8/R3K3 w Q - 0 1',
+     {'a1': B_SHIFTY, 'f3': B_SHIFTY, 'c6': B_SHIFTY}, 3, 23615),
+    ('sneaker', '4k3/3r4/8/8/8/8/3N4/4K3 w - - 0 1',
+     {'d2': B_SNEAKER, 'd7': B_SNEAKER}, 4, 105813),
+    ('ruthless', '4k3/8/8/3b4/8/8/3N4/4K3 w - - 0 1',
+     {'d2': B_RUTHLESS, 'd5': B_RUTHLESS}, 4, 217897),
+    ('rider', '4k3/8/8/8/3n4/8/1N6/4K3 w - - 0 1',
+     {'b2': B_RIDER, 'd4': B_RIDER}, 4, 21953),
+    ('expendable', '1n2k3/ppp5/8/8/8/8/PPP5/1N2K3 w - - 0 1',
+     {'a2': B_EXPENDABLE, 'b2': B_EXPENDABLE, 'c2': B_EXPENDABLE,
+      'a7': B_EXPENDABLE, 'b7': B_EXPENDABLE, 'c7': B_EXPENDABLE}, 4, 42365),
+    ('eagle', '4k3/8/1P6/8/8/6p1/8/4K3 w - - 0 1',
+     {'b6': B_EAGLE, 'g3': B_EAGLE}, 4, 9740),
+    ('pacifist', '4k3/8/8/2pp4/3PP3/8/8/4K3 w - - 0 1',
+     {'d4': B_PACIFIST, 'c5': B_PACIFIST}, 4, 2855),
+    ('pacifist en passant', '4k3/8/8/3Pp3/8/8/8/4K3 w - e6 0 1',
+     {'e5': B_PACIFIST}, 4, 1719),
+    ('stubborn', '4k3/8/8/8/4r3/8/8/R3K2R w KQ - 0 1',
+     {'e1': B_STUBBORN}, 3, 2445),
+    ('ghost', 'r3k2r/8/8/8/2b5/8/8/R3K2R w KQkq - 0 1',
+     {'e1': B_GHOST, 'e8': B_GHOST}, 3, 18065),
+]
+# Levels are played against the full army, these are their counts in order.
+LEVEL_NODES = [8012, 8902, 10682, 9792, 8902]
+PERFT_SUITE += [(f'level {name}', None, index, 3,
+                 LEVEL_NODES[index] if index < len(LEVEL_NODES) else None)
+                for index, (name, _) in enumerate(LEVELS)]
+
+
+def suite_board(fen: Optional[str], abilities) -> Board:
+    # Level entries carry the level index in place of the abilities.
+    if fen is None:
+        return level_board(abilities)
+    return fen_board(fen, abilities)
+
+
+def perft_main():
+    parser = ArgumentParser(description='Count the leaf nodes of the legal move tree.')
+    parser.add_argument('positions', nargs='*',
+                        help='names of suite positions to run, all by default')
+    parser.add_argument('-d', '--depth', type=int,
+                        help='search depth instead of the one of the suite')
+    parser.add_argument('--fen', help='run a single position instead of the suite')
+    parser.add_argument('--divide', action='store_true',
+                        help='print the node count below every root move')
+    parser.add_argument('--bulk', action='store_true',
+                        help='generate the last ply in bulk with NumPy')
+    parser.add_argument('--scores', action='store_true',
+                        help='also check the running score of every leaf')
+    args = parser.parse_args()
+
+    if args.fen is not None:
+        suite = [(args.fen, args.fen, {}, args.depth or 1, None)]
+    else:
+        suite = [entry for entry in PERFT_SUITE
+                 if not args.positions or entry[0] in args.positions]
+        if args.positions and len(suite) != len(args.positions):
+            parser.error('unknown position names')
+
+    failed = False
+    total_nodes = 0
+    total_time = 0
+    for name, fen, abilities, depth, expected in suite:
+        board = suite_board(fen, abilities)
+        if args.depth is not None and args.depth != depth:
+            depth, expected = args.depth, None
+
+        start = perf_counter()
+        if args.divide:
+            result = divide(board, depth)
+            for move, nodes in result.items():
+                print(f'  {move}: {nodes}')
+            nodes = sum(result.values())
+        elif args.bulk:
+            nodes = perft_bulk(board, depth)
+        else:
+            nodes = perft(board, depth)
+        elapsed = perf_counter() - start
+        total_nodes += nodes
+        total_time += elapsed
+
+        status = ''
+        if expected is not None and nodes != expected:
+            status = f'  MISMATCH, expected {expected}'
+            failed = True
+        print(f'{name:<24} depth {depth}  {nodes:>9} nodes  {elapsed:7.2f}s  '
+              f'{nodes / max(elapsed, 1e-9):>9.0f} nps{status}')
+
+        if args.scores:
+            leaves, mismatches = check_scores(board, depth)
+            if mismatches:
+                print(f'{"":<24} {mismatches} of {leaves} leaf scores MISMATCH')
+                failed = True
+
+    print(f'{"total":<24}          {total_nodes:>9} nodes  {total_time:7.2f}s  '
+          f'{total_nodes / max(total_time, 1e-9):>9.0f} nps')
+    if failed:
+        sys_exit(1)
+
+
+if __name__ == '__main__':
+    perft_main()
@@ -0,0 +1,354 @@
+from numpy import array as np_array, concatenate, frombuffer, int8, int32, memmap, subtract, unique, zeros
+
+from argparse import ArgumentParser
+from array import array
+from itertools import product
+from os.path import getsize, join, split
+from time import perf_counter
+from typing import Optional
+
+from abilities import FLAGS, UNIQUE_FLAGS
+from fileio import open_atomic
+from intchess import (
+    Board, Move, Piece, PAWN, KING, WHITE, BLACK, PIECE_SYMBOLS,
+    BB_BACKRANKS, BB_SQUARES, popcount, scan_forward)
+
+
+__all__ = ['TABLEBASE_DIR', 'TABLEBASE_MEN', 'Tablebase', 'tablebase_main']
+
+
+TABLEBASE_DIR = join(split(__file__)[0], 'assets', 'tablebases')
+TABLEBASE_MAGIC = b'CCTB0001'
+# Positions with more men are not looked up. The generator is pure Python,
+# a table of four men takes it minutes and one of five would take hours.
+TABLEBASE_MEN = 4
+
+# Tables shipped with the game, every one with the tables it depends on.
+DEFAULT_TABLES = ['KvK', 'KQvK', 'KRvK', 'KBvK', 'KNvK', 'KPvK', 'KB[sneaker]vK', 'KQvKR']
+
+
+# Every entry is the value for the side to move: 0 is a draw, n > 0 mates in
+# n plies and n < 0 is mated in -n - 1 plies, which keeps being mated on the
+# board apart from a draw. Entries of invalid positions are left at 0.
+def _win(plies: int) -> int:
+    return plies
+
+
+def _loss(plies: int) -> int:
+    return -plies - 1
+
+
+def _score(value: int) -> int:
+    # Larger is better for the side that moved into the position valued,
+    # fast wins first and slow losses last.
+    if value < 0:
+        return 1000 + value
+    if value > 0:
+        return -1000 + value + 1
+    return 0
+
+
+# Moves of every piece but pawns look the same on a mirrored board, so
+# pawnless tables keep the white king on a1-d1-d4 and tables with pawns keep
+# it on the queen side.
+def _transforms() -> list[list[int]]:
+    transforms = []
+    for swap, flip_rank, flip_file in product((False, True), repeat=3):
+        transform = []
+        for square in range(64):
+            file, rank = square & 7, square >> 3
+            if swap:
+                file, rank = rank, file
+            if flip_file:
+                file = 7 - file
+            if flip_rank:
+                rank = 7 - rank
+            transform.append(rank << 3 | file)
+        transforms.append(transform)
+    return transforms
+
+
+TRANSFORMS = _transforms()
+PAWNLESS_KINGS = [square for square in range(64) if (square & 7) <= 3 and
+                  (square >> 3) <= (square & 7)]
+PAWN_KINGS = [square for square in range(64) if (square & 7) <= 3]
+PAWNLESS_CANON = [next(transform for transform in TRANSFORMS
+                       if transform[king] in PAWNLESS_KINGS) for king in range(64)]
+# Only the identity and the file mirror keep pawns going the same way.
+PAWN_CANON = [next(transform for transform in TRANSFORMS[:2] if transform[king] in PAWN_KINGS)
+              for king in range(64)]
+PAWNLESS_INDEX = {square: index for index, square in enumerate(PAWNLESS_KINGS)}
+PAWN_INDEX = {square: index for index, square in enumerate(PAWN_KINGS)}
+
+
+def position_index(turn: bool, squares: tuple[int, ...], pawns: bool) -> int:
+    # squares are in the order of the signature, the white king first.
+    king = squares[0]
+    if pawns:
+        transform = PAWN_CANON[king]
+        index = turn * len(PAWN_KINGS) + PAWN_INDEX[transform[king]]
+    else:
+        transform = PAWNLESS_CANON[king]
+        index = turn * len(PAWNLESS_KINGS) + PAWNLESS_INDEX[transform[king]]
+    for square in squares[1:]:
+        index = index << 6 | transform[square]
+    return index
+
+
+def table_size(men: int, pawns: bool) -> int:
+    return 2 * len(PAWN_KINGS if pawns else PAWNLESS_KINGS) << 6 * (men - 1)
+
+
+# A signature names the material of a table, white before black, such as
+# KQvK or KR[leaper]vKP. Abilities follow a piece in brackets.
+def piece_name(piece: Piece) -> str:
+    names = [name.lower() for name, flag in FLAGS.items() if piece.abilities & flag]
+    names += [name for name, value in UNIQUE_FLAGS.items() if piece.unique_ability == value]
+    symbol = PIECE_SYMBOLS[piece.piece_type].upper()
+    return f'{symbol}[{"+".join(names)}]' if names else symbol
+
+
+def _piece_key(piece: Piece) -> tuple:
+    return not piece.color, -piece.piece_type, piece.abilities, piece.unique_ability
+
+
+def parse_signature(signature: str) -> list[Piece]:
+    pieces = []
+    for color, side in zip((WHITE, BLACK), signature.split('v')):
+        index = 0
+        while index < len(side):
+            piece = Piece(PIECE_SYMBOLS.index(side[index].lower()), color)
+            index += 1
+            if index < len(side) and side[index] == '[':
+                end = side.index(']', index)
+                for name in side[index + 1:end].split('+'):
+                    if name in UNIQUE_FLAGS:
+                        piece.unique_ability = UNIQUE_FLAGS[name]
+                    else:
+                        piece.abilities |= FLAGS[name.upper()]
+                index = end + 1
+            pieces.append(piece)
+    pieces.sort(key=_piece_key)
+    if [piece.piece_type for piece in pieces].count(KING) != 2 or pieces[0].piece_type != KING:
+        raise ValueError(f'{signature} needs one king of each color')
+    return pieces
+
+
+def _signature(pieces: list[Piece]) -> str:
+    white = ''.join(piece_name(piece) for piece in pieces if piece.color)
+    black = ''.join(piece_name(piece) for piece in pieces if not piece.color)
+    return f'{white}v{black}'
+
+
+def _board_pieces(board: Board) -> tuple[str, tuple[int, ...]]:
+    pieces = sorted(((board.piece_at(square), square) for square in scan_forward(board.occupied)),
+                    key=lambda item: _piece_key(item[0]))
+    return (_signature([piece for piece, _ in pieces]),
+            tuple(square for _, square in pieces))
+
+
+def _mirror(board: Board) -> Board:
+    # The same position with the colors swapped and the board upside down.
+    mirrored = Board()
+    mirrored.clear_board()
+    for square in scan_forward(board.occupied):
+        piece = board.piece_at(square)
+        piece.color = not piece.color
+        mirrored.set_piece_at(square ^ 56, piece)
+    mirrored.turn = not board.turn
+    return mirrored
+
+
+# Tables of distance to mate, built by retrograde analysis and read from
+# memory-mapped files.
+class Tablebase:
+    def __init__(self, directory: str = TABLEBASE_DIR):
+        self.directory = directory
+        self.tables = {}
+
+    def table(self, signature: str):
+        if signature not in self.tables:
+            path = join(self.directory, f'{signature}.bin')
+            table = None
+            try:
+                with open(path, 'rb') as file:
+                    magic = file.read(len(TABLEBASE_MAGIC))
+                if magic == TABLEBASE_MAGIC and getsize(path) > len(TABLEBASE_MAGIC):
+                    table = memmap(path, int8, 'r', len(TABLEBASE_MAGIC))
+            except OSError:
+                pass
+            self.tables[signature] = table
+        return self.tables[signature]
+
+    def probe(self, board: Board) -> Optional[int]:
+        # The value of the position for the side to move, or None if no
+        # table has it.
+        if (popcount(board.occupied) > TABLEBASE_MEN or board.clean_castling_rights() or
+                board.has_legal_en_passant()):
+            return None
+        for position in (board, None):
+            if position is None:
+                position = _mirror(board)
+            signature, squares = _board_pieces(position)
+            table = self.table(signature)
+            if table is not None:
+                pawns = bool(position.pawns)
+                return int(table[position_index(position.turn, squares, pawns)])
+        return None
+
+    def best_move(self, board: Board) -> Optional[Move]:
+        # The fastest win, else a draw, else the slowest loss, or None if
+        # the position or one after it is in no table.
+        if self.probe(board) is None:
+            return None
+        best = None
+        for move in board.generate_legal_moves():
+            board.push(move)
+            value = self.probe(board)
+            board.pop()
+            if value is None:
+                return None
+            if best is None or _score(value) > best[0]:
+                best = _score(value), move
+        return None if best is None else best[1]
+
+    def generate(self, signature: str, verbose: bool = False):
+        # Builds the table with the tables of every capture and promotion
+        # out of it, and keeps them in memory.
+        pieces = parse_signature(signature)
+        signature = _signature(pieces)
+        if self.table(signature) is not None:
+            return self.tables[signature]
+
+        start = perf_counter()
+        men = len(pieces)
+        pawns = any(piece.piece_type == PAWN for piece in pieces)
+        size = table_size(men, pawns)
+        values = zeros(size, int8)
+        resolved = zeros(size, bool)
+        remaining = zeros(size, int32)
+        parents, children = array('i'), array('i')
+        exit_parents, exit_values = array('i'), array('b')
+
+        board = Board()
+        index = -1
+        for turn in (BLACK, WHITE):
+            for king in PAWN_KINGS if pawns else PAWNLESS_KINGS:
+                for rest in product(range(64), repeat=men - 1):
+                    index += 1
+                    squares = (king,) + rest
+                    if len(set(squares)) < men:
+                        continue
+                    board.clear_board()
+                    for piece, square in zip(pieces, squares):
+                        board.set_piece_at(square, piece)
+                    if board.pawns & BB_BACKRANKS:
+                        continue
+                    board.turn = turn
+                    if board.attackers_mask(turn, board.king(not turn)):
+                        continue
+
+                    moves = list(board.generate_legal_moves())
+                    if not moves:
+                        if board.is_check():
+                            values[index] = _loss(0)
+                        resolved[index] = True
+                        continue
+                    remaining[index] = len(moves)
+                    for move in moves:
+                        if move.promotion or board.occupied & BB_SQUARES[move.to_square]:
+                            # Captures and promotions leave for another table.
+                            board.push(move)
+                            value = self._probe_generated(board, verbose)
+                            board.pop()
+                            exit_parents.append(index)
+                            exit_values.append(value)
+                        else:
+                            # The en passant right of a double step is not
+                            # kept, which only matters with pawns on both sides.
+                            slot = squares.index(move.from_square)
+                            parents.append(index)
+                            children.append(position_index(
+                                not turn, squares[:slot] + (move.to_square,) + squares[slot + 1:],
+                                pawns))
+
+        parents = frombuffer(parents, int32)
+        children = frombuffer(children, int32)
+        exit_parents = frombuffer(exit_parents, int32)
+        exit_values = frombuffer(exit_values, int8)
+
+        # Positions are solved in order of distance to mate. A position
+        # with a reply into a loss in n plies wins in n + 1, one with every
+        # reply into a win is lost in one more than the slowest of them.
+        # Whatever is left once nothing changes is a draw.
+        plies = 0
+        last = int(abs(exit_values.astype(int32)).max(initial=0))
+        while plies <= last:
+            if plies + 2 > 127:
+                raise ValueError(f'{signature} has mates too long to store')
+            winning = concatenate([parents[values[children] == _loss(plies)],
+                                   exit_parents[exit_values == _loss(plies)]])
+            winning = unique(winning)
+            winning = winning[~resolved[winning]]
+            values[winning] = _win(plies + 1)
+            resolved[winning] = True
+
+            losing = np_array([], int32)
+            if plies:
+                losing = concatenate([parents[values[children] == _win(plies)],
+                                      exit_parents[exit_values == _win(plies)]])
+                subtract.at(remaining, losing, 1)
+                losing = unique(losing)
+                losing = losing[(remaining[losing] == 0) & ~resolved[losing]]
+                values[losing] = _loss(plies + 1)
+                resolved[losing] = True
+
+            if len(winning) or len(losing):
+                last = max(last, plies + 2)
+            plies += 1
+
+        self.tables[signature] = values
+        if verbose:
+            wins = int((values > 0).sum())
+            losses = int((values < 0).sum())
+            print(f'{signature}: {size} positions, {wins} won and {losses} lost, '
+                  f'longest mate {int(values.max(initial=0))} plies, '
+                  f'{perf_counter() - start:.0f}s')
+        return values
+
+    def _probe_generated(self, board: Board, verbose: bool) -> int:
+        value = self.probe(board)
+        if value is None:
+            self.generate(_board_pieces(board)[0], verbose)
+            value = self.probe(board)
+        return value
+
+    def write(self, signature: str) -> str:
+        signature = _signature(parse_signature(signature))
+        path = join(self.directory, f'{signature}.bin')
+        with open_atomic(path) as file:
+            file.write(TABLEBASE_MAGIC)
+            file.write(self.tables[signature].tobytes())
+        return path
+
+
+def tablebase_main():
+    parser = ArgumentParser(description='Build endgame tablebases of the bot.')
+    parser.add_argument('signatures', nargs='*', default=DEFAULT_TABLES,
+                        help='material of the tables, such as KQvK or KR[leaper]vKP')
+    parser.add_argument('-o', '--output', default=TABLEBASE_DIR,
+                        help='directory to write the tables to')
+    args = parser.parse_args()
+
+    start = perf_counter()
+    tablebase = Tablebase(args.output)
+    for signature in args.signatures:
+        tablebase.generate(signature, verbose=True)
+    for signature, table in list(tablebase.tables.items()):
+        if table is not None and not isinstance(table, memmap):
+            print(f'{signature} written to {tablebase.write(signature)}')
+    print(f'done in {perf_counter() - start:.0f}s')
+
+
+if __name__ == '__main__':
+    tablebase_main()
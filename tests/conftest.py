@@ -0,0 +1,6 @@
+from os.path import dirname, abspath
+import sys
+
+# The modules import each other by name, as they do when run from the
+# package directory.
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
@@ -0,0 +1,46 @@
+from book import BOOK_MAGIC, OpeningBook
+from intchess import A2, A3, E2, E4, Move
+from level import LEVELS, level_board
+
+
+def test_book_hits():
+    # The bot is handed the board of the game with the move of the player
+    # on it, and the book answers every first move of every level.
+    book = OpeningBook()
+    assert len(book)
+    for index in range(len(LEVELS)):
+        start = level_board(index)
+        for move in list(start.legal_moves):
+            board = start.copy()
+            board.push(move)
+            reply = book.probe(board.copy())
+            assert reply is not None and board.is_legal(reply), (index, move)
+
+
+def test_write_probe(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    start = level_board(0)
+    board = start.copy()
+    board.push(Move(E2, E4))
+    reply = next(iter(board.legal_moves))
+    OpeningBook.write(path, {board.zobrist_hash(): reply})
+
+    book = OpeningBook(path)
+    assert len(book) == 1
+    assert book.probe(board) == reply
+    assert book.probe(start) is None
+    # A key that collides with another position gives no illegal move.
+    other = start.copy()
+    other.push(Move(A2, A3))
+    OpeningBook.write(path, {other.zobrist_hash(): Move(E4, E2)})
+    assert OpeningBook(path).probe(other) is None
+
+
+def test_missing_book(tmp_path):
+    book = OpeningBook(str(tmp_path / 'book.bin'))
+    assert len(book) == 0
+    assert book.probe(level_board(0)) is None
+
+    path = tmp_path / 'empty.bin'
+    path.write_bytes(BOOK_MAGIC)
+    assert len(OpeningBook(str(path))) == 0
@@ -0,0 +1,90 @@
+from math import inf
+
+import pytest
+
+import bot
+from bot import ASPIRATION_RESEARCHES, Search, SearchStats, iterative_search, move_engine
+from book import OpeningBook
+from intchess import Board, E2, E4, Move
+from level import level_board
+from tablebase import Tablebase
+
+
+POSITIONS = [
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 1',
+    '4k3/8/2p5/3p4/8/8/8/3QK3 w - - 0 1',
+]
+
+
+def fen_board(fen):
+    board = Board()
+    board.set_fen(fen)
+    return board
+
+
+@pytest.fixture
+def root_windows(monkeypatch):
+    # The windows of the searches from the root, by iteration.
+    windows = {}
+    negamax = Search.negamax
+
+    def recording(self, board, depth, alpha=-inf, beta=inf, ply=0, moves=None):
+        if not ply:
+            windows.setdefault(depth, []).append((alpha, beta))
+        return negamax(self, board, depth, alpha, beta, ply, moves)
+
+    monkeypatch.setattr(Search, 'negamax', recording)
+    return windows
+
+
+def search_values(board, depth):
+    # Without the table and pruning, a window only changes how much is
+    # searched, never the value found inside it.
+    return [(current_depth, value) for current_depth, value, _ in
+            iterative_search(board, depth, None, ordering=None, null_move=False,
+                             reductions=False)]
+
+
+@pytest.mark.parametrize('fen', POSITIONS)
+def test_aspiration_researches(fen, root_windows, monkeypatch):
+    monkeypatch.setattr(bot, 'ASPIRATION_WINDOW', inf)
+    expected = search_values(fen_board(fen), 4)
+
+    # A window this narrow fails nearly every iteration.
+    monkeypatch.setattr(bot, 'ASPIRATION_WINDOW', 0.01)
+    root_windows.clear()
+    assert search_values(fen_board(fen), 4) == expected
+    assert any(len(windows) > 1 for windows in root_windows.values())
+    for windows in root_windows.values():
+        assert len(windows) <= ASPIRATION_RESEARCHES + 1
+        # Every re-search widens the window.
+        for (alpha, beta), (next_alpha, next_beta) in zip(windows, windows[1:]):
+            assert next_alpha <= alpha and next_beta >= beta
+            assert (next_alpha, next_beta) != (alpha, beta)
+
+
+def test_aspiration_mate(root_windows):
+    # A mate fails high on any window, which is opened at once rather than
+    # widened step by step.
+    values = search_values(fen_board('k7/8/2K5/8/8/8/8/6R1 w - - 0 1'), 6)
+    assert values[-1] == (3, inf)
+    assert root_windows[3][-1][1] == inf
+    assert len(root_windows[3]) == 2
+
+
+def test_book_move():
+    board = level_board(0)
+    board.push(Move(E2, E4))
+    stats = SearchStats()
+    move = move_engine(board.copy(), stats=stats)
+    assert move == OpeningBook().probe(board)
+    assert stats.nodes == 0
+
+
+def test_tablebase_move():
+    board = fen_board('8/8/8/3k4/8/8/8/R3K3 w - - 0 1')
+    stats = SearchStats()
+    move = move_engine(board, stats=stats, book=None)
+    assert move == Tablebase().best_move(board)
+    assert stats.nodes == 0
@@ -0,0 +1,33 @@
+from math import inf
+
+from intchess import Board
+from parallel import SearchPool
+from tablebase import Tablebase
+
+
+def test_quickest_mate():
+    # Worker processes that prove a mate at different depths must agree on
+    # the quickest one, or the bot may put the mate off forever.
+    board = Board()
+    board.set_fen('k7/8/2K5/8/8/8/8/6R1 w - - 0 1')
+    pool = SearchPool(2)
+    try:
+        value, pv = pool.search(board, 6)
+    finally:
+        pool.close()
+    assert value == inf
+    # The tables know the distance to mate of every move.
+    tablebase = Tablebase()
+    plies = tablebase.probe(board)
+    board.push(pv[0])
+    assert tablebase.probe(board) == -plies
+
+
+def test_no_moves():
+    board = Board()
+    board.set_fen('k7/2Q5/1K6/8/8/8/8/8 b - - 0 1')
+    pool = SearchPool(2)
+    try:
+        assert pool.search(board, 3) is None
+    finally:
+        pool.close()
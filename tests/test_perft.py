@@ -0,0 +1,15 @@
+import pytest
+
+from perft import PERFT_SUITE, perft, perft_bulk, suite_board
+
+
+@pytest.mark.parametrize('name, fen, abilities, depth, expected',
+                         [entry for entry in PERFT_SUITE if entry[4] is not None],
+                         ids=[entry[0] for entry in PERFT_SUITE if entry[4] is not None])
+def test_perft(name, fen, abilities, depth, expected):
+    assert perft(suite_board(fen, abilities), depth) == expected
+
+
+def test_perft_bulk():
+    name, fen, abilities, depth, expected = PERFT_SUITE[1]
+    assert perft_bulk(suite_board(fen, abilities), depth) == expected
@@ -0,0 +1,84 @@
+from abilities import B_SNEAKER
+from intchess import B1, Board
+from level import level_board
+from tablebase import Tablebase
+
+
+def fen_board(fen):
+    board = Board()
+    board.set_fen(fen)
+    return board
+
+
+def test_probe():
+    tablebase = Tablebase()
+    # Values are for the side to move: mates in n plies, mated in -n - 1.
+    assert tablebase.probe(fen_board('k7/8/1K6/8/8/8/7Q/8 w - - 0 1')) == 1
+    assert tablebase.probe(fen_board('k6Q/8/1K6/8/8/8/8/8 b - - 0 1')) == -1
+    assert tablebase.probe(fen_board('k7/8/1K6/8/8/8/8/8 w - - 0 1')) == 0
+    # The side with the queen may be black.
+    assert tablebase.probe(fen_board('K7/8/1k6/8/8/8/7q/8 b - - 0 1')) == 1
+    # Stalemate is a draw.
+    assert tablebase.probe(fen_board('k7/2Q5/1K6/8/8/8/8/8 b - - 0 1')) == 0
+
+
+def test_probe_misses():
+    tablebase = Tablebase()
+    assert tablebase.probe(level_board(0)) is None
+    # No table is shipped for this material, nor for five men.
+    assert tablebase.probe(fen_board('k7/8/1K6/8/8/8/8/QN6 w - - 0 1')) is None
+    assert tablebase.probe(fen_board('k7/8/1K6/8/8/8/8/QQ5r w - - 0 1')) is None
+    # Castling rights and en passant are not in the tables.
+    assert tablebase.probe(fen_board('k7/8/8/8/8/8/8/R3K3 w Q - 0 1')) is None
+    assert tablebase.probe(fen_board('k7/8/8/3Pp3/8/8/8/4K3 w - e6 0 1')) is None
+
+
+def test_best_move():
+    tablebase = Tablebase()
+    board = fen_board('k7/8/1K6/8/8/8/7Q/8 w - - 0 1')
+    board.push(tablebase.best_move(board))
+    assert board.is_checkmate()
+
+    # With both sides playing the moves of the tables, the mate comes one
+    # ply closer with every move.
+    board = fen_board('8/8/8/3k4/8/8/8/R3K3 w - - 0 1')
+    plies = tablebase.probe(board)
+    assert plies > 0
+    while not board.is_checkmate():
+        board.push(tablebase.best_move(board))
+        plies -= 1
+        assert tablebase.probe(board) == (plies if board.turn else -plies - 1)
+    assert plies == 0
+
+
+def test_four_men():
+    tablebase = Tablebase()
+    board = fen_board('8/8/3k4/8/3r4/8/8/3QK3 w - - 0 1')
+    plies = tablebase.probe(board)
+    assert plies > 0
+    # Taking the rook leaves a table of three men.
+    board.push(tablebase.best_move(board))
+    assert tablebase.probe(board) == -plies
+    assert not board.rooks
+
+
+def test_abilities():
+    tablebase = Tablebase()
+    board = fen_board('8/8/8/3k4/8/8/8/1B2K3 w - - 0 1')
+    assert tablebase.probe(board) == 0
+    bishop = board.piece_at(B1)
+    bishop.abilities |= B_SNEAKER
+    board.set_piece_at(B1, bishop)
+    plies = tablebase.probe(board)
+    assert plies > 0
+    board.push(tablebase.best_move(board))
+    assert tablebase.probe(board) == -plies
+
+
+def test_generate(tmp_path):
+    tablebase = Tablebase(str(tmp_path))
+    table = tablebase.generate('KRvK')
+    assert (table == Tablebase().table('KRvK')).all()
+    tablebase.write('KRvK')
+    tablebase.write('KvK')
+    assert (Tablebase(str(tmp_path)).table('KRvK') == table).all()
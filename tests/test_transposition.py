@@ -0,0 +1,45 @@
+from intchess import E2, E4, Move, QUEEN
+from transposition import *
+
+
+def test_encode_move():
+    for move in (Move(12, 28), Move(52, 60, QUEEN), Move(0, 63)):
+        assert decode_move(encode_move(move)) == move
+    assert encode_move(None) == 0
+    assert decode_move(0) is None
+
+
+def test_store_probe():
+    table = TranspositionTable(1)
+    move = Move(E2, E4)
+    table.store(12345, 4, 0.75, BOUND_LOWER, move)
+    assert table.probe(12345) == (4, 0.75, BOUND_LOWER, move)
+    assert table.probe(54321) is None
+
+    # A result without a move keeps the best move found before.
+    table.store(12345, 5, -0.25, BOUND_UPPER, None)
+    assert table.probe(12345) == (5, -0.25, BOUND_UPPER, move)
+
+    table.clear()
+    assert table.probe(12345) is None
+
+
+def test_replacement():
+    table = TranspositionTable(0.001)
+    deep, shallow, other = 7, 7 + table.buckets, 7 + 2 * table.buckets
+    table.store(deep, 6, 1.0, BOUND_EXACT, None)
+    # A shallower entry of the same bucket leaves the deeper one in place.
+    table.store(shallow, 2, 2.0, BOUND_EXACT, None)
+    assert table.probe(deep)[0] == 6
+    assert table.probe(shallow)[0] == 2
+    table.store(other, 1, 3.0, BOUND_EXACT, None)
+    assert table.probe(deep)[0] == 6
+    assert table.probe(shallow) is None
+    assert table.probe(other)[0] == 1
+
+    # In a new search, the old entry gives way and is demoted.
+    table.new_search()
+    table.store(shallow, 2, 2.0, BOUND_EXACT, None)
+    assert table.probe(shallow)[0] == 2
+    assert table.probe(deep)[0] == 6
+    assert table.probe(other) is None
@@ -0,0 +1,92 @@
+from array import array
+from typing import Optional
+
+from intchess import Move
+
+
+__all__ = [
+    'BOUNDS', 'BOUND_EXACT', 'BOUND_LOWER', 'BOUND_UPPER',
+    'TT_SIZE_MB', 'encode_move', 'decode_move', 'TranspositionTable',
+]
+
+BOUNDS = [BOUND_EXACT, BOUND_LOWER, BOUND_UPPER] = range(3)
+
+TT_SIZE_MB = 16
+
+# Every slot is a key (8 bytes), a score (8 bytes) and packed info (4 bytes):
+# move in bits 0-15, depth in 16-23, bound in 24-25, generation in 26-31.
+SLOT_SIZE = 20
+BUCKET_SLOTS = 2
+
+
+# Moves in 16 bits, 0 for none.
+def encode_move(move: Optional[Move]) -> int:
+    if move is None:
+        return 0
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+def decode_move(code: int) -> Optional[Move]:
+    if not code:
+        return None
+    return Move(code & 0x3f, code >> 6 & 0x3f, code >> 12 or None)
+
+
+# Each bucket holds a depth-preferred slot, which keeps the deepest result of
+# the current search, and an always-replace slot, which takes whatever the
+# first slot turned down.
+class TranspositionTable:
+    def __init__(self, size_mb: float = TT_SIZE_MB):
+        self.resize(size_mb)
+
+    def resize(self, size_mb: float) -> None:
+        self.buckets = max(1, int(size_mb * 2 ** 20) // (SLOT_SIZE * BUCKET_SLOTS))
+        self.clear()
+
+    def clear(self) -> None:
+        slots = self.buckets * BUCKET_SLOTS
+        self.keys = array('Q', bytes(8 * slots))
+        self.scores = array('d', bytes(8 * slots))
+        self.infos = array('I', bytes(4 * slots))
+        self.generation = 0
+
+    def new_search(self) -> None:
+        # Entries from older searches give way to new ones regardless of depth.
+        self.generation = (self.generation + 1) & 0x3f
+
+    def probe(self, key: int) -> Optional[tuple[int, float, int, Optional[Move]]]:
+        index = key % self.buckets * BUCKET_SLOTS
+        for slot in (index, index + 1):
+            if self.keys[slot] == key:
+                info = self.infos[slot]
+                return (info >> 16 & 0xff, self.scores[slot],
+                        info >> 24 & 0x3, decode_move(info & 0xffff))
+
+    def store(self, key: int, depth: int, score: float, bound: int,
+              move: Optional[Move]) -> None:
+        index = key % self.buckets * BUCKET_SLOTS
+        keys, infos = self.keys, self.infos
+
+        code = encode_move(move)
+        if not code:
+            # Keep the best move of an earlier search of this position.
+            for slot in (index, index + 1):
+                if keys[slot] == key:
+                    code = infos[slot] & 0xffff
+                    break
+        info = code | min(depth, 0xff) << 16 | bound << 24 | self.generation << 26
+
+        old_info = infos[index]
+        if (keys[index] == key or depth >= old_info >> 16 & 0xff or
+                old_info >> 26 != self.generation):
+            if keys[index] != key:
+                # Demote the old entry rather than losing it outright.
+                keys[index + 1] = keys[index]
+                self.scores[index + 1] = self.scores[index]
+                infos[index + 1] = old_info
+            slot = index
+        else:
+            slot = index + 1
+
+        keys[slot] = key
+        self.scores[slot] = score
+        infos[slot] = info